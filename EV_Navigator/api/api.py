@@ -1,13 +1,43 @@
 # Import necessary libraries and modules
-from fastapi import FastAPI, Body, HTTPException
+from fastapi import FastAPI, Body, HTTPException, Request, Response
 from pydantic import BaseModel, Field
+from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
-import requests
+from fastapi.responses import StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+import contextvars
+import httpx
+import json
 import logging
 import os
+import re
+import time
+import uuid
 
-# Initialize logging with INFO level
-logging.basicConfig(level=logging.INFO)
+# Header carrying the request ID, passed on to the navigator and echoed back on every response
+REQUEST_ID_HEADER = "X-Request-ID"
+# Incoming request IDs are only reused if they are short and printable, otherwise a new one is generated
+VALID_REQUEST_ID = re.compile(r"^[\w.:-]{1,128}$")
+request_id_var = contextvars.ContextVar("request_id", default="-")
+# Header telling the navigator how many seconds the gateway waits for it, so it can give up on slow lookups in time
+DEADLINE_HEADER = "X-Request-Deadline"
+
+_record_factory = logging.getLogRecordFactory()
+
+
+def request_log_record(*args, **kwargs):
+    # Every log record carries the ID of the request it was logged for, unless another factory already set one
+    record = _record_factory(*args, **kwargs)
+    request_id = request_id_var.get()
+    if request_id != "-" or not hasattr(record, "request_id"):
+        record.request_id = request_id
+    return record
+
+
+logging.setLogRecordFactory(request_log_record)
+
+# Initialize logging with INFO level, including the request ID in every line
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:[%(request_id)s] %(message)s")
 
 # Create a FastAPI instance
 app = FastAPI()
@@ -21,9 +51,210 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", REQUEST_ID_HEADER],
 )
 
-# Define Pydantic model for input data validation
+# Navigator service endpoint URL, as configured in docker-compose.yml
+NAVIGATOR_URL = os.getenv('NAVIGATOR_URL', 'http://navigator:8001/calculate_route')
+# Navigator batch endpoint, derived from NAVIGATOR_URL unless configured explicitly
+NAVIGATOR_BATCH_URL = os.getenv('NAVIGATOR_BATCH_URL', NAVIGATOR_URL.rstrip('/') + 's')
+# Navigator what-if endpoint, on the same host as NAVIGATOR_URL unless configured explicitly
+NAVIGATOR_WHAT_IF_URL = os.getenv('NAVIGATOR_WHAT_IF_URL', NAVIGATOR_URL.rsplit('/', 1)[0] + '/what_if')
+# Navigator streaming endpoint, derived from NAVIGATOR_URL unless configured explicitly
+NAVIGATOR_STREAM_URL = os.getenv('NAVIGATOR_STREAM_URL', NAVIGATOR_URL.rstrip('/') + '/stream')
+# Navigator charging plan endpoint, on the same host as NAVIGATOR_URL unless configured explicitly
+NAVIGATOR_PLAN_URL = os.getenv('NAVIGATOR_PLAN_URL', NAVIGATOR_URL.rsplit('/', 1)[0] + '/plan_route')
+
+# Connection pool sizing towards the navigator service
+NAVIGATOR_MAX_CONNECTIONS = int(os.getenv('NAVIGATOR_MAX_CONNECTIONS', '200'))
+NAVIGATOR_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('NAVIGATOR_MAX_KEEPALIVE_CONNECTIONS', '50'))
+NAVIGATOR_KEEPALIVE_EXPIRY = float(os.getenv('NAVIGATOR_KEEPALIVE_EXPIRY', '30'))
+
+# Per-request timeouts (in seconds) for calls to the navigator service
+NAVIGATOR_CONNECT_TIMEOUT = float(os.getenv('NAVIGATOR_CONNECT_TIMEOUT', '5'))
+NAVIGATOR_READ_TIMEOUT = float(os.getenv('NAVIGATOR_READ_TIMEOUT', '60'))
+NAVIGATOR_POOL_TIMEOUT = float(os.getenv('NAVIGATOR_POOL_TIMEOUT', '10'))
+# Batches take longer than single trips, so they get their own read timeout
+NAVIGATOR_BATCH_READ_TIMEOUT = float(os.getenv('NAVIGATOR_BATCH_READ_TIMEOUT', '300'))
+
+# Latency buckets (in seconds), wide enough to tell a slow navigator call from a slow gateway
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+# Prometheus metrics of the gateway and of its calls to the navigator
+REQUESTS = Counter("gateway_requests_total", "Requests handled by the gateway", ["endpoint", "status"])
+REQUEST_LATENCY = Histogram("gateway_request_duration_seconds", "Time to answer a request", ["endpoint"], buckets=LATENCY_BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge("gateway_requests_in_flight", "Requests being handled", ["endpoint"], multiprocess_mode="livesum")
+NAVIGATOR_LATENCY = Histogram(
+    "gateway_navigator_request_duration_seconds", "Time until the navigator answered (headers only for streams)",
+    ["endpoint"], buckets=LATENCY_BUCKETS,
+)
+NAVIGATOR_ERRORS = Counter("gateway_navigator_errors_total", "Failed calls to the navigator", ["endpoint", "kind"])
+NAVIGATOR_IN_FLIGHT = Gauge(
+    "gateway_navigator_requests_in_flight", "Calls to the navigator waiting for an answer",
+    ["endpoint"], multiprocess_mode="livesum",
+)
+
+# Shared HTTP client holding the keep-alive connection pool to the navigator
+navigator_client = None
+
+
+@app.on_event("startup")
+async def open_navigator_client():
+    global navigator_client
+    navigator_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(
+            NAVIGATOR_READ_TIMEOUT,
+            connect=NAVIGATOR_CONNECT_TIMEOUT,
+            pool=NAVIGATOR_POOL_TIMEOUT,
+        ),
+        limits=httpx.Limits(
+            max_connections=NAVIGATOR_MAX_CONNECTIONS,
+            max_keepalive_connections=NAVIGATOR_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=NAVIGATOR_KEEPALIVE_EXPIRY,
+        ),
+    )
+    logging.info(
+        f"Navigator client ready for {NAVIGATOR_URL} "
+        f"(max_connections={NAVIGATOR_MAX_CONNECTIONS}, max_keepalive={NAVIGATOR_MAX_KEEPALIVE_CONNECTIONS})"
+    )
+
+
+@app.on_event("shutdown")
+async def close_navigator_client():
+    if navigator_client is not None:
+        await navigator_client.aclose()
+
+
+# Assign every request an ID (the caller's, if it sent a valid one) and record request metrics
+@app.middleware("http")
+async def track_request(request: Request, call_next):
+    request_id = request.headers.get(REQUEST_ID_HEADER, "")
+    request_id_var.set(request_id if VALID_REQUEST_ID.match(request_id) else uuid.uuid4().hex)
+    endpoint = request.url.path if request.url.path in {route.path for route in app.routes} else "other"
+    started = time.perf_counter()
+    REQUESTS_IN_FLIGHT.labels(endpoint).inc()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        REQUESTS_IN_FLIGHT.labels(endpoint).dec()
+        REQUESTS.labels(endpoint, str(status)).inc()
+        REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - started)
+    response.headers[REQUEST_ID_HEADER] = request_id_var.get()
+    return response
+
+
+async def send_to_navigator(endpoint, url, payload, timeout=None, stream=False):
+
+    """
+    POST a payload to the navigator under the current request ID and deadline, recording latency, errors and
+    in-flight calls.
+
+    Args:
+    endpoint (str): Metric label of the navigator endpoint, e.g. "calculate_route".
+    url (str): The navigator URL.
+    payload (dict): The JSON body.
+    timeout (httpx.Timeout): Optional timeout replacing the client default.
+    stream (bool): Return as soon as the headers arrived, leaving the body to be streamed.
+
+    Returns:
+    httpx.Response: The navigator's response.
+    """
+
+    options = {} if timeout is None else {"timeout": timeout}
+    headers = {
+        REQUEST_ID_HEADER: request_id_var.get(),
+        DEADLINE_HEADER: f"{timeout.read if timeout is not None else NAVIGATOR_READ_TIMEOUT:.3f}",
+    }
+    request = navigator_client.build_request("POST", url, json=payload, headers=headers, **options)
+    NAVIGATOR_IN_FLIGHT.labels(endpoint).inc()
+    started = time.perf_counter()
+    try:
+        response = await navigator_client.send(request, stream=stream)
+    except httpx.TimeoutException:
+        NAVIGATOR_ERRORS.labels(endpoint, "timeout").inc()
+        raise
+    except httpx.HTTPError:
+        NAVIGATOR_ERRORS.labels(endpoint, "error").inc()
+        raise
+    finally:
+        NAVIGATOR_LATENCY.labels(endpoint).observe(time.perf_counter() - started)
+        NAVIGATOR_IN_FLIGHT.labels(endpoint).dec()
+    if response.status_code >= 500:
+        NAVIGATOR_ERRORS.labels(endpoint, "status").inc()
+    return response
+
+
+async def call_navigator(endpoint, url, payload, timeout=None, stream=False):
+
+    """
+    POST a payload to the navigator with send_to_navigator and turn every failure into the gateway's HTTP error.
+
+    Args:
+    endpoint (str): Metric label of the navigator endpoint, e.g. "calculate_route".
+    url (str): The navigator URL.
+    payload (dict): The JSON body.
+    timeout (httpx.Timeout): Optional timeout replacing the client default.
+    stream (bool): Return as soon as the headers arrived, leaving the body to be streamed.
+
+    Returns:
+    httpx.Response: The navigator's successful response.
+
+    Raises HTTPException with the navigator's own status code and message when it reports an error, (504) when it
+    times out, (503) when it cannot be reached and (500) on any other error.
+    """
+
+    try:
+        response = await send_to_navigator(endpoint, url, payload, timeout=timeout, stream=stream)
+    except httpx.TimeoutException as timeout_exc:
+        logging.error(f"Request to navigator {endpoint} timed out: {timeout_exc}")
+        raise HTTPException(status_code=504, detail="Navigator service timed out")
+    except httpx.HTTPError as req_exc:
+        logging.error(f"Request to navigator {endpoint} failed: {req_exc}")
+        raise HTTPException(status_code=503, detail="Navigator service unavailable")
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if response.status_code != 200:
+        # Forward errors reported by the navigator service; a streamed body is read in full first
+        try:
+            detail = (await response.aread()).decode(errors="replace")
+        finally:
+            await response.aclose()
+        raise HTTPException(status_code=response.status_code, detail=detail)
+    return response
+
+
+# Endpoint exposing gateway metrics in the Prometheus text format
+@app.get("/metrics")
+async def metrics():
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Combine the metrics of every worker process
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+def server_timing(navigator_response, started):
+
+    """
+    Combine the stage timings reported by the navigator with the total time spent in the gateway.
+
+    Args:
+    navigator_response (httpx.Response): The navigator's response, carrying its Server-Timing header.
+    started (float): time.perf_counter() value taken when the gateway received the request.
+
+    Returns:
+    str: A Server-Timing header value.
+    """
+
+    stages = [navigator_response.headers.get("server-timing", ""), f"gateway;dur={(time.perf_counter() - started) * 1000:.1f}"]
+    return ", ".join(stage for stage in stages if stage)
+
 class EVInputData(BaseModel):
     origin_location: str
     destination_location: str
@@ -32,30 +263,94 @@ class EVInputData(BaseModel):
     initial_SOC: float = Field(..., ge=0, le=100)  # Range 0-100%
     fast_charging_priority: bool = False
 
+# Define Pydantic model for a batch of trips
+class EVBatchInputData(BaseModel):
+    trips: List[EVInputData]
+
+# Define Pydantic model for recomputing a computed trip with another EV model or initial SOC
+class EVWhatIfData(BaseModel):
+    trip_context_id: str
+    ev_model: str
+    initial_SOC: float = Field(..., ge=0, le=100)  # Range 0-100%
+
+# Define Pydantic model for planning the charging stops of a trip beyond the EV's range
+class EVPlanData(BaseModel):
+    origin_location: str
+    destination_location: str
+    ev_model: str
+    initial_SOC: float = Field(..., ge=0, le=100)  # Range 0-100%
+    fast_charging_priority: bool = False
+    corridor_km: Optional[float] = Field(None, gt=0, le=50)  # Maximum distance of a stop from the route
+    min_arrival_SOC: Optional[float] = Field(None, ge=0, le=50)  # SOC kept at every stop and at the destination
+
 # Endpoint to process EV routing data
 @app.post("/process_data")
-async def process_data(data: EVInputData = Body(...)):
-    try:
-        # Convert input data to JSON
-        json_data = data.dict()
-        
-        # Navigator service endpoint URL
-        navigator_url = "http://navigator:8001/calculate_route"
-        
-        # Make a POST request to navigator service
-        response = requests.post(navigator_url, json=json_data)
-        
-        # Handle response
-        if response.status_code == 200:
-            station_results = response.json()
-            return {"message": "Data processed successfully", "charging_stations": station_results}
-        else:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-    
-    except requests.RequestException as req_exc:
-        logging.error(f"Request failed: {req_exc}")
-        raise HTTPException(status_code=503, detail="Navigator service unavailable")
-    
-    except Exception as e:
-        logging.error(f"An error occurred: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+async def process_data(gateway_response: Response, data: EVInputData = Body(...)):
+    started = time.perf_counter()
+    # Make a non-blocking POST request to navigator service over the shared connection pool
+    response = await call_navigator("calculate_route", NAVIGATOR_URL, data.dict())
+    station_results = response.json()
+    gateway_response.headers["Server-Timing"] = server_timing(response, started)
+    return {"message": "Data processed successfully", "charging_stations": station_results}
+
+
+# Endpoint to process many EV trips in a single call
+@app.post("/process_batch")
+async def process_batch(gateway_response: Response, data: EVBatchInputData = Body(...)):
+    started = time.perf_counter()
+    # Forward the whole batch so the navigator can share identical lookups across trips
+    response = await call_navigator(
+        "calculate_routes",
+        NAVIGATOR_BATCH_URL,
+        data.dict(),
+        timeout=httpx.Timeout(
+            NAVIGATOR_BATCH_READ_TIMEOUT,
+            connect=NAVIGATOR_CONNECT_TIMEOUT,
+            pool=NAVIGATOR_POOL_TIMEOUT,
+        ),
+    )
+    gateway_response.headers["Server-Timing"] = server_timing(response, started)
+    return response.json()
+
+
+# Endpoint to compare another EV model or initial SOC on an already computed trip
+@app.post("/what_if")
+async def what_if(data: EVWhatIfData = Body(...)):
+    response = await call_navigator("what_if", NAVIGATOR_WHAT_IF_URL, data.dict())
+    return response.json()
+
+
+# Endpoint to plan the charging stops of a trip beyond the EV's range
+@app.post("/plan_route")
+async def plan_route(gateway_response: Response, data: EVPlanData = Body(...)):
+    started = time.perf_counter()
+    # Unset options fall back to the navigator's defaults
+    response = await call_navigator("plan_route", NAVIGATOR_PLAN_URL, data.dict(exclude_none=True))
+    gateway_response.headers["Server-Timing"] = server_timing(response, started)
+    return response.json()
+
+
+# Endpoint relaying charging station results as the navigator computes them
+@app.post("/process_data/stream")
+async def process_data_stream(data: EVInputData = Body(...)):
+    # Open the streamed request; only the status line and headers are read here, and errors raised before the first
+    # record are forwarded like on /process_data
+    response = await call_navigator("calculate_route_stream", NAVIGATOR_STREAM_URL, data.dict(), stream=True)
+
+    async def relay():
+        # Chunks are passed through as they arrive instead of being collected first
+        last_byte = b"\n"
+        try:
+            async for chunk in response.aiter_raw():
+                if chunk:
+                    last_byte = chunk[-1:]
+                yield chunk
+        except httpx.HTTPError as req_exc:
+            logging.error(f"Stream from navigator interrupted: {req_exc}")
+            # Tell the client the results are incomplete, on a line of its own even if a record was cut short
+            record = json.dumps({"type": "error", "detail": "Navigator service unavailable, the results are incomplete"})
+            yield (b"" if last_byte == b"\n" else b"\n") + record.encode() + b"\n"
+        finally:
+            await response.aclose()
+
+    return StreamingResponse(relay(), media_type=response.headers.get("content-type", "application/x-ndjson"))
@@ -0,0 +1,188 @@
+# Local stand-ins for the navigator's external providers, with realistic response shapes and latency
+import asyncio
+import hashlib
+import math
+import os
+import random
+
+from fastapi import FastAPI, Request
+
+# Median latency (in milliseconds) and log-normal spread of each fake provider, loosely based on production traces
+LATENCY_PROFILES = {
+    "nominatim": (250, 0.5),
+    "ocm": (450, 0.6),
+    "open_meteo": (120, 0.4),
+    "bing_routes": (300, 0.5),
+    "bing_elevation": (180, 0.4),
+    "bing_distance_matrix": (350, 0.5),
+}
+
+# Factor applied to every latency; 0 turns the fake providers into instant responders
+FAKE_LATENCY_SCALE = float(os.getenv("FAKE_LATENCY_SCALE", "1"))
+# Seed for latencies and generated data, so runs can be compared
+FAKE_SEED = int(os.getenv("FAKE_SEED", "0"))
+# Area (south, west, north, east) in which fake addresses are placed
+FAKE_AREA = tuple(float(value) for value in os.getenv("FAKE_AREA", "40.0,-4.2,40.9,-3.2").split(","))
+
+app = FastAPI()
+_random = random.Random(FAKE_SEED)
+calls = {name: 0 for name in LATENCY_PROFILES}
+
+
+async def simulate_latency(provider):
+
+    """
+    Count the call and wait for a latency drawn from the provider's log-normal profile.
+    """
+
+    calls[provider] += 1
+    median_ms, sigma = LATENCY_PROFILES[provider]
+    if FAKE_LATENCY_SCALE > 0:
+        await asyncio.sleep(_random.lognormvariate(math.log(median_ms), sigma) * FAKE_LATENCY_SCALE / 1000)
+
+
+def seeded(*values):
+
+    """
+    Return a random generator determined only by values, so the same request always gets the same data.
+    """
+
+    digest = hashlib.sha1(repr((FAKE_SEED,) + values).encode("utf-8")).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_point(value):
+    latitude, longitude = value.split(",")[:2]
+    return float(latitude), float(longitude)
+
+
+@app.get("/nominatim/search")
+async def nominatim_search(q: str):
+    await simulate_latency("nominatim")
+    rng = seeded("address", q.strip().casefold())
+    south, west, north, east = FAKE_AREA
+    latitude, longitude = rng.uniform(south, north), rng.uniform(west, east)
+    return [{
+        "place_id": rng.randrange(10 ** 8),
+        "lat": f"{latitude:.7f}",
+        "lon": f"{longitude:.7f}",
+        "display_name": q,
+        "boundingbox": [f"{latitude - 0.01:.7f}", f"{latitude + 0.01:.7f}", f"{longitude - 0.01:.7f}", f"{longitude + 0.01:.7f}"],
+        "class": "place",
+        "type": "city",
+        "importance": 0.5,
+    }]
+
+
+@app.get("/ocm/poi/")
+async def ocm_poi(latitude: float, longitude: float, distance: float = 10, maxresults: int = 10):
+    await simulate_latency("ocm")
+    rng = seeded("stations", round(latitude, 3), round(longitude, 3), distance)
+    stations = []
+    for station_id in range(min(maxresults, 200)):
+        bearing = rng.uniform(0, 2 * math.pi)
+        offset_km = distance * math.sqrt(rng.random())
+        station_latitude = latitude + offset_km * math.cos(bearing) / 111.32
+        station_longitude = longitude + offset_km * math.sin(bearing) / (111.32 * math.cos(math.radians(latitude)))
+        stations.append({
+            "ID": rng.randrange(10 ** 7),
+            "UsageCost": rng.choice(["Free", "0.39 EUR/kWh", "0.59 EUR/kWh", None]),
+            "DateLastStatusUpdate": "2024-01-01T00:00:00Z",
+            "AddressInfo": {
+                "Title": f"Fake Station {station_id}",
+                "Latitude": station_latitude,
+                "Longitude": station_longitude,
+                "Distance": offset_km,
+                "DistanceUnit": 1,
+            },
+            "OperatorInfo": {"Title": rng.choice(["Iberdrola", "Endesa X", "Tesla", "Ionity"])},
+            "UsageType": {"Title": "Public"},
+            "Connections": [
+                {
+                    "ConnectionType": {"Title": rng.choice(["Type 2 (Socket Only)", "CCS (Type 2)", "CHAdeMO"])},
+                    "PowerKW": rng.choice([11, 22, 50, 150]),
+                }
+                for _ in range(rng.randint(1, 4))
+            ],
+        })
+    stations.sort(key=lambda station: station["AddressInfo"]["Distance"])
+    return stations
+
+
+@app.get("/open_meteo/forecast")
+async def open_meteo_forecast(latitude: str, longitude: str):
+    await simulate_latency("open_meteo")
+    points = list(zip(latitude.split(","), longitude.split(",")))
+    readings = [
+        {
+            "latitude": float(point_latitude),
+            "longitude": float(point_longitude),
+            "current_weather": {
+                "temperature": round(seeded("temperature", point_latitude, point_longitude).uniform(-2, 28), 1),
+                "windspeed": 10.0,
+                "weathercode": 1,
+            },
+        }
+        for point_latitude, point_longitude in points
+    ]
+    return readings if len(readings) > 1 else readings[0]
+
+
+def route_resource(origin, destination, mode):
+    straight_km = haversine_km(*origin, *destination)
+    if mode == "Walking":
+        distance = straight_km * 1.3
+        return {"travelDistance": distance, "travelDuration": distance / 5 * 3600, "travelMode": "Walking"}
+
+    rng = seeded("route", origin, destination)
+    distance = straight_km * rng.uniform(1.15, 1.45)
+    road_types = ["LimitedAccessHighway", "Highway", "Ramp", "Arterial", "MajorRoad", "Street", "LocalRoad"]
+    weights = [rng.random() for _ in road_types]
+    items = [
+        {"travelDistance": distance * weight / sum(weights), "details": [{"mode": "Driving", "roadType": road_type}]}
+        for road_type, weight in zip(road_types, weights)
+    ]
+    return {
+        "travelDistance": distance,
+        "travelDuration": distance / rng.uniform(55, 95) * 3600,
+        "trafficCongestion": rng.choice(["None", "Mild", "Medium", "Heavy"]),
+        "travelMode": "Driving",
+        "routeLegs": [{"itineraryItems": items}],
+    }
+
+
+@app.get("/bing/Routes/{mode}")
+async def bing_routes(mode: str, request: Request):
+    params = request.query_params
+    if mode.casefold() == "distancematrix":
+        await simulate_latency("bing_distance_matrix")
+        destination = parse_point(params["destinations"].split(";")[0])
+        results = []
+        for index, origin in enumerate(params["origins"].split(";")):
+            distance = haversine_km(*parse_point(origin), *destination) * 1.3
+            results.append({"originIndex": index, "destinationIndex": 0, "travelDistance": distance, "travelDuration": distance / 5 * 60})
+        return {"resourceSets": [{"resources": [{"results": results}]}]}
+
+    await simulate_latency("bing_routes")
+    walking = mode.casefold() == "walking"
+    resource = route_resource(parse_point(params["wp.0"]), parse_point(params["wp.1"]), "Walking" if walking else "Driving")
+    return {"resourceSets": [{"resources": [resource]}], "statusCode": 200}
+
+
+@app.get("/bing/Elevation/List")
+async def bing_elevation(points: str):
+    await simulate_latency("bing_elevation")
+    values = [float(value) for value in points.split(",")]
+    elevations = [round(seeded("elevation", round(lat, 3), round(lon, 3)).uniform(0, 900)) for lat, lon in zip(values[::2], values[1::2])]
+    return {"resourceSets": [{"resources": [{"elevations": elevations, "zoomLevel": 12}]}], "statusCode": 200}
+
+
+@app.get("/calls")
+async def call_counts():
+    return calls
@@ -0,0 +1,35 @@
+# Navigator app for benchmarks: the EV catalog is read from init.sql instead of MySQL
+import ast
+import os
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+NAVIGATOR_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "navigator")
+INIT_SQL_PATH = os.path.join(os.path.dirname(BENCHMARKS_DIR), "init.sql")
+
+if NAVIGATOR_DIR not in sys.path:
+    sys.path.insert(0, NAVIGATOR_DIR)
+
+import main  # noqa: E402
+
+
+def read_init_sql_rows(path=INIT_SQL_PATH):
+
+    """
+    Read the ev_data rows inserted by init.sql, in the column order expected by EVSpec.from_row.
+
+    Returns:
+    list: One tuple per EV model.
+    """
+
+    with open(path, encoding="utf-8") as f:
+        script = f.read()
+    statement = "INSERT INTO `ev_data` VALUES"
+    values = script[script.index(statement) + len(statement):]
+    values = values[:values.index(";")]
+    return list(ast.literal_eval("[" + values.replace("NULL", "None") + "]"))
+
+
+main.ev_catalog.loader = read_init_sql_rows
+main.ev_catalog.row_loader = None
+app = main.app
@@ -0,0 +1,388 @@
+# End-to-end load and latency benchmark of /process_data -> /calculate_route against local fake providers
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "api")
+
+# EV models used by generated trips; all present in init.sql with the weight and discharge rates the SoC needs
+DEFAULT_MODELS = ["Nissan Leaf", "Tesla Model S Plaid", "BMW i4 eDrive40", "Tesla Model 3 Long Range Dual Motor"]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the EV Navigator end-to-end load and latency benchmark.")
+    parser.add_argument("--mode", choices=("inprocess", "processes"), default="inprocess",
+                        help="run the services as threads of this process or as separate uvicorn processes")
+    parser.add_argument("--target", choices=("gateway", "navigator"), default="gateway",
+                        help="send trips to the gateway's /process_data or directly to the navigator's /calculate_route")
+    parser.add_argument("--navigator-workers", type=int, default=1,
+                        help="worker processes of the navigator (processes mode only)")
+    parser.add_argument("--requests", type=int, default=200, help="number of measured requests")
+    parser.add_argument("--concurrency", type=int, default=20, help="number of requests in flight at the same time")
+    parser.add_argument("--warmup", type=int, default=10, help="requests sent before measuring")
+    parser.add_argument("--unique-trips", type=int, default=50, help="number of distinct trips the requests are drawn from")
+    parser.add_argument("--models", default=",".join(DEFAULT_MODELS), help="comma-separated EV models used by the trips")
+    parser.add_argument("--max-radius", type=float, default=10, help="station search radius of every trip (km)")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="factor applied to the fake provider latencies")
+    parser.add_argument("--seed", type=int, default=0, help="seed for generated trips and fake provider data")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.15,
+                        help="allowed relative increase of any latency percentile or stage p95 before failing")
+    return parser.parse_args(argv)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def service_environment(work_dir, upstream_port, navigator_port, latency_scale, seed):
+
+    """
+    Build the environment pointing the navigator at the fake providers and the gateway at the navigator.
+    """
+
+    upstream = f"127.0.0.1:{upstream_port}"
+    return {
+        "FAKE_LATENCY_SCALE": str(latency_scale),
+        "FAKE_SEED": str(seed),
+        "NOMINATIM_DOMAIN": f"{upstream}/nominatim",
+        "NOMINATIM_SCHEME": "http",
+        # The fake Nominatim has no usage policy to respect
+        "PROVIDER_RATE_NOMINATIM": "1000",
+        "PROVIDER_BURST_NOMINATIM": "1000",
+        "OCM_URL": f"http://{upstream}/ocm/poi/",
+        "OPEN_METEO_URL": f"http://{upstream}/open_meteo/forecast",
+        "BING_MAPS_URL": f"http://{upstream}/bing",
+        "PROVIDER_MODE": "live",
+        "GEOCODE_CACHE_PATH": os.path.join(work_dir, "geocode.sqlite3"),
+        "STATION_MIRROR_PATH": os.path.join(work_dir, "stations.sqlite3"),
+        "STATION_SYNC_SECONDS": "0",
+        "LEG_CACHE_BACKEND": "memory",
+        "LEG_CACHE_PATH": os.path.join(work_dir, "legs.sqlite3"),
+        "TRIP_CONTEXT_PATH": os.path.join(work_dir, "trip_contexts.sqlite3"),
+        "EV_CATALOG_REFRESH_SECONDS": "0",
+        "NAVIGATOR_URL": f"http://127.0.0.1:{navigator_port}/calculate_route",
+    }
+
+
+class ThreadedServer(uvicorn.Server):
+
+    """
+    uvicorn server running on its own event loop in a background thread.
+    """
+
+    def install_signal_handlers(self):
+        pass
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        while not self.started:
+            time.sleep(0.05)
+
+    def stop(self):
+        self.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def start_inprocess(environment, ports):
+
+    """
+    Import the fake providers, the navigator and the gateway into this process and serve each from a thread.
+
+    Returns:
+    tuple: A function stopping the services and a function returning the fake provider call counters.
+    """
+
+    os.environ.update(environment)
+    sys.path.insert(0, BENCHMARKS_DIR)
+    sys.path.insert(0, API_DIR)
+    import fake_upstreams
+    import offline_navigator
+    import api
+
+    servers = [
+        ThreadedServer(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        for app, port in ((fake_upstreams.app, ports["upstream"]), (offline_navigator.app, ports["navigator"]), (api.app, ports["gateway"]))
+    ]
+    for server in servers:
+        server.start()
+
+    def stop():
+        for server in reversed(servers):
+            server.stop()
+
+    return stop, lambda: dict(fake_upstreams.calls)
+
+
+def wait_until_ready(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/openapi.json", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Service on port {port} did not start within {timeout} seconds")
+
+
+def start_processes(environment, ports, navigator_workers=1):
+
+    """
+    Start the fake providers, the navigator and the gateway as separate uvicorn processes, the navigator with
+    navigator_workers worker processes.
+
+    Returns:
+    tuple: A function stopping the services and a function returning the fake provider call counters.
+    """
+
+    env = dict(os.environ, **environment)
+    commands = [
+        ("fake_upstreams:app", ports["upstream"], BENCHMARKS_DIR, 1),
+        ("offline_navigator:app", ports["navigator"], BENCHMARKS_DIR, navigator_workers),
+        ("api:app", ports["gateway"], API_DIR, 1),
+    ]
+    processes = []
+    for app, port, cwd, workers in commands:
+        # The navigator reads WEB_CONCURRENCY to split per-service limits between its workers
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+             "--workers", str(workers)],
+            cwd=cwd, env=dict(env, WEB_CONCURRENCY=str(workers)),
+        ))
+        wait_until_ready(port)
+
+    def stop():
+        for process in reversed(processes):
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+    return stop, lambda: httpx.get(f"http://127.0.0.1:{ports['upstream']}/calls").json()
+
+
+def generate_trips(count, unique_trips, models, max_radius, seed):
+
+    """
+    Build the request bodies, drawn from a fixed set of distinct trips so caches behave as with real traffic.
+    """
+
+    rng = random.Random(seed)
+    distinct = [
+        {
+            "origin_location": f"Benchmark origin {rng.randrange(unique_trips)}",
+            "destination_location": f"Benchmark destination {rng.randrange(unique_trips)}",
+            "max_radius": max_radius,
+            "ev_model": rng.choice(models),
+            "initial_SOC": rng.choice([40, 60, 80, 95]),
+        }
+        for _ in range(unique_trips)
+    ]
+    return [rng.choice(distinct) for _ in range(count)]
+
+
+def parse_server_timing(header):
+
+    """
+    Parse a Server-Timing header into {stage: (milliseconds, count)}.
+    """
+
+    stages = {}
+    for entry in filter(None, (part.strip() for part in (header or "").split(","))):
+        name, *fields = entry.split(";")
+        duration, count = 0.0, 1
+        for field in fields:
+            key, _, value = field.strip().partition("=")
+            if key == "dur":
+                duration = float(value)
+            elif key == "desc":
+                count = int(value.strip('"') or 1)
+        stages[name.strip()] = (duration, count)
+    return stages
+
+
+async def drive_load(url, trips, concurrency):
+
+    """
+    Send every trip with at most concurrency requests in flight.
+
+    Returns:
+    tuple: Per-request (latency seconds, status code, stage timings) results and the wall-clock duration.
+    """
+
+    results = []
+    queue = iter(trips)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=300) as client:
+
+        async def worker():
+            for trip in queue:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(url, json=trip)
+                    status, header = response.status_code, response.headers.get("server-timing")
+                except httpx.HTTPError:
+                    status, header = 0, None
+                results.append((time.perf_counter() - started, status, parse_server_timing(header)))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return results, time.perf_counter() - started
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(results, duration):
+
+    """
+    Aggregate per-request results into latency percentiles, throughput and per-stage timings.
+    """
+
+    latencies = [latency * 1000 for latency, status, _ in results if status == 200]
+    status_codes = {}
+    for _, status, _ in results:
+        status_codes[str(status)] = status_codes.get(str(status), 0) + 1
+
+    stage_values = {}
+    for _, status, stages in results:
+        if status != 200:
+            continue
+        for stage, (milliseconds, count) in stages.items():
+            stage_values.setdefault(stage, []).append((milliseconds, count))
+
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(latencies),
+        "status_codes": status_codes,
+        "duration_s": round(duration, 3),
+        "requests_per_second": round(len(results) / duration, 2) if duration else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "max": max(latencies) if latencies else None,
+        },
+        "stages": {
+            stage: {
+                "requests": len(values),
+                "p50_ms": percentile([milliseconds for milliseconds, _ in values], 0.50),
+                "p95_ms": percentile([milliseconds for milliseconds, _ in values], 0.95),
+                "mean_ms": sum(milliseconds for milliseconds, _ in values) / len(values),
+                "mean_count": sum(count for _, count in values) / len(values),
+            }
+            for stage, values in sorted(stage_values.items())
+        },
+    }
+
+
+def find_regressions(report, baseline, max_regression, min_delta_ms=5.0):
+
+    """
+    List the latency percentiles and stage p95 values that grew by more than max_regression since the baseline.
+
+    Differences below min_delta_ms are ignored so that near-zero stages do not fail the comparison on noise.
+    """
+
+    pairs = [(f"latency_ms.{name}", report["latency_ms"].get(name), baseline.get("latency_ms", {}).get(name)) for name in ("p50", "p95", "p99")]
+    for stage, values in report["stages"].items():
+        pairs.append((f"stages.{stage}.p95_ms", values["p95_ms"], baseline.get("stages", {}).get(stage, {}).get("p95_ms")))
+
+    regressions = []
+    for name, current, previous in pairs:
+        if current is None or not previous:
+            continue
+        if current > previous * (1 + max_regression) and current - previous > min_delta_ms:
+            regressions.append({"metric": name, "baseline": previous, "current": current, "change": current / previous - 1})
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.navigator_workers > 1 and args.mode != "processes":
+        sys.exit("--navigator-workers requires --mode processes")
+    models = [model.strip() for model in args.models.split(",") if model.strip()]
+    ports = {"upstream": free_port(), "navigator": free_port(), "gateway": free_port()}
+
+    with tempfile.TemporaryDirectory(prefix="ev-navigator-benchmark-") as work_dir:
+        environment = service_environment(work_dir, ports["upstream"], ports["navigator"], args.latency_scale, args.seed)
+        if args.navigator_workers > 1:
+            # Workers share analyzed legs and trip contexts through SQLite, as in a multi-worker deployment
+            environment.update(LEG_CACHE_BACKEND="disk", TRIP_CONTEXT_BACKEND="disk")
+        if args.mode == "inprocess":
+            stop, upstream_calls = start_inprocess(environment, ports)
+        else:
+            stop, upstream_calls = start_processes(environment, ports, args.navigator_workers)
+        try:
+            if args.target == "gateway":
+                url = f"http://127.0.0.1:{ports['gateway']}/process_data"
+            else:
+                url = f"http://127.0.0.1:{ports['navigator']}/calculate_route"
+            trips = generate_trips(args.warmup + args.requests, args.unique_trips, models, args.max_radius, args.seed)
+            if args.warmup:
+                asyncio.run(drive_load(url, trips[:args.warmup], args.concurrency))
+            calls_before = upstream_calls()
+            results, duration = asyncio.run(drive_load(url, trips[args.warmup:], args.concurrency))
+            calls_after = upstream_calls()
+        finally:
+            stop()
+
+    report = {
+        "config": {
+            "mode": args.mode,
+            "target": args.target,
+            "navigator_workers": args.navigator_workers,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "unique_trips": args.unique_trips,
+            "models": models,
+            "max_radius": args.max_radius,
+            "latency_scale": args.latency_scale,
+            "seed": args.seed,
+        },
+        **summarize(results, duration),
+        "upstream_calls": {name: calls_after[name] - calls_before.get(name, 0) for name in calls_after},
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["regressions"] = find_regressions(report, json.load(f), args.max_regression)
+        exit_code = 1 if report["regressions"] else 0
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+-- Migrate 'ev_data' from text values with units ('118.0 kWh', '184 Wh/km') to typed, indexed columns
+-- Run once against an existing database; fresh databases run it automatically after init.sql
+USE ev_database;
+
+-- Create the typed table with a primary key and a unique, normalized model key
+CREATE TABLE IF NOT EXISTS ev_data_typed (
+  id INT UNSIGNED NOT NULL AUTO_INCREMENT,
+  EV_model VARCHAR(255) NOT NULL,
+  -- Normalized model name the navigator looks models up by, computed from EV_model on every insert and update so it
+  -- is never missing; keep it in step with ev_catalog.normalize_model_name (hyphens and whitespace runs become one
+  -- hyphen, lowercase)
+  model_key VARCHAR(255) AS (LOWER(REPLACE(TRIM(
+    REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(
+      REPLACE(REPLACE(REPLACE(REPLACE(EV_model, '-', ' '), '\t', ' '), '\n', ' '), '\r', ' '),
+    '  ', ' '), '  ', ' '), '  ', ' '), '  ', ' '), '  ', ' '), '  ', ' ')
+  ), ' ', '-'))) STORED NOT NULL,
+  Useable_Capacity DECIMAL(6,2) NULL,  -- kWh
+  Charge_Port VARCHAR(64) NULL,
+  Fast_charge_port VARCHAR(64) NULL,
+  charge_power DECIMAL(6,2) NULL,  -- kW (AC)
+  charge_speed DECIMAL(6,1) NULL,  -- km of range added per hour of charging
+  city_cold_rate DECIMAL(6,1) NULL,  -- Wh/km
+  highway_cold_rate DECIMAL(6,1) NULL,  -- Wh/km
+  combined_cold_rate DECIMAL(6,1) NULL,  -- Wh/km
+  city_mild_rate DECIMAL(6,1) NULL,  -- Wh/km
+  highway_mild_rate DECIMAL(6,1) NULL,  -- Wh/km
+  combined_mild_rate DECIMAL(6,1) NULL,  -- Wh/km
+  weight DECIMAL(7,1) NULL,  -- kg
+  PRIMARY KEY (id),
+  UNIQUE KEY uq_ev_data_model_key (model_key)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Copy the existing rows, keeping only the numeric part of each value
+-- Empty values become NULL; a row whose model_key repeats an earlier row's is skipped, keeping the first
+INSERT IGNORE INTO ev_data_typed (
+  EV_model, Useable_Capacity, Charge_Port, Fast_charge_port, charge_power, charge_speed,
+  city_cold_rate, highway_cold_rate, combined_cold_rate, city_mild_rate, highway_mild_rate, combined_mild_rate, weight
+)
+SELECT
+  TRIM(EV_model),
+  CAST(NULLIF(SUBSTRING_INDEX(TRIM(Useable_Capacity), ' ', 1), '') AS DECIMAL(6,2)),
+  NULLIF(TRIM(Charge_Port), ''),
+  NULLIF(TRIM(Fast_charge_port), ''),
+  CAST(NULLIF(SUBSTRING_INDEX(TRIM(charge_power), ' ', 1), '') AS DECIMAL(6,2)),
+  CAST(NULLIF(SUBSTRING_INDEX(TRIM(charge_speed), ' ', 1), '') AS DECIMAL(6,1)),
+  CAST(NULLIF(SUBSTRING_INDEX(TRIM(city_cold_rate), ' ', 1), '') AS DECIMAL(6,1)),
+  CAST(NULLIF(SUBSTRING_INDEX(TRIM(highway_cold_rate), ' ', 1), '') AS DECIMAL(6,1)),
+  CAST(NULLIF(SUBSTRING_INDEX(TRIM(combined_cold_rate), ' ', 1), '') AS DECIMAL(6,1)),
+  CAST(NULLIF(SUBSTRING_INDEX(TRIM(city_mild_rate), ' ', 1), '') AS DECIMAL(6,1)),
+  CAST(NULLIF(SUBSTRING_INDEX(TRIM(highway_mild_rate), ' ', 1), '') AS DECIMAL(6,1)),
+  CAST(NULLIF(SUBSTRING_INDEX(TRIM(combined_mild_rate), ' ', 1), '') AS DECIMAL(6,1)),
+  CAST(NULLIF(SUBSTRING_INDEX(TRIM(weight), ' ', 1), '') AS DECIMAL(7,1))
+FROM ev_data
+WHERE EV_model IS NOT NULL AND TRIM(EV_model) <> '';
+
+-- Swap the tables atomically, keeping the original data as 'ev_data_legacy'
+RENAME TABLE ev_data TO ev_data_legacy, ev_data_typed TO ev_data;
@@ -0,0 +1,70 @@
+# Coalescing of identical trip requests that are in flight at the same time
+import asyncio
+import os
+
+# Width (in SoC percentage points) of the buckets initial_SOC is grouped into; 0 only coalesces identical values
+COALESCE_SOC_BUCKET = float(os.getenv("COALESCE_SOC_BUCKET", "0"))
+
+
+class TripCoalescer:
+
+    """
+    Singleflight for whole trip computations.
+
+    The first request for a key runs the computation; requests with the same key that arrive while it is still
+    running await that same computation and receive its result (or its error). Unlike SharedLookups, a key is
+    forgotten as soon as its computation finishes, so nothing is cached beyond the burst.
+    """
+
+    def __init__(self, soc_bucket=COALESCE_SOC_BUCKET):
+        self.soc_bucket = soc_bucket
+        self._in_flight = {}
+        self.requests = 0
+        self.executed = 0
+
+    def soc_key(self, initial_SOC):
+
+        """
+        Map an initial SoC to the value used in the coalescing key.
+        """
+
+        if self.soc_bucket <= 0:
+            return initial_SOC
+        return int(initial_SOC // self.soc_bucket)
+
+    async def run(self, key, factory):
+
+        """
+        Return the result of the computation identified by key, starting it with factory() unless it is already running.
+
+        Args:
+        key (tuple): Hashable trip identity.
+        factory (callable): Returns the awaitable computing the trip.
+
+        Returns:
+        object: The computation result, shared by every concurrent request with the same key.
+        """
+
+        self.requests += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            self.executed += 1
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _, key=key: self._in_flight.pop(key, None))
+        # Shielded so that one client disconnecting does not cancel the computation for the others
+        return await asyncio.shield(task)
+
+    def stats(self):
+
+        """
+        Return how many trip requests were received, computed and coalesced, and how many are in flight.
+        """
+
+        return {
+            "requests": self.requests,
+            "executed": self.executed,
+            "coalesced": self.requests - self.executed,
+            "in_flight": len(self._in_flight),
+            "soc_bucket": self.soc_bucket,
+        }
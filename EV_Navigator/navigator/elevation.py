@@ -0,0 +1,267 @@
+# Local digital elevation model: SRTM .hgt tiles read through memory maps, with bilinear interpolation
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Directory holding SRTM .hgt tiles named after their south-west corner (e.g. N40W004.hgt); empty to use the
+# Bing Maps Elevation API
+DEM_PATH = os.getenv("DEM_PATH", "")
+# Maximum number of tiles kept memory-mapped at once
+DEM_MAX_OPEN_TILES = int(os.getenv("DEM_MAX_OPEN_TILES", "64"))
+# Meters between the points of an elevation profile sampled along a route (SRTM1 has a 30 m, SRTM3 a 90 m grid)
+ELEVATION_PROFILE_SPACING_M = float(os.getenv("ELEVATION_PROFILE_SPACING_M", "90"))
+# Rises and falls smaller than this (in meters) are treated as DEM noise when adding up the climb of a profile
+ELEVATION_CLIMB_THRESHOLD_M = float(os.getenv("ELEVATION_CLIMB_THRESHOLD_M", "3"))
+
+# Value of SRTM samples without data
+VOID = -32768
+EARTH_RADIUS_KM = 6371.0088
+
+
+def tile_name(latitude, longitude):
+
+    """
+    Return the SRTM file name of the tile whose south-west corner is at the given whole degrees.
+    """
+
+    return f"{'N' if latitude >= 0 else 'S'}{abs(latitude):02d}{'E' if longitude >= 0 else 'W'}{abs(longitude):03d}.hgt"
+
+
+class DemTile:
+
+    """
+    One SRTM tile: a square grid of big-endian 16-bit heights covering one degree, north-west corner first, whose
+    edge rows and columns overlap the neighbouring tiles.
+
+    The file is memory-mapped, so lookups read only the pages holding the requested samples.
+    """
+
+    def __init__(self, path):
+        size = os.path.getsize(path)
+        samples = math.isqrt(size // 2)
+        if samples < 2 or samples * samples * 2 != size:
+            raise ValueError(f"{path} is not a square grid of 16-bit samples")
+        self.path = path
+        self.samples = samples
+        self.heights = np.memmap(path, dtype=">i2", mode="r", shape=(samples, samples))
+
+    def interpolate(self, north, east):
+
+        """
+        Interpolate heights bilinearly.
+
+        Args:
+        north (array): Offsets of the points from the tile's southern edge, in degrees (0 to 1).
+        east (array): Offsets of the points from the tile's western edge, in degrees (0 to 1).
+
+        Returns:
+        array: Heights in meters, NaN where a surrounding sample is void.
+        """
+
+        cells = self.samples - 1
+        row = (1.0 - north) * cells
+        column = east * cells
+        top = np.clip(np.floor(row).astype(int), 0, cells - 1)
+        left = np.clip(np.floor(column).astype(int), 0, cells - 1)
+        down = row - top
+        right = column - left
+
+        corners = np.stack((
+            self.heights[top, left], self.heights[top, left + 1],
+            self.heights[top + 1, left], self.heights[top + 1, left + 1],
+        )).astype(float)
+        corners[corners == VOID] = np.nan
+        upper = corners[0] * (1 - right) + corners[1] * right
+        lower = corners[2] * (1 - right) + corners[3] * right
+        return upper * (1 - down) + lower * down
+
+
+def path_distances_km(latitudes, longitudes):
+
+    """
+    Return the cumulative great-circle distance (km) along a polyline at each of its points.
+    """
+
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    a = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+    return np.concatenate(([0.0], np.cumsum(2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a))))))
+
+
+def cumulative_climb(heights, threshold=ELEVATION_CLIMB_THRESHOLD_M):
+
+    """
+    Add up the ascent and descent along an elevation profile.
+
+    Args:
+    heights (array): Heights (m) of consecutive profile points; NaN points are skipped.
+    threshold (float): Smallest rise or fall counted, so DEM noise on flat roads does not add up.
+
+    Returns:
+    tuple: Arrays of the total ascent and total descent (m) from the first point up to each point.
+    """
+
+    ascent = np.zeros(len(heights))
+    descent = np.zeros(len(heights))
+    reference = None
+    climbed = fallen = 0.0
+    for index, height in enumerate(heights):
+        if not np.isnan(height):
+            if reference is None:
+                reference = height
+            elif height - reference >= threshold:
+                climbed += height - reference
+                reference = height
+            elif reference - height >= threshold:
+                fallen += reference - height
+                reference = height
+        ascent[index] = climbed
+        descent[index] = fallen
+    return ascent, descent
+
+
+class ElevationModel:
+
+    """
+    Elevation lookups against a directory of SRTM tiles.
+
+    Tiles are opened on first use and kept memory-mapped in an LRU of max_open_tiles; a tile missing from the
+    directory is remembered as missing until the service restarts. Points outside the available tiles get NaN,
+    so callers can fall back to the Bing Maps Elevation API for them. Thread-safe.
+    """
+
+    def __init__(self, directory=DEM_PATH, max_open_tiles=DEM_MAX_OPEN_TILES):
+        self.directory = directory
+        self.max_open_tiles = max_open_tiles
+        self._tiles = OrderedDict()  # (latitude, longitude) of the south-west corner -> DemTile, or None if missing
+        self._lock = threading.Lock()
+        self.points = 0
+        self.missing = 0
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def _tile(self, key):
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+            path = os.path.join(self.directory, tile_name(*key))
+            tile = None
+            if os.path.isfile(path):
+                try:
+                    tile = DemTile(path)
+                except (OSError, ValueError) as e:
+                    logging.error(f"Could not open elevation tile {path}: {e}")
+            self._tiles[key] = tile
+            # Evict open tiles beyond the limit; missing-tile markers cost nothing and stay
+            open_tiles = [k for k, t in self._tiles.items() if t is not None]
+            for k in open_tiles[:max(0, len(open_tiles) - self.max_open_tiles)]:
+                del self._tiles[k]
+            return tile
+
+    def elevations(self, latitudes, longitudes):
+
+        """
+        Look up the elevation of many points at once.
+
+        Args:
+        latitudes (array): Latitudes of the points.
+        longitudes (array): Longitudes of the points.
+
+        Returns:
+        array: Elevations in meters, NaN where no tile covers the point or its samples are void.
+        """
+
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+        result = np.full(latitudes.shape, np.nan)
+        if not self.enabled or not latitudes.size:
+            return result
+
+        corners = np.stack((np.floor(latitudes), np.floor(longitudes)), axis=-1).astype(int).reshape(-1, 2)
+        keys, groups = np.unique(corners, axis=0, return_inverse=True)
+        flat = result.reshape(-1)
+        for group, (latitude, longitude) in enumerate(keys):
+            tile = self._tile((int(latitude), int(longitude)))
+            if tile is None:
+                continue
+            members = np.nonzero(groups.reshape(-1) == group)[0]
+            flat[members] = tile.interpolate(latitudes.reshape(-1)[members] - latitude, longitudes.reshape(-1)[members] - longitude)
+
+        self.points += result.size
+        self.missing += int(np.isnan(result).sum())
+        return result
+
+    def elevation_change(self, origin, destination):
+
+        """
+        Return the elevation change (m) from origin to destination, two (latitude, longitude) pairs, or None if
+        either is not covered.
+        """
+
+        if not self.enabled:
+            return None
+        heights = self.elevations([origin[0], destination[0]], [origin[1], destination[1]])
+        if np.isnan(heights).any():
+            return None
+        return float(heights[1] - heights[0])
+
+    def profile(self, points, spacing_m=ELEVATION_PROFILE_SPACING_M):
+
+        """
+        Sample the elevation along a polyline.
+
+        Args:
+        points (array): (latitude, longitude) points of the polyline.
+        spacing_m (float): Distance between the samples in meters.
+
+        Returns:
+        tuple: Arrays of the distance (km) along the polyline and the elevation (m, NaN where unknown) of each sample.
+        """
+
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(points) < 2:
+            return np.zeros(len(points)), self.elevations(points[:, 0], points[:, 1])
+        distance_km = path_distances_km(points[:, 0], points[:, 1])
+        count = max(2, int(math.ceil(distance_km[-1] * 1000 / spacing_m)) + 1)
+        samples_km = np.linspace(0.0, distance_km[-1], count)
+        latitudes = np.interp(samples_km, distance_km, points[:, 0])
+        longitudes = np.interp(samples_km, distance_km, points[:, 1])
+        return samples_km, self.elevations(latitudes, longitudes)
+
+    def route_climb(self, points, spacing_m=ELEVATION_PROFILE_SPACING_M):
+
+        """
+        Return the total ascent and descent (m) along a polyline, or None unless every sample is covered.
+        """
+
+        if not self.enabled:
+            return None
+        _, heights = self.profile(points, spacing_m)
+        if not len(heights) or np.isnan(heights).any():
+            return None
+        ascent, descent = cumulative_climb(heights)
+        return float(ascent[-1]), float(descent[-1])
+
+    def stats(self):
+
+        """
+        Return whether the model is enabled, the number of open and missing tiles and the points looked up.
+        """
+
+        with self._lock:
+            open_tiles = sum(tile is not None for tile in self._tiles.values())
+            missing_tiles = len(self._tiles) - open_tiles
+        return {
+            "enabled": self.enabled,
+            "open_tiles": open_tiles,
+            "missing_tiles": missing_tiles,
+            "points": self.points,
+            "missing_points": self.missing,
+        }
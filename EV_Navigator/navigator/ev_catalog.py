@@ -0,0 +1,285 @@
+# In-memory, indexed catalog of EV specifications loaded from the ev_data table
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from metrics import provider_call
+
+# Seconds between background reloads of the catalog (0 disables the background refresh)
+EV_CATALOG_REFRESH_SECONDS = float(os.getenv("EV_CATALOG_REFRESH_SECONDS", "3600"))
+# Minimum seconds between on-demand reloads triggered while the catalog is empty
+EV_CATALOG_RETRY_SECONDS = float(os.getenv("EV_CATALOG_RETRY_SECONDS", "30"))
+# Seconds a model missing from the database is remembered before it is queried again
+EV_CATALOG_MISS_TTL = float(os.getenv("EV_CATALOG_MISS_TTL", "300"))
+# Maximum number of missing models remembered
+EV_CATALOG_MAX_MISSES = int(os.getenv("EV_CATALOG_MAX_MISSES", "1000"))
+
+# Characters normalize_model_name treats as word separators, the same ones the model_key column expression replaces
+MODEL_NAME_SEPARATORS = re.compile("[- \t\n\r]+")
+
+
+class CatalogUnavailableError(Exception):
+
+    """
+    Raised when a model missing from the catalog cannot be looked up because the database query failed.
+    """
+
+
+def parse_quantity(value):
+
+    """
+    Convert a stored attribute such as '118.0 kWh' or '184 Wh/km' into a float.
+
+    Args:
+    value (str/float/int/Decimal): The stored value, with or without its unit.
+
+    Returns:
+    float: The numeric part of the value, or None if the value is missing or not numeric.
+    """
+
+    if value is None:
+        return None
+    if isinstance(value, float):
+        return value
+    if not isinstance(value, str):
+        return float(value)
+    parts = value.split()
+    if not parts:
+        return None
+    try:
+        return float(parts[0])
+    except ValueError:
+        return None
+
+
+def normalize_model_name(model):
+
+    """
+    Build the lookup key for an EV model name, so 'Nissan Leaf', 'nissan-leaf' and 'Nissan-Leaf' match.
+
+    This must give the same key as the generated model_key column of ev_data (migrations/001_typed_ev_data.sql).
+    """
+
+    return "-".join(part for part in MODEL_NAME_SEPARATORS.split(model) if part).lower()
+
+
+class EVSpec(NamedTuple):
+
+    """
+    Parsed specification of an EV model. Capacities are in kWh, rates in Wh/km, weight in kg.
+    """
+
+    ev_model: str
+    useable_capacity: Optional[float]
+    charge_port: Optional[str]
+    fast_charge_port: Optional[str]
+    charge_power: Optional[float]
+    charge_speed: Optional[float]
+    city_cold_rate: Optional[float]
+    highway_cold_rate: Optional[float]
+    combined_cold_rate: Optional[float]
+    city_mild_rate: Optional[float]
+    highway_mild_rate: Optional[float]
+    combined_mild_rate: Optional[float]
+    weight: Optional[float]
+
+    @classmethod
+    def from_row(cls, row):
+
+        """
+        Build a specification from an ev_data row in the column order used by the catalog query.
+        """
+
+        return cls(
+            row[0],
+            parse_quantity(row[1]),
+            row[2],
+            row[3],
+            parse_quantity(row[4]),
+            parse_quantity(row[5]),
+            *(parse_quantity(value) for value in row[6:12]),
+            parse_quantity(row[12]),
+        )
+
+    def rates(self):
+
+        """
+        Return the discharge rates (Wh/km) keyed by road and temperature profile, as used by calculate_soc.
+        """
+
+        return {
+            'city_cold_rate': self.city_cold_rate,
+            'highway_cold_rate': self.highway_cold_rate,
+            'combined_cold_rate': self.combined_cold_rate,
+            'city_mild_rate': self.city_mild_rate,
+            'highway_mild_rate': self.highway_mild_rate,
+            'combined_mild_rate': self.combined_mild_rate,
+        }
+
+
+class EVCatalog:
+
+    """
+    Holds every EV specification in memory, indexed by normalized model name.
+
+    The catalog is loaded through a blocking loader (returning ev_data rows) in a worker thread and swapped in
+    atomically, so lookups on the request path are a single dictionary access and never touch the database.
+    Models added after the last load are fetched once through the optional single-row loader and kept in the
+    index; models that are not in the database are remembered for EV_CATALOG_MISS_TTL seconds.
+    """
+
+    def __init__(self, loader, row_loader=None):
+        self.loader = loader
+        self.row_loader = row_loader
+        self._index = {}
+        self._missing = OrderedDict()  # model key -> time it was found missing
+        self.loaded_at = None
+        self._last_attempt = 0.0
+        self._lock = None
+        self.lookups = 0
+        self.misses = 0
+
+    def load(self):
+
+        """
+        Load all rows through the loader and replace the index.
+
+        Returns:
+        int: The number of models in the new index.
+        """
+
+        index = {}
+        for row in self.loader():
+            spec = EVSpec.from_row(row)
+            index[normalize_model_name(spec.ev_model)] = spec
+        self._index = index
+        self._missing.clear()
+        self.loaded_at = time.time()
+        return len(index)
+
+    async def refresh(self):
+
+        """
+        Reload the catalog without blocking the event loop.
+
+        Returns:
+        bool: True if the catalog was reloaded, False if loading failed and the previous index was kept.
+        """
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._last_attempt = time.monotonic()
+            try:
+                with provider_call("mysql"):
+                    count = await asyncio.to_thread(self.load)
+            except Exception as e:
+                logging.error(f"Could not load the EV catalog: {e}")
+                return False
+        logging.info(f"EV catalog loaded with {count} models")
+        return True
+
+    async def ensure_loaded(self):
+
+        """
+        Load the catalog on demand if it is still empty, at most once per EV_CATALOG_RETRY_SECONDS.
+        """
+
+        if self._index:
+            return
+        if self._lock is not None and self._lock.locked():
+            # Another request is already loading the catalog; wait for it instead of missing the empty index
+            async with self._lock:
+                return
+        if time.monotonic() - self._last_attempt >= EV_CATALOG_RETRY_SECONDS:
+            await self.refresh()
+
+    async def run_periodic_refresh(self, interval=EV_CATALOG_REFRESH_SECONDS):
+
+        """
+        Reload the catalog every interval seconds until cancelled.
+        """
+
+        while True:
+            await asyncio.sleep(interval)
+            await self.refresh()
+
+    def get(self, model):
+
+        """
+        Look up a model by name.
+
+        Args:
+        model (str): The EV model as entered by the user.
+
+        Returns:
+        EVSpec: The parsed specification, or None if the model is not in the catalog.
+        """
+
+        self.lookups += 1
+        spec = self._index.get(normalize_model_name(model))
+        if spec is None:
+            self.misses += 1
+        return spec
+
+    async def lookup(self, model):
+
+        """
+        Look up a model by name, falling back to a single-row database query for models missing from the index.
+
+        Args:
+        model (str): The EV model as entered by the user.
+
+        Returns:
+        EVSpec: The parsed specification, or None if the model is not in the database.
+
+        Raises:
+        CatalogUnavailableError: If the database query fails; the model is not remembered as missing.
+        """
+
+        spec = self.get(model)
+        if spec is not None or self.row_loader is None:
+            return spec
+
+        key = normalize_model_name(model)
+        missing_since = self._missing.get(key)
+        if missing_since is not None and time.monotonic() - missing_since < EV_CATALOG_MISS_TTL:
+            return None
+
+        try:
+            with provider_call("mysql"):
+                row = await asyncio.to_thread(self.row_loader, key)
+        except Exception as err:
+            logging.error(f"Database error while looking up EV model '{model}': {err}")
+            raise CatalogUnavailableError(model) from err
+        if row is None:
+            self._missing[key] = time.monotonic()
+            self._missing.move_to_end(key)
+            while len(self._missing) > EV_CATALOG_MAX_MISSES:
+                self._missing.popitem(last=False)
+            return None
+
+        spec = EVSpec.from_row(row)
+        self._missing.pop(key, None)
+        self._index[key] = spec
+        return spec
+
+    def __len__(self):
+        return len(self._index)
+
+    def stats(self):
+
+        """
+        Return the catalog size, load time and lookup counters.
+        """
+
+        return {
+            "models": len(self._index),
+            "loaded_at": self.loaded_at,
+            "lookups": self.lookups,
+            "misses": self.misses,
+        }
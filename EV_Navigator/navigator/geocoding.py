@@ -0,0 +1,243 @@
+# Cached, rate-limited geocoding in front of the Nominatim service
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from workers import connect_shared_sqlite
+
+# Location of the on-disk geocoding cache, kept across restarts
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", os.path.join("cache", "geocode.sqlite3"))
+# Maximum number of addresses kept in the in-memory LRU
+GEOCODE_CACHE_MAX_ENTRIES = int(os.getenv("GEOCODE_CACHE_MAX_ENTRIES", "10000"))
+# Most recently used addresses loaded from the persistent store into the memory LRU when a worker starts
+GEOCODE_WARM_ENTRIES = int(os.getenv("GEOCODE_WARM_ENTRIES", "1000"))
+# Seconds an address Nominatim could not find is answered as not found without asking again
+GEOCODE_NOT_FOUND_TTL = float(os.getenv("GEOCODE_NOT_FOUND_TTL", "300"))
+# Nominatim server, configurable to use a self-hosted instance or a local fake
+NOMINATIM_DOMAIN = os.getenv("NOMINATIM_DOMAIN", "nominatim.openstreetmap.org")
+NOMINATIM_SCHEME = os.getenv("NOMINATIM_SCHEME", "https")
+
+
+def normalize_address(address):
+
+    """
+    Build the cache key for an address.
+
+    Args:
+    address (str): The address as entered by the user.
+
+    Returns:
+    str: The address with unicode normalized, case folded, whitespace collapsed and separators unified,
+         so that "  Madrid ,Spain" and "madrid, spain" share one cache entry.
+    """
+
+    key = unicodedata.normalize("NFKC", address).casefold()
+    key = re.sub(r"\s*,\s*", ", ", key)
+    key = re.sub(r"\s+", " ", key)
+    return key.strip(" ,.;")
+
+
+class GeocodeStore:
+
+    """
+    SQLite-backed persistent store of geocoded addresses.
+    """
+
+    def __init__(self, path=GEOCODE_CACHE_PATH):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Opened on first use rather than when the store is built at import time; called with the lock held
+        if self._connection is None:
+            self._connection = connect_shared_sqlite(self.path)
+            with self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS geocode ("
+                    "address_key TEXT PRIMARY KEY, latitude REAL NOT NULL, longitude REAL NOT NULL, updated_at REAL NOT NULL)"
+                )
+        return self._connection
+
+    def get(self, key):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT latitude, longitude FROM geocode WHERE address_key = ?", (key,)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def put(self, key, coordinates):
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO geocode (address_key, latitude, longitude, updated_at) VALUES (?, ?, ?, ?)",
+                (key, coordinates[0], coordinates[1], time.time()),
+            )
+
+    def recent(self, limit):
+
+        """
+        Return up to limit (address_key, (latitude, longitude)) pairs, most recently stored first.
+        """
+
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT address_key, latitude, longitude FROM geocode ORDER BY updated_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [(key, (latitude, longitude)) for key, latitude, longitude in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+
+
+class Geocoder:
+
+    """
+    Resolves addresses to coordinates through a memory LRU, a persistent store and a rate-limited upstream lookup.
+
+    The upstream lookup is a blocking callable (such as get_coordinates bound to a Nominatim instance) and is run
+    in a worker thread. It returns None for an address that does not exist and raises when the service fails.
+    Concurrent requests for the same normalized address share a single upstream call, and all upstream calls first
+    wait for the limiter, the provider scheduler of the Nominatim quota. Addresses that were not found are
+    remembered in memory for not_found_ttl seconds; failed lookups are not remembered.
+    """
+
+    def __init__(self, lookup, limiter, store=None, max_entries=GEOCODE_CACHE_MAX_ENTRIES, not_found_ttl=GEOCODE_NOT_FOUND_TTL):
+        self.lookup = lookup
+        self.limiter = limiter
+        self.store = store
+        self.max_entries = max_entries
+        self.not_found_ttl = not_found_ttl
+        self._memory = OrderedDict()
+        self._not_found = OrderedDict()  # key -> time.monotonic() at which the entry expires
+        self._pending = {}
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.not_found_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.coalesced = 0
+
+    def _remember(self, key, coordinates):
+        self._memory[key] = coordinates
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _remember_not_found(self, key):
+        if self.not_found_ttl <= 0:
+            return
+        self._not_found[key] = time.monotonic() + self.not_found_ttl
+        self._not_found.move_to_end(key)
+        while len(self._not_found) > self.max_entries:
+            self._not_found.popitem(last=False)
+
+    def _known_not_found(self, key):
+        expires_at = self._not_found.get(key)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del self._not_found[key]
+            return False
+        return True
+
+    async def _resolve(self, key, address):
+        if self.store is not None:
+            coordinates = await asyncio.to_thread(self.store.get, key)
+            if coordinates is not None:
+                self.disk_hits += 1
+                self._remember(key, coordinates)
+                return coordinates
+
+        self.misses += 1
+        await self.limiter.acquire()
+        try:
+            coordinates = await asyncio.to_thread(self.lookup, address)
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"Geocoding service error: {e}")
+            return None
+        if coordinates is None:
+            self._remember_not_found(key)
+        else:
+            self._remember(key, coordinates)
+            if self.store is not None:
+                try:
+                    await asyncio.to_thread(self.store.put, key, coordinates)
+                except sqlite3.Error as e:
+                    logging.error(f"Could not persist geocoding result: {e}")
+        return coordinates
+
+    async def warm(self, entries=GEOCODE_WARM_ENTRIES):
+
+        """
+        Fill the memory LRU with the most recently stored addresses, so a freshly started worker answers popular
+        addresses without a disk lookup.
+
+        Returns:
+        int: The number of addresses loaded.
+        """
+
+        if self.store is None or entries <= 0:
+            return 0
+        recent = await asyncio.to_thread(self.store.recent, min(entries, self.max_entries))
+        # Insert the oldest first so the most recent addresses end up last in LRU order
+        for key, coordinates in reversed(recent):
+            self._remember(key, coordinates)
+        return len(recent)
+
+    async def geocode(self, address):
+
+        """
+        Retrieve geographic coordinates for an address.
+
+        Args:
+        address (str): The address to geocode.
+
+        Returns:
+        tuple: A pair of floats (latitude, longitude), or None if the address cannot be found.
+        """
+
+        key = normalize_address(address)
+        coordinates = self._memory.get(key)
+        if coordinates is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return coordinates
+        if self._known_not_found(key):
+            self.not_found_hits += 1
+            return None
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        task = asyncio.ensure_future(self._resolve(key, address))
+        self._pending[key] = task
+        task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(task)
+
+    def stats(self):
+
+        """
+        Return cache counters for the memory and disk tiers, the addresses answered as not found from memory, the
+        failed lookups and the number of coalesced lookups.
+        """
+
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "not_found_hits": self.not_found_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "coalesced": self.coalesced,
+            "memory_entries": len(self._memory),
+            "not_found_entries": len(self._not_found),
+        }
@@ -0,0 +1,79 @@
+# Shared asynchronous HTTP client used by the navigator for all outbound provider calls
+import asyncio
+import os
+
+import httpx
+
+# Maximum number of outbound requests the navigator keeps in flight at the same time
+MAX_CONCURRENT_REQUESTS = int(os.getenv("NAVIGATOR_MAX_CONCURRENCY", "20"))
+
+# Default timeout (in seconds) applied to every outbound request
+REQUEST_TIMEOUT = float(os.getenv("NAVIGATOR_REQUEST_TIMEOUT", "10"))
+
+_client = None
+_semaphore = None
+
+
+def get_http_client():
+
+    """
+    Return the process-wide asynchronous HTTP client, creating it on first use.
+
+    Returns:
+    httpx.AsyncClient: A client with keep-alive connections shared by every provider call.
+
+    Reusing a single client lets consecutive calls to the same provider share pooled connections
+    instead of paying a new TCP/TLS handshake for every request.
+    """
+
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_connections=MAX_CONCURRENT_REQUESTS, max_keepalive_connections=MAX_CONCURRENT_REQUESTS),
+        )
+    return _client
+
+
+def get_request_semaphore():
+
+    """
+    Return the semaphore bounding the number of concurrent outbound requests.
+
+    Returns:
+    asyncio.Semaphore: A semaphore sized by the NAVIGATOR_MAX_CONCURRENCY environment variable.
+    """
+
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return _semaphore
+
+
+async def limited_get(url, params=None):
+
+    """
+    Perform a GET request through the shared client while respecting the concurrency limit.
+
+    Args:
+    url (str): The URL to request.
+    params (dict): Optional query string parameters.
+
+    Returns:
+    httpx.Response: The response returned by the remote service.
+    """
+
+    async with get_request_semaphore():
+        return await get_http_client().get(url, params=params)
+
+
+async def close_http_client():
+
+    """
+    Close the shared HTTP client and release its pooled connections.
+    """
+
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,311 @@
+# Cache of analyzed driving legs (road-type breakdown and elevation change) keyed by snapped coordinates
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from workers import connect_shared_sqlite
+
+# Road types reported by analyze_route, in the order they are stored in a cached leg
+ROAD_TYPES = ("Highway", "MajorRoad", "Arterial", "LocalRoad", "Street", "Ramp", "LimitedAccessHighway")
+
+# Cache backend: "memory" (per process) or "disk" (SQLite file, shared across restarts and workers)
+LEG_CACHE_BACKEND = os.getenv("LEG_CACHE_BACKEND", "memory")
+LEG_CACHE_PATH = os.getenv("LEG_CACHE_PATH", os.path.join("cache", "legs.sqlite3"))
+# Size (in degrees) of the grid used to snap leg endpoints (0.001 deg is roughly 100 m)
+LEG_CACHE_GRID_DEGREES = float(os.getenv("LEG_CACHE_GRID_DEGREES", "0.001"))
+# Seconds a cached leg stays valid; traffic congestion makes very long values less accurate
+LEG_CACHE_TTL = float(os.getenv("LEG_CACHE_TTL", "3600"))
+# Maximum number of legs kept by the backend
+LEG_CACHE_MAX_ENTRIES = int(os.getenv("LEG_CACHE_MAX_ENTRIES", "100000"))
+# Seconds a cached station-to-destination walking leg stays valid
+WALKING_CACHE_TTL = float(os.getenv("WALKING_CACHE_TTL", "86400"))
+
+
+def compact_leg(route_info, segment_distances_sum, elevation_change, total_ascent=None):
+
+    """
+    Reduce an analyzed route and its elevation change to the values calculate_soc and the station result need.
+
+    Returns:
+    list: Distance, duration, congestion, the per-road-type distances, the segment distance sum, the elevation change
+    and the total ascent along the route (None unless measured on a local elevation model).
+    """
+
+    return [
+        route_info["distance"],
+        route_info["duration"],
+        route_info["traffic_congestion"],
+        [route_info[road_type]["distance"] for road_type in ROAD_TYPES],
+        segment_distances_sum,
+        elevation_change,
+        total_ascent,
+    ]
+
+
+def expand_leg(leg):
+
+    """
+    Rebuild the analyze_route output from a compact leg.
+
+    Returns:
+    tuple: The route info dictionary, the segment distance sum, the elevation change and the total ascent (None
+    for legs cached before it was stored).
+    """
+
+    distance, duration, traffic_congestion, road_distances, segment_distances_sum, elevation_change = leg[:6]
+    total_ascent = leg[6] if len(leg) > 6 else None
+    route_info = {
+        "distance": distance,
+        "duration": duration,
+        "traffic_congestion": traffic_congestion,
+    }
+    for road_type, road_distance in zip(ROAD_TYPES, road_distances):
+        route_info[road_type] = {"distance": road_distance}
+    return route_info, segment_distances_sum, elevation_change, total_ascent
+
+
+class MemoryLegBackend:
+
+    """
+    In-process LRU store of compact legs with per-entry expiry.
+    """
+
+    def __init__(self, max_entries=LEG_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, leg)
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def put(self, key, leg, ttl):
+        self._entries[key] = (time.time() + ttl, leg)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def size(self):
+        return len(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskLegBackend:
+
+    """
+    SQLite store of compact legs with per-entry expiry, bounded by evicting the entries closest to expiry.
+    """
+
+    def __init__(self, path=LEG_CACHE_PATH, max_entries=LEG_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._writes = 0
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Opened on first use rather than when the backend is built at import time; called with the lock held
+        if self._connection is None:
+            self._connection = connect_shared_sqlite(self.path)
+            with self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS legs (leg_key TEXT PRIMARY KEY, expires_at REAL NOT NULL, leg TEXT NOT NULL)"
+                )
+                self._connection.execute("CREATE INDEX IF NOT EXISTS legs_expires_at ON legs (expires_at)")
+        return self._connection
+
+    def _get(self, key):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT leg FROM legs WHERE leg_key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _put(self, key, leg, ttl):
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO legs (leg_key, expires_at, leg) VALUES (?, ?, ?)",
+                (key, time.time() + ttl, json.dumps(leg)),
+            )
+            self._writes += 1
+            # Trim periodically rather than on every write
+            if self._writes % 1000 == 0:
+                connection.execute("DELETE FROM legs WHERE expires_at < ?", (time.time(),))
+                connection.execute(
+                    "DELETE FROM legs WHERE leg_key IN (SELECT leg_key FROM legs ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+    async def get(self, key):
+        return await asyncio.to_thread(self._get, key)
+
+    async def put(self, key, leg, ttl):
+        await asyncio.to_thread(self._put, key, leg, ttl)
+
+    async def size(self):
+        # Counting the rows scans the table, so it runs in a worker thread like the other queries
+        return await asyncio.to_thread(len, self)
+
+    def __len__(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM legs").fetchone()[0]
+
+
+def create_leg_backend(name=LEG_CACHE_BACKEND):
+
+    """
+    Build the leg cache backend selected by name ("memory" or "disk").
+    """
+
+    if name == "disk":
+        return DiskLegBackend()
+    if name != "memory":
+        logging.warning(f"Unknown leg cache backend '{name}', using the in-memory backend.")
+    return MemoryLegBackend()
+
+
+class LegCache:
+
+    """
+    Caches analyzed origin-to-station driving legs under grid-snapped coordinates.
+
+    Only the compact values produced by compact_leg are stored, never the raw Bing responses.
+    """
+
+    def __init__(self, backend=None, grid_degrees=LEG_CACHE_GRID_DEGREES, ttl=LEG_CACHE_TTL):
+        self.backend = backend if backend is not None else create_leg_backend()
+        self.grid_degrees = grid_degrees
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, origin, destination):
+
+        """
+        Build the cache key for a leg from two (latitude, longitude) pairs.
+        """
+
+        size = self.grid_degrees
+        return "|".join(
+            f"{round(round(latitude / size) * size, 6)},{round(round(longitude / size) * size, 6)}"
+            for latitude, longitude in (origin, destination)
+        )
+
+    async def get(self, origin, destination):
+
+        """
+        Look up a cached leg.
+
+        Returns:
+        tuple: The route info dictionary, segment distance sum, elevation change and total ascent, or None on a miss.
+        """
+
+        try:
+            leg = await self.backend.get(self.key(origin, destination))
+        except sqlite3.Error as e:
+            logging.error(f"Leg cache read failed: {e}")
+            leg = None
+        if leg is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return expand_leg(leg)
+
+    async def put(self, origin, destination, route_info, segment_distances_sum, elevation_change, total_ascent=None):
+
+        """
+        Store an analyzed leg.
+        """
+
+        try:
+            await self.backend.put(
+                self.key(origin, destination), compact_leg(route_info, segment_distances_sum, elevation_change, total_ascent), self.ttl,
+            )
+        except sqlite3.Error as e:
+            logging.error(f"Leg cache write failed: {e}")
+
+    async def stats(self):
+
+        """
+        Return hit/miss counters, the hit rate and the number of stored legs.
+        """
+
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": await self.backend.size(),
+        }
+
+
+class WalkingLegCache:
+
+    """
+    Caches walking legs (distance in kilometers, duration in minutes) from charging stations to destinations.
+
+    Walking legs do not depend on traffic, so they are kept longer than driving legs. They are stored in a leg
+    cache backend under exact coordinates, since both ends are either station locations or geocoded addresses.
+    """
+
+    def __init__(self, backend=None, ttl=WALKING_CACHE_TTL):
+        self.backend = backend if backend is not None else create_leg_backend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(origin, destination):
+        return f"walking|{origin}|{destination}"
+
+    async def get(self, origin, destination):
+
+        """
+        Look up a cached walking leg between two "lat,lon" coordinates.
+
+        Returns:
+        tuple: The walking distance and duration, or None on a miss.
+        """
+
+        try:
+            leg = await self.backend.get(self.key(origin, destination))
+        except sqlite3.Error as e:
+            logging.error(f"Walking leg cache read failed: {e}")
+            leg = None
+        if leg is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return tuple(leg)
+
+    async def put(self, origin, destination, leg):
+
+        """
+        Store a walking leg.
+        """
+
+        try:
+            await self.backend.put(self.key(origin, destination), list(leg), self.ttl)
+        except sqlite3.Error as e:
+            logging.error(f"Walking leg cache write failed: {e}")
+
+    def stats(self):
+
+        """
+        Return hit/miss counters and the hit rate.
+        """
+
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
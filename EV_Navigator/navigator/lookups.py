@@ -0,0 +1,57 @@
+# Shared, deduplicated lookups across the trips of a request or batch
+import asyncio
+
+
+class SharedLookups:
+
+    """
+    Memo of provider lookups keyed by their normalized inputs.
+
+    The first caller for a key starts the lookup; every later caller with the same key, including callers from
+    other trips in the same batch, awaits that same task. External calls therefore grow with the number of unique
+    inputs rather than with the number of trips.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self.requested = 0
+
+    async def get(self, key, factory):
+
+        """
+        Return the result of the lookup identified by key, starting it with factory() if nobody has yet.
+
+        Args:
+        key (tuple): Hashable lookup identity, e.g. ("geocode", normalized_address).
+        factory (callable): Returns the awaitable performing the lookup.
+
+        Returns:
+        object: The lookup result, shared by every caller using the same key.
+        """
+
+        self.requested += 1
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+        # Shielded so that one trip giving up (e.g. on an early exit) does not cancel the lookup for the others
+        return await asyncio.shield(task)
+
+    def close(self):
+
+        """
+        Cancel lookups that are still running once no trip needs them anymore.
+        """
+
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+
+    def stats(self):
+
+        """
+        Return how many lookups were requested and how many were actually executed.
+        """
+
+        executed = len(self._tasks)
+        return {"requested": self.requested, "executed": executed, "deduplicated": self.requested - executed}
@@ -1,20 +1,187 @@
 # Import necessary libraries and modules
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from typing import List
 from geopy.geocoders import Nominatim
-import requests
+import asyncio
+import httpx
 import json
-import mysql.connector
+import math
 import os
 import logging
-logging.basicConfig(level=logging.INFO)
+from timing import REQUEST_ID_HEADER, REQUEST_LOG_FORMAT, begin_request, timed
+logging.basicConfig(level=logging.INFO, format=REQUEST_LOG_FORMAT)
 import sys
 from bs4 import BeautifulSoup
+from http_client import close_http_client
+from providers import get_provider, get_geocoding_provider, provider_stats
+from temperature import TemperatureService
+from geocoding import Geocoder, GeocodeStore, NOMINATIM_DOMAIN, NOMINATIM_SCHEME, normalize_address
+from ev_catalog import EVCatalog, CatalogUnavailableError, parse_quantity, normalize_model_name, EV_CATALOG_REFRESH_SECONDS
+from database import fetch_ev_rows, fetch_ev_row
+from stations import StationMirror, StationSetCache, StationStore, OCM_URL, STATION_IMPORT_PATH, STATION_SYNC_LOCK_PATH, STATION_SYNC_SECONDS, haversine_km
+from leg_cache import LegCache, WalkingLegCache
+from soc_engine import soc_for_legs, soc_upper_bounds
+from lookups import SharedLookups
+from coalescing import TripCoalescer
+from trip_context import TripContext, TripContextStore
+from metrics import REQUESTS_IN_FLIGHT, observe_request, render_metrics
+from prewarm import Prewarmer, load_prewarm_targets, PREWARM_PATH
+from elevation import ElevationModel
+from routing import OfflineRouter, route_info as offline_route_info
+from planner import (
+    Corridor, CorridorCache, PLAN_CORRIDOR_KM, PLAN_MAX_CANDIDATES, PLAN_MIN_ARRIVAL_SOC, PLAN_TEMPERATURE_SPACING_KM,
+    can_plan, corridor_temperatures, encode_polyline, plan_charging_stops, profile_ascent, project_stations, route_profile,
+    sample_points,
+)
+from workers import NAVIGATOR_WORKERS, LeaderLock, install_thread_pool, shutdown_thread_pool, worker_stats
+from scheduler import get_scheduler, scheduler_stats, set_priority
+from resilience import DEADLINE_HEADER, REQUEST_DEADLINE_SECONDS, BATCH_REQUEST_DEADLINE_SECONDS, start_deadline, within_deadline
 
 # Initialize FastAPI app
 app = FastAPI()
 
 
+# Run blocking work (geocoding, MySQL, SQLite caches) in a bounded thread pool instead of one thread per call
+@app.on_event("startup")
+async def start_thread_pool():
+    install_thread_pool()
+
+
+# Load the EV catalog before serving requests and keep it fresh in the background
+@app.on_event("startup")
+async def load_ev_catalog():
+    await ev_catalog.refresh()
+    if EV_CATALOG_REFRESH_SECONDS > 0:
+        background_tasks.append(asyncio.ensure_future(ev_catalog.run_periodic_refresh()))
+
+
+# Load the local charging station mirror, seed it from a dataset export if needed and keep it in sync.
+# With several workers only the worker holding the sync lock imports and syncs; the others follow the shared store
+@app.on_event("startup")
+async def load_station_mirror():
+    leader = station_sync_leader.acquire()
+    try:
+        await asyncio.to_thread(station_mirror.load)
+        if leader and not len(station_mirror) and STATION_IMPORT_PATH:
+            await asyncio.to_thread(station_mirror.import_export, STATION_IMPORT_PATH)
+    except Exception as e:
+        logging.error(f"Could not load the charging station mirror: {e}")
+    logging.info(f"Charging station mirror holds {len(station_mirror)} stations")
+    if (len(station_mirror) or NAVIGATOR_WORKERS > 1) and STATION_SYNC_SECONDS > 0:
+        background_tasks.append(asyncio.ensure_future(in_background(station_mirror.run_periodic_sync(OCM_API_KEY, leader=station_sync_leader))))
+
+
+# Load the most recently geocoded addresses into memory, so a new worker starts with warm popular addresses
+@app.on_event("startup")
+async def warm_geocoder():
+    try:
+        warmed = await geocoder.warm()
+    except Exception as e:
+        logging.error(f"Could not warm the geocoding cache: {e}")
+        return
+    logging.info(f"Loaded {warmed} geocoded addresses into memory")
+
+
+# Load or build the offline road network in the background; until it is ready legs are routed with Bing Maps
+@app.on_event("startup")
+async def load_road_network():
+    if not road_network.enabled:
+        return
+
+    async def load():
+        try:
+            await asyncio.to_thread(road_network.load)
+        except Exception as e:
+            logging.error(f"Could not load the offline road network from {road_network.path}: {e}")
+
+    background_tasks.append(asyncio.ensure_future(load()))
+
+
+# Keep the lookups of configured hot destinations and common origins cached in the background
+@app.on_event("startup")
+async def start_prewarming():
+    if not PREWARM_PATH:
+        return
+    try:
+        prewarmer.destinations, prewarmer.origins = load_prewarm_targets(PREWARM_PATH)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logging.error(f"Could not read the pre-warming targets from {PREWARM_PATH}: {e}")
+        return
+    if len(prewarmer):
+        background_tasks.append(asyncio.ensure_future(in_background(prewarmer.run_periodic())))
+
+
+async def in_background(awaitable):
+
+    """
+    Await awaitable with background priority, so its provider calls wait behind those of trip requests.
+    """
+
+    set_priority("background")
+    return await awaitable
+
+
+# Collect per-stage timings of every request under the caller's request ID, record them as metrics and report them
+# in the Server-Timing header
+@app.middleware("http")
+async def add_server_timing(request: Request, call_next):
+    timings = begin_request(request.headers.get(REQUEST_ID_HEADER))
+    start_deadline(request_deadline(request))
+    set_priority("batch" if request.url.path == "/calculate_routes" else "interactive")
+    endpoint = request.url.path if request.url.path in route_paths() else "other"
+    REQUESTS_IN_FLIGHT.labels(endpoint).inc()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        REQUESTS_IN_FLIGHT.labels(endpoint).dec()
+        observe_request(endpoint, status, timings.elapsed(), timings)
+        if endpoint != "/metrics":
+            timings.log(endpoint, status)
+    timings.add("navigator", timings.elapsed())
+    response.headers["Server-Timing"] = timings.server_timing()
+    response.headers[REQUEST_ID_HEADER] = timings.request_id
+    return response
+
+
+def route_paths():
+
+    """
+    Return the paths served by the app, used as metric labels so unknown paths cannot create new series.
+    """
+
+    return {route.path for route in app.routes}
+
+
+def request_deadline(request: Request):
+
+    """
+    Return the time budget of a request in seconds: the configured deadline, shortened to what the caller is still
+    willing to wait according to the X-Request-Deadline header.
+    """
+
+    seconds = BATCH_REQUEST_DEADLINE_SECONDS if request.url.path == "/calculate_routes" else REQUEST_DEADLINE_SECONDS
+    try:
+        caller_seconds = float(request.headers.get(DEADLINE_HEADER, "0"))
+    except ValueError:
+        caller_seconds = 0
+    if caller_seconds > 0 and (not seconds or caller_seconds < seconds):
+        seconds = caller_seconds
+    return seconds
+
+
+# Release pooled provider connections and stop background work when the service stops
+@app.on_event("shutdown")
+async def shutdown_http_client():
+    for task in background_tasks:
+        task.cancel()
+    await close_http_client()
+    shutdown_thread_pool()
+
+
 # Define a Pydantic model to validate and structure incoming data
 class RouteCalculationData(BaseModel):
     origin_location: str
@@ -24,18 +191,262 @@ class RouteCalculationData(BaseModel):
     initial_SOC: float
     fast_charging_priority: bool = False
 
+
+# Define a Pydantic model for a batch of trips
+class BatchRouteCalculationData(BaseModel):
+    trips: List[RouteCalculationData]
+
+
+# Define a Pydantic model for recomputing a computed trip with another EV model or initial SOC
+class WhatIfData(BaseModel):
+    trip_context_id: str
+    ev_model: str
+    initial_SOC: float
+
+
+# Define a Pydantic model for planning the charging stops of a trip beyond the EV's range
+class PlanRouteData(BaseModel):
+    origin_location: str
+    destination_location: str
+    ev_model: str
+    initial_SOC: float
+    fast_charging_priority: bool = False
+    corridor_km: float = PLAN_CORRIDOR_KM
+    min_arrival_SOC: float = PLAN_MIN_ARRIVAL_SOC
+
+
+# Maximum number of trips accepted in a single batch request
+MAX_BATCH_TRIPS = int(os.getenv("MAX_BATCH_TRIPS", "500"))
+
+# Background tasks started with the service
+background_tasks = []
+
+# Shared temperature cache, reused across requests
+temperature_service = TemperatureService()
+
+# Shared geocoder: a single Nominatim client (live, recorded or replayed) behind a persistent, rate-limited cache
+geolocator = get_geocoding_provider(Nominatim(user_agent="Navigator", domain=NOMINATIM_DOMAIN, scheme=NOMINATIM_SCHEME))
+geocoder = Geocoder(lambda address: get_coordinates(geolocator, address), store=GeocodeStore(), limiter=get_scheduler("nominatim"))
+
+# In-memory EV specification catalog, loaded from the database at startup
+ev_catalog = EVCatalog(lambda: fetch_ev_rows(), row_loader=lambda model_key: fetch_ev_row(model_key))
+
+# Local, spatially indexed copy of Open Charge Map
+station_mirror = StationMirror(StationStore())
+station_sync_leader = LeaderLock(STATION_SYNC_LOCK_PATH)
+
+# Cache of analyzed origin-to-station legs
+leg_cache = LegCache()
+
+# Cache of station-to-destination walking legs, in the same backend as the driving legs
+walking_cache = WalkingLegCache(leg_cache.backend)
+
+# Station sets fetched from the live Open Charge Map API when there is no local mirror
+station_sets = StationSetCache()
+
+# Shares one computation between identical trip requests that arrive while it is running
+trip_coalescer = TripCoalescer()
+
+# Model-independent trip data kept for what-if recomputation
+trip_contexts = TripContextStore()
+
+# Background warming of hot destinations and common origins, configured through PREWARM_PATH
+prewarmer = Prewarmer(lambda target: prewarm_destination(target), lambda target: prewarm_origin(target))
+
+# Local elevation model read from SRTM tiles in DEM_PATH; without tiles elevations come from the Bing Maps API
+elevation_model = ElevationModel()
+
+# Driving and walking networks built from the OpenStreetMap extract in ROAD_NETWORK_PATH; without it legs come from Bing Maps
+road_network = OfflineRouter()
+
+# Route profiles with their charging stations and elevations, reused by charging plans between the same places
+corridors = CorridorCache()
+
+
+async def run_trip_once(data: RouteCalculationData):
+
+    """
+    Runs the main processing function for one trip with its own lookup memo.
+    """
+
+    lookups = SharedLookups()
+    try:
+        return await your_main_code(data, lookups)
+    finally:
+        # Stop lookups that are no longer needed, e.g. after an early exit
+        lookups.close()
+
+
+def coalescing_key(data: RouteCalculationData):
+
+    """
+    Builds the key under which concurrent, equivalent trip requests share one computation.
+
+    Addresses and model names are normalized the same way as their cached lookups, and initial_SOC is bucketed
+    by COALESCE_SOC_BUCKET. With a non-zero bucket, every request in a bucket receives the result computed for
+    the first request's initial_SOC.
+    """
+
+    return (
+        normalize_address(data.origin_location),
+        normalize_address(data.destination_location),
+        normalize_model_name(data.ev_model),
+        data.max_radius,
+        trip_coalescer.soc_key(data.initial_SOC),
+        data.fast_charging_priority,
+    )
+
+
 # Endpoint to calculate the route and return charging station data
 @app.post("/calculate_route")
 async def calculate_route(data: RouteCalculationData):
     try:
-        # Call the main processing function with input data
-        return your_main_code(data)
+        # Call the main processing function with input data, sharing the run with identical requests in flight
+        return await within_deadline(trip_coalescer.run(coalescing_key(data), lambda: run_trip_once(data)))
+    except HTTPException as http_ex:
+        # Forward the HTTPException
+        raise http_ex
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="The route could not be calculated within the request deadline")
+    except Exception as ex:
+        # Handle unexpected exceptions
+        raise HTTPException(status_code=500, detail=str(ex))
+
+
+# Endpoint streaming charging station results as newline-delimited JSON while they are computed
+@app.post("/calculate_route/stream")
+async def calculate_route_stream(data: RouteCalculationData):
+    lookups = SharedLookups()
+    try:
+        # Failures before the first station (unknown model, location or no stations) are still plain HTTP errors
+        trip = await prepare_trip(data, lookups)
+    except HTTPException:
+        lookups.close()
+        raise
+    except Exception as ex:
+        lookups.close()
+        raise HTTPException(status_code=500, detail=str(ex))
+
+    async def records():
+        try:
+            async for record in stream_station_results(data, trip, lookups):
+                yield json.dumps(record) + "\n"
+        except Exception as ex:
+            logging.error(f"Streaming failed: {ex}")
+            yield json.dumps({"type": "error", "detail": str(ex)}) + "\n"
+        finally:
+            lookups.close()
+
+    return StreamingResponse(records(), media_type="application/x-ndjson")
+
+
+# Endpoint to calculate many trips at once, sharing identical lookups across the batch
+@app.post("/calculate_routes")
+async def calculate_routes(batch: BatchRouteCalculationData):
+    if len(batch.trips) > MAX_BATCH_TRIPS:
+        raise HTTPException(status_code=413, detail=f"A batch can contain at most {MAX_BATCH_TRIPS} trips")
+
+    lookups = SharedLookups()
+
+    async def run_trip(trip):
+        try:
+            return {"status_code": 200, "result": await your_main_code(trip, lookups)}
+        except HTTPException as http_ex:
+            return {"status_code": http_ex.status_code, "detail": http_ex.detail}
+        except Exception as ex:
+            logging.error(f"Batch trip failed: {ex}")
+            return {"status_code": 500, "detail": str(ex)}
+
+    try:
+        results = await asyncio.gather(*(run_trip(trip) for trip in batch.trips))
+    finally:
+        lookups.close()
+    return {
+        "message": "Batch processed successfully",
+        "results": results,
+        "shared_lookups": lookups.stats(),
+    }
+
+
+# Endpoint recomputing the SOC at every station of a computed trip for another EV model or initial SOC
+@app.post("/what_if")
+async def what_if(data: WhatIfData):
+    context = await trip_contexts.get(data.trip_context_id)
+    if context is None:
+        raise HTTPException(status_code=404, detail="Trip context not found or expired, please calculate the route again")
+
+    await ev_catalog.ensure_loaded()
+    ev_spec = await lookup_ev_model(data.ev_model)
+    if ev_spec is None:
+        raise HTTPException(status_code=404, detail="EV model not found in the database")
+
+    # The nearest station decides whether the destination is within range, as in your_main_code, so the other
+    # selected stations are only evaluated once it is
+    selection = context_selection(context, ev_spec, data.initial_SOC)
+    context = await complete_trip_context(data.trip_context_id, context, selection[:1])
+    (_, first_adjusted_SOC), = station_socs(ev_spec, data.initial_SOC, context.origin_coordinates, context.charging_stations[:1], context.evaluated_stations[:1], context.temperatures[:1])
+    if first_adjusted_SOC is not None and first_adjusted_SOC <= 0:
+        return RANGE_NOT_ENOUGH_MESSAGE
+    context = await complete_trip_context(data.trip_context_id, context, selection)
+
+    return {
+        "message": "Data processed successfully",
+        "charging_stations": station_results_for_context(context, ev_spec, data.initial_SOC),
+        "trip_context_id": data.trip_context_id,
+    }
+
+
+# Endpoint planning the charging stops of a trip beyond the EV's range
+@app.post("/plan_route")
+async def plan_route(data: PlanRouteData):
+    try:
+        return await within_deadline(plan_trip(data))
     except HTTPException as http_ex:
         # Forward the HTTPException
         raise http_ex
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="The charging plan could not be calculated within the request deadline")
     except Exception as ex:
         # Handle unexpected exceptions
         raise HTTPException(status_code=500, detail=str(ex))
+
+
+# Endpoint exposing cache counters of the navigator's shared services
+@app.get("/stats")
+async def stats():
+    return {
+        "temperature": temperature_service.stats(),
+        "geocoding": geocoder.stats(),
+        "ev_catalog": ev_catalog.stats(),
+        "station_mirror": station_mirror.stats(),
+        "leg_cache": await leg_cache.stats(),
+        "walking_cache": walking_cache.stats(),
+        "station_sets": station_sets.stats(),
+        "prewarm": prewarmer.stats(),
+        "corridors": corridors.stats(),
+        "elevation": elevation_model.stats(),
+        "routing": road_network.stats(),
+        "coalescing": trip_coalescer.stats(),
+        "trip_contexts": await trip_contexts.stats(),
+        "providers": provider_stats(),
+        "provider_queues": scheduler_stats(),
+        "worker": worker_stats(),
+    }
+
+
+# Endpoint exposing request, stage and provider metrics in the Prometheus text format
+@app.get("/metrics")
+async def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
+# Endpoint to reload the EV catalog on demand, e.g. after updating ev_data
+@app.post("/ev_catalog/refresh")
+async def refresh_ev_catalog():
+    if not await ev_catalog.refresh():
+        raise HTTPException(status_code=503, detail="Could not load the EV catalog from the database")
+    return {"message": "EV catalog refreshed", "models": len(ev_catalog)}
     
 # API keys configuration
 
@@ -46,6 +457,31 @@ OCM_API_KEY = 'YOUR_OPEN_CHARGE_MAP_API_KEY_HERE'
 # Bing Maps API Key: Obtain your key from https://www.bingmapsportal.com/ and replace below
 BING_MAPS_API_KEY = "YOUR_BING_MAPS_API_KEY_HERE"
 
+# Base URL of the Bing Maps REST services, configurable to point the navigator at a local fake
+BING_MAPS_URL = os.getenv("BING_MAPS_URL", "https://dev.virtualearth.net/REST/v1")
+
+# Maximum number of points sent in a single Bing Elevation request
+ELEVATION_BATCH_SIZE = int(os.getenv("ELEVATION_BATCH_SIZE", "100"))
+
+# Maximum number of station origins sent in a single Bing Distance Matrix request
+WALKING_MATRIX_CHUNK_SIZE = int(os.getenv("WALKING_MATRIX_CHUNK_SIZE", "50"))
+
+# Number of charging stations fetched around the destination as candidates, nearest first
+STATION_CANDIDATE_POOL = int(os.getenv("STATION_CANDIDATE_POOL", "50"))
+# Maximum number of candidates that get the full route, elevation and walking evaluation
+STATION_TOP_K = int(os.getenv("STATION_TOP_K", "10"))
+# Share of the straight-line distance assumed as the minimum driven distance when bounding the SOC at a candidate;
+# below 1 because calculate_soc counts rounded route segments
+STATION_PRUNE_DISTANCE_FACTOR = float(os.getenv("STATION_PRUNE_DISTANCE_FACTOR", "0.9"))
+
+# Ambient temperature (in degrees Celsius) assumed for a leg when no reading is available. Below the 10 degree
+# threshold, so the more conservative cold discharge rates are used. Empty to leave such stations without a SOC
+DEGRADED_TEMPERATURE = os.getenv("DEGRADED_TEMPERATURE", "5")
+DEGRADED_TEMPERATURE = float(DEGRADED_TEMPERATURE) if DEGRADED_TEMPERATURE else None
+# Elevation change (in meters) assumed for a leg when the elevation lookup fails. Empty to leave such stations without a SOC
+DEGRADED_ALTITUDE_CHANGE = os.getenv("DEGRADED_ALTITUDE_CHANGE", "0")
+DEGRADED_ALTITUDE_CHANGE = float(DEGRADED_ALTITUDE_CHANGE) if DEGRADED_ALTITUDE_CHANGE else None
+
 
 
 def get_coordinates(geolocator, address):
@@ -59,24 +495,18 @@ def get_coordinates(geolocator, address):
 
     Returns:
     tuple: A pair of floats (latitude, longitude) representing the geographic coordinates of the address.
-           Returns None if the address cannot be found or if an error occurs.
+           Returns None if the address cannot be found.
 
     This function attempts to find the latitude and longitude of an address. If successful, it returns the coordinates.
-    If the address is not found or if a geocoding service error occurs, appropriate errors are logged, and None is returned.
+    If the address is not found, an error is logged and None is returned. Geocoding service errors (e.g. GeocoderTimedOut)
+    are raised, so the Geocoder can tell a failed lookup, which is tried again, from an address that does not exist.
     """
 
-    try:
-        location = geolocator.geocode(address)
-        if location:
-            return location.latitude, location.longitude
-        logging.error("Address not found. Please enter a valid address.")
-        return None
-    except GeocoderTimedOut:
-        logging.error("Geocoding service timed out. Please try again later.")
-        return None
-    except Exception as e:
-        logging.error(f"Error occurred: {e}")
-        return None
+    location = geolocator.geocode(address)
+    if location:
+        return location.latitude, location.longitude
+    logging.error("Address not found. Please enter a valid address.")
+    return None
 
 
 
@@ -97,7 +527,7 @@ def is_percentage(value):
 
     return 0 <= value <= 100
 
-def get_temperature(latitude, longitude):
+async def get_temperature(latitude, longitude):
 
     """
     Retrieve the current temperature for specified geographic coordinates.
@@ -110,33 +540,15 @@ def get_temperature(latitude, longitude):
     float: The current temperature at the given location. Returns None if the temperature
            cannot be fetched or an error occurs.
 
-    This function fetches the current temperature using an external weather API.
-    It handles various response scenarios and logs any errors encountered during the request.
+    This function reads the temperature through the shared TemperatureService, which snaps the point to a grid cell
+    and only calls the external weather API when no fresh reading is cached for that cell.
     """
 
-    url = 'https://api.open-meteo.com/v1/forecast'
-    params = {
-        'latitude': latitude,
-        'longitude': longitude,
-        'current_weather': 'true',
-        'hourly': 'temperature_2m'
-    }
-
-    try:
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            return data['current_weather']['temperature']
-        else:
-            logging.error(f"Error fetching temperature: {response.json().get('error')}")
-            return None
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error occurred during temperature request: {e}")
-        return None
+    return await temperature_service.get_temperature(latitude, longitude)
 
 
     
-def fetch_charging_station_data(api_key, latitude, longitude, max_radius):
+async def fetch_charging_station_data(api_key, latitude, longitude, max_radius):
    
     """
     Fetches charging station data from the Open Charge Map API based on given coordinates and search radius.
@@ -155,10 +567,9 @@ def fetch_charging_station_data(api_key, latitude, longitude, max_radius):
     fails or returns a different status code, the function logs an error message and returns None.
     """
 
-    ocm_url = 'https://api.openchargemap.io/v3/poi/'
     params = {
         "output": "json",
-        "maxresults": 10,
+        "maxresults": STATION_CANDIDATE_POOL,
         "compact": False,
         "verbose": False,
         "key": api_key,
@@ -170,18 +581,88 @@ def fetch_charging_station_data(api_key, latitude, longitude, max_radius):
     }
     
     try:
-        response = requests.get(ocm_url, params=params)
+        response = await get_provider("ocm").get(OCM_URL, params=params)
         if response.status_code == 200:
             return response.json()
         else:
             logging.error(f"Failed to get charging station data: {response.status_code}")
             return None
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logging.error(f"Error occurred during charging station data request: {e}")
         return None
 
 
-def get_charging_stations(api_key, coordinates, max_radius):
+async def fetch_corridor_station_data(api_key, points, corridor_km):
+
+    """
+    Fetches the charging stations along a route from the Open Charge Map API.
+
+    Args:
+    api_key (str): The API key for accessing the Open Charge Map API.
+    points (list): (latitude, longitude) points along the route.
+    corridor_km (float): Maximum distance of a station from the route in kilometers.
+
+    Returns:
+    list or None: The charging stations near the route if successful, None otherwise.
+
+    The route is sent as an encoded polyline, so a single request covers the whole corridor.
+    """
+
+    params = {
+        "output": "json",
+        "maxresults": PLAN_MAX_CANDIDATES,
+        "compact": False,
+        "verbose": False,
+        "key": api_key,
+        "polyline": encode_polyline(points),
+        "distance": corridor_km,
+        "distanceunit": "KM",
+        "includechargingprices": True
+    }
+
+    try:
+        response = await get_provider("ocm").get(OCM_URL, params=params)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            logging.error(f"Failed to get charging stations along the route: {response.status_code}")
+            return None
+    except httpx.HTTPError as e:
+        logging.error(f"Error occurred during corridor charging station request: {e}")
+        return None
+
+
+def ocm_station_dict(station):
+
+    """
+    Converts a charging station returned by the Open Charge Map API into the station dictionary format of the navigator.
+
+    Args:
+    station (dict): The charging station (POI) from the API response.
+
+    Returns:
+    dict: The station location, name, operator, usage type, cost and connections, each connection with its type, price
+    and power in kW (None if unknown).
+    """
+
+    return {
+        'location': (station.get("AddressInfo", {}).get("Latitude"), station.get("AddressInfo", {}).get("Longitude")),
+        'name': station.get("AddressInfo", {}).get("Title", "Unknown"),
+        'operator': station.get('OperatorInfo', {}).get('Title', "Unknown"),
+        'usage_type': station.get('UsageType', {}).get('Title', "Unknown"),
+        'usage_cost': station.get('UsageCost', "Unknown"),
+        'connections': [
+            {
+                'connection_type': conn.get('ConnectionType', {}).get('Title', "Unknown"),
+                'price': conn.get('PricingModel', "Unknown"),
+                'power_kw': conn.get('PowerKW'),
+            }
+            for conn in station.get('Connections', [])
+        ]
+    }
+
+
+async def get_charging_stations(api_key, coordinates, max_radius):
     
     """
     Retrieves a list of charging stations within a specified radius of given coordinates.
@@ -194,41 +675,35 @@ def get_charging_stations(api_key, coordinates, max_radius):
     Returns:
     list: A list of dictionaries, each containing information about a charging station.
 
-    The function splits the coordinates into latitude and longitude, and then calls fetch_charging_station_data to retrieve
-    charging stations data from the Open Charge Map API. It processes the API response and constructs a list of dictionaries
+    The function splits the coordinates into latitude and longitude. When the local station mirror holds data, every station
+    within the radius is returned from its spatial index, nearest first. Otherwise it answers from the station set cache or calls
+    fetch_charging_station_data to retrieve charging stations data from the Open Charge Map API. It processes the API response and constructs a list of dictionaries
     with relevant information about each station, including location, name, operator, usage type, cost, and connection details.
     If no data is received, it logs a warning and returns an empty list.
     """
 
     latitude, longitude = map(float, coordinates.split(','))
-    ocm_data = fetch_charging_station_data(api_key, latitude, longitude, max_radius)
+    if len(station_mirror):
+        return station_mirror.query(latitude, longitude, max_radius, limit=STATION_CANDIDATE_POOL)
+
+    cached = station_sets.get(coordinates, max_radius)
+    if cached is not None:
+        return cached
+
+    ocm_data = await fetch_charging_station_data(api_key, latitude, longitude, max_radius)
 
     if ocm_data is None:
         logging.warning("No charging station data received.")
         return []
 
-    stations_info = []
-    for station in ocm_data:
-        station_dict = {
-            'location': (station.get("AddressInfo", {}).get("Latitude"), station.get("AddressInfo", {}).get("Longitude")),
-            'name': station.get("AddressInfo", {}).get("Title", "Unknown"),
-            'operator': station.get('OperatorInfo', {}).get('Title', "Unknown"),
-            'usage_type': station.get('UsageType', {}).get('Title', "Unknown"),
-            'usage_cost': station.get('UsageCost', "Unknown"),
-            'connections': [
-                {
-                    'connection_type': conn.get('ConnectionType', {}).get('Title', "Unknown"),
-                    'price': conn.get('PricingModel', "Unknown")
-                }
-                for conn in station.get('Connections', [])
-            ]
-        }
-        stations_info.append(station_dict)
+    stations_info = [ocm_station_dict(station) for station in ocm_data]
 
+    if stations_info:
+        station_sets.put(coordinates, max_radius, stations_info)
     return stations_info
 
 
-def get_route_info(origin, destination):
+async def get_route_info(origin, destination, route_path=False):
     
     """
     Retrieves detailed route information for driving from the origin to the destination.
@@ -236,6 +711,7 @@ def get_route_info(origin, destination):
     Args:
     origin (str): The starting point coordinates.
     destination (str): The endpoint coordinates.
+    route_path (bool): Also request the full route geometry (routePath), as needed to plan charging stops along it.
 
     Returns:
     dict: A dictionary containing route details if successful, None otherwise.
@@ -245,19 +721,21 @@ def get_route_info(origin, destination):
     exception, an error is logged, and None is returned.
     """
 
-    url = "http://dev.virtualearth.net/REST/V1/Routes/Driving"
+    url = f"{BING_MAPS_URL}/Routes/Driving"
     params = {
         "wp.0": origin,
         "wp.1": destination,
         "avoid": "minimizeTolls",
         "key": BING_MAPS_API_KEY,
     }
+    if route_path:
+        params["routeAttributes"] = "routePath"
 
     try:
-        response = requests.get(url, params=params)
+        response = await get_provider("bing_routes").get(url, params=params)
         response.raise_for_status()
         return response.json()
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         logging.error(f"Error fetching route information: {e}")
         return None
 
@@ -327,90 +805,50 @@ def analyze_route(route_data):
         logging.error("Error analyzing route data. Invalid data structure.")
         return None, 0
 
-def get_ev_information(model):
-    
+async def lookup_ev_model(model):
+
     """
-    Retrieves electric vehicle information from the database for a specified model.
+    Looks up an EV model in the catalog, falling back to the database for models missing from it.
 
     Args:
-    model (str): The model of the electric vehicle.
+    model (str): The EV model as entered by the user.
 
     Returns:
-    tuple: A tuple containing various attributes of the EV, or None if an error occurs.
+    EVSpec: The specification of the model, or None if the model is not in the database.
 
-    This function connects to the MySQL database to retrieve EV data. It queries the database for specific EV
-    model attributes. If the model is found, it returns various attributes like usable capacity, charge port types,
-    and efficiency rates. It handles database connection errors and cases where the EV model is not found.
+    Raises HTTPException (503) when the database cannot be queried, so an outage is never reported as an unknown model.
     """
 
-    
     try:
-        cnx = mysql.connector.connect(
-            host="db",  # Use the service name specified in docker-compose.yml
-            user="root",
-            password="password",
-            database="ev_database"
-        )
+        return await ev_catalog.lookup(model)
+    except CatalogUnavailableError:
+        raise HTTPException(status_code=503, detail="Could not look up the EV model in the database")
 
-    except mysql.connector.Error as err:
-        logging.error(f"Something went wrong: {err}")
-        return None
+async def get_ev_information(model):
     
-    # Create a cursor to execute SQL queries
-    cursor = cnx.cursor()
+    """
+    Retrieves electric vehicle information from the in-memory catalog for a specified model.
 
-    # Define the SQL query
-    query = "SELECT EV_model, Useable_Capacity, Charge_Port, Fast_charge_port, charge_power, charge_speed, city_cold_rate, highway_cold_rate, combined_cold_rate, city_mild_rate, highway_mild_rate, combined_mild_rate, weight FROM ev_data"
+    Args:
+    model (str): The model of the electric vehicle.
 
-    # Execute the query
-    cursor.execute(query)
+    Returns:
+    tuple: A tuple containing various attributes of the EV, or None if the model is not found.
 
-    # Fetch all rows from the result
-    rows = cursor.fetchall()
+    The lookup is a single dictionary access on the normalized model name. Models added to the database since the
+    catalog was loaded are fetched once with a parameterized single-row query on the indexed model_key column.
+    Numeric attributes such as the usable capacity, charge power and discharge rates are returned as floats.
+    """
 
-    # Find the matching EV model
-    formatted_model = model.replace(" ", "-").title()
-    try:
-        for row in rows:
-            if row[0] == formatted_model:
-                ev_model = row[0]
-                useable_capacity_str = row[1]
-                charge_port = row[2]
-                fast_charge_port = row[3]
-                charge_power = row[4]
-                charge_speed = row[5]
-                city_cold_rate_str = row[6]
-                highway_cold_rate_str = row[7]
-                combined_cold_rate_str = row[8]
-                city_mild_rate_str = row[9]
-                highway_mild_rate_str = row[10]
-                combined_mild_rate_str = row[11]
-                weight = row[12]
-                break  # Stop iterating after finding the matching EV model
-        else:
-            logging.error("EV model not found in the database")
-            return None
-    except mysql.connector.Error as err:
-        logging.error(f"Database connection error: {err}")
+    spec = await lookup_ev_model(model)
+    if spec is None:
+        logging.error("EV model not found in the database")
         return None
 
-    # Close the cursor and database connection
-    cursor.close()
-    cnx.close()
-
-    rates = {
-            'city_cold_rate_str': city_cold_rate_str,
-            'highway_cold_rate_str': highway_cold_rate_str,
-            'combined_cold_rate_str': combined_cold_rate_str,
-            'city_mild_rate_str': city_mild_rate_str,
-            'highway_mild_rate_str': highway_mild_rate_str,
-            'combined_mild_rate_str': combined_mild_rate_str,
-        }
-    
-    return useable_capacity_str, charge_port, fast_charge_port, charge_power, charge_speed, rates, weight
+    return spec.useable_capacity, spec.charge_port, spec.fast_charge_port, spec.charge_power, spec.charge_speed, spec.rates(), spec.weight
 
     
-def get_elevation_change(origin_coords, destination_coords, bing_maps_key):
+async def get_elevation_change(origin_coords, destination_coords, bing_maps_key):
     
     """
     Calculates the elevation change between two geographic coordinates using Bing Maps API.
@@ -423,14 +861,21 @@ def get_elevation_change(origin_coords, destination_coords, bing_maps_key):
     Returns:
     float or str: The elevation change in meters, or 'Unknown' in case of an error.
 
-    The function constructs an API request to Bing Maps to get elevation data for the specified coordinates.
+    The elevation change is read from the local elevation model when its tiles cover both points. Otherwise the function
+    constructs an API request to Bing Maps to get elevation data for the specified coordinates.
     It calculates the elevation change and handles possible request exceptions by logging errors and returning 'Unknown'.
     """
 
-    elevation_url = f'http://dev.virtualearth.net/REST/v1/Elevation/List?points={origin_coords},{destination_coords}&key={bing_maps_key}'
+    elevation_change = elevation_model.elevation_change(
+        tuple(map(float, origin_coords.split(','))), tuple(map(float, destination_coords.split(',')))
+    )
+    if elevation_change is not None:
+        return elevation_change
+
+    elevation_url = f'{BING_MAPS_URL}/Elevation/List?points={origin_coords},{destination_coords}&key={bing_maps_key}'
 
     try:
-        elevation_response = requests.get(elevation_url)
+        elevation_response = await get_provider("bing_elevation").get(elevation_url)
         elevation_response.raise_for_status()
         elevation_data = elevation_response.json()
 
@@ -441,13 +886,54 @@ def get_elevation_change(origin_coords, destination_coords, bing_maps_key):
         else:
             logging.warning("No elevation data found in the Bing Maps API response.")
             return "Unknown"
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         logging.error(f"An error occurred while fetching elevation data: {e}")
         return "Unknown"
 
 
 
-def get_walking_route(origin_coords, destination_coords, bing_maps_key):
+async def get_elevations(points, bing_maps_key):
+
+    """
+    Looks up the elevation of many points using the Bing Maps API.
+
+    Args:
+    points (list): (latitude, longitude) pairs.
+    bing_maps_key (str): Bing Maps API key.
+
+    Returns:
+    list: The elevation of each point in meters, None where it could not be retrieved.
+
+    Points covered by the local elevation model are answered from it. The others are sent ELEVATION_BATCH_SIZE at a time,
+    with all batches requested concurrently. A failed batch only leaves its own points unknown.
+    """
+
+    local = elevation_model.elevations([point[0] for point in points], [point[1] for point in points]).tolist()
+    remote = [index for index, elevation in enumerate(local) if elevation != elevation]  # NaN where not covered
+
+    async def fetch_batch(batch):
+        coordinates = ",".join(f"{latitude},{longitude}" for latitude, longitude in batch)
+        try:
+            response = await get_provider("bing_elevation").get(f'{BING_MAPS_URL}/Elevation/List', params={"points": coordinates, "key": bing_maps_key})
+            response.raise_for_status()
+            elevations = response.json()['resourceSets'][0]['resources'][0]['elevations']
+            if len(elevations) == len(batch):
+                return elevations
+            logging.warning("Bing Maps returned fewer elevations than requested.")
+        except httpx.HTTPError as e:
+            logging.error(f"An error occurred while fetching elevation data: {e}")
+        except (KeyError, IndexError, ValueError) as e:
+            logging.warning(f"No elevation data found in the Bing Maps API response: {e}")
+        return [None] * len(batch)
+
+    batches = [[points[index] for index in remote[i:i + ELEVATION_BATCH_SIZE]] for i in range(0, len(remote), ELEVATION_BATCH_SIZE)]
+    results = await asyncio.gather(*(fetch_batch(batch) for batch in batches))
+    for index, elevation in zip(remote, (elevation for batch in results for elevation in batch)):
+        local[index] = elevation
+    return local
+
+
+async def get_walking_route(origin_coords, destination_coords, bing_maps_key):
 
     """
     Calculates the walking route distance and duration between two coordinates using Bing Maps API.
@@ -464,10 +950,10 @@ def get_walking_route(origin_coords, destination_coords, bing_maps_key):
     by returning 'Unknown' values for both distance and duration.
     """
 
-    route_url = f'http://dev.virtualearth.net/REST/V1/Routes/Walking?wp.0={origin_coords}&wp.1={destination_coords}&optmz=distance&key={bing_maps_key}'
+    route_url = f'{BING_MAPS_URL}/Routes/Walking?wp.0={origin_coords}&wp.1={destination_coords}&optmz=distance&key={bing_maps_key}'
     
     try:
-        route_response = requests.get(route_url)
+        route_response = await get_provider("bing_walking").get(route_url)
         route_response.raise_for_status()
         route_data = route_response.json()
     
@@ -478,76 +964,221 @@ def get_walking_route(origin_coords, destination_coords, bing_maps_key):
             return travel_distance, travel_duration / 60  # Convert duration to minutes
         else:
             return "Unknown", "Unknown"
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
 
         return "Unknown", "Unknown"
 
 
 
-def calculate_soc(altitude_change, useable_capacity_str, weight, initial_SOC, temperature, route_info, rates_dict):
+async def get_walking_matrix(origins, destination_coords, bing_maps_key):
 
     """
-    Calculates the State of Charge (SOC) for an electric vehicle considering various factors.
+    Calculates walking distances and durations from many origins to a single destination using the Bing Maps Distance Matrix API.
 
     Args:
-    altitude_change (float): Change in altitude between origin and destination.
-    useable_capacity_str (str): String representing the usable battery capacity.
-    weight (float): Weight in kg of the vehicle.
-    initial_SOC (float): Initial state of charge as a percentage.
-    temperature (float): Ambient temperature.
-    route_info (dict): Information about the route including distances by road type.
-    rates_dict (dict): Dictionary containing discharge rates.
+    origins (list): The starting coordinates (str) of each walking leg.
+    destination_coords (str): The shared ending coordinates.
+    bing_maps_key (str): Bing Maps API key.
 
     Returns:
-    tuple: A tuple containing final SOC and altitude-adjusted SOC percentages.
+    list: One entry per origin, either a tuple of the walking distance in kilometers and duration in minutes, or None when
+          the matrix could not provide that leg.
 
-    The function calculates energy consumption based on road type, distance traveled, and discharge rates.
-    It adjusts the SOC for potential energy  lost due to positive altitude changes. Exception handling is used
-    to manage potential calculation errors, returning None in such cases.
+    Origins are sent in chunks of WALKING_MATRIX_CHUNK_SIZE so that each request stays within the Distance Matrix limits.
+    The chunks are requested concurrently. Failed chunks and cells reported as unreachable are left as None.
     """
 
-    try:
+    url = f'{BING_MAPS_URL}/Routes/DistanceMatrix'
+    chunks = [origins[i:i + WALKING_MATRIX_CHUNK_SIZE] for i in range(0, len(origins), WALKING_MATRIX_CHUNK_SIZE)]
+
+    async def fetch_chunk(chunk):
+        params = {
+            "origins": ";".join(chunk),
+            "destinations": destination_coords,
+            "travelMode": "walking",
+            "distanceUnit": "km",
+            "timeUnit": "minute",
+            "key": bing_maps_key,
+        }
+        legs = [None] * len(chunk)
+        try:
+            response = await get_provider("bing_distance_matrix").get(url, params=params)
+            response.raise_for_status()
+            results = response.json()['resourceSets'][0]['resources'][0]['results']
+        except (httpx.HTTPError, ValueError, KeyError, IndexError) as e:
+            logging.error(f"Error fetching walking distance matrix: {e}")
+            return legs
+
+        for cell in results:
+            index = cell.get('originIndex')
+            distance = cell.get('travelDistance', -1)
+            duration = cell.get('travelDuration', -1)
+            if cell.get('hasError') or index is None or not 0 <= index < len(chunk) or distance < 0 or duration < 0:
+                continue
+            legs[index] = (distance, duration)
+        return legs
+
+    chunk_legs = await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks))
+    return [leg for legs in chunk_legs for leg in legs]
+
+
+async def fetch_walking_legs(origins, destination_coords, bing_maps_key):
 
-        weight = float(weight)  # Make sure weight is a float for calculations
-        useable_capacity = float(useable_capacity_str.split()[0])
-        potential_energy = (altitude_change * 9.81 * weight) / 3600000      
-        discharge_highway = float(rates_dict['highway_cold_rate_str'].split()[0])
-        discharge_city = float(rates_dict['city_cold_rate_str'].split()[0])
-        
-        # Calculate highway and city kilometers based on the route info
-        highway_kilometers = (
-            route_info["LimitedAccessHighway"]["distance"]
-            + route_info["Highway"]["distance"]
-            + route_info["Ramp"]["distance"]
-            + route_info["Arterial"]["distance"]
-            + route_info["MajorRoad"]["distance"]
-        )
-        
+    """
+    Retrieves the walking leg from every origin to the destination, using the distance matrix first and per-pair routes as a fallback.
 
-        city_kilometers = route_info["Street"]["distance"] + route_info["LocalRoad"]["distance"]
-        
+    Args:
+    origins (list): The starting coordinates (str) of each walking leg.
+    destination_coords (str): The shared ending coordinates.
+    bing_maps_key (str): Bing Maps API key.
 
-        if not rates_dict or all(value is None for value in rates_dict.values()):
-            logging.error("Insufficient data to calculate SOC.")
-            return None, None
-        else:
-            temperature_threshold = 10
-            if temperature < temperature_threshold:
-                discharge_highway = float(rates_dict['highway_cold_rate_str'].split()[0])
-                discharge_combined = float(rates_dict['combined_cold_rate_str'].split()[0])
-                discharge_city = float(rates_dict['city_cold_rate_str'].split()[0])
-            else:
-                discharge_highway = float(rates_dict['highway_mild_rate_str'].split()[0])
-                discharge_combined = float(rates_dict['combined_mild_rate_str'].split()[0])
-                discharge_city = float(rates_dict['city_mild_rate_str'].split()[0])
+    Returns:
+    list: One tuple of walking distance in kilometers and duration in minutes per origin, in the same order as origins.
+          Legs that cannot be computed are returned as ('Unknown', 'Unknown').
 
-            final_SOC = ((initial_SOC * float(useable_capacity) * 10 - (discharge_highway * highway_kilometers + discharge_city * city_kilometers)) / (float(useable_capacity) * 1000)) * 100
-            
-            if altitude_change > 0:
-                adjusted_SOC = final_SOC - potential_energy
-            else:
-                adjusted_SOC = final_SOC
-        
+    Only legs missing from the matrix response are requested individually through get_walking_route.
+    """
+
+    legs = await get_walking_matrix(origins, destination_coords, bing_maps_key)
+    missing = [i for i, leg in enumerate(legs) if leg is None]
+    if missing:
+        logging.warning(f"Distance matrix missing {len(missing)} walking legs, falling back to per-pair routes.")
+        fallback = await asyncio.gather(*(get_walking_route(origins[i], destination_coords, bing_maps_key) for i in missing))
+        for i, leg in zip(missing, fallback):
+            legs[i] = leg
+    return legs
+
+
+async def get_walking_legs(origins, destination_coords, bing_maps_key):
+
+    """
+    Retrieves the walking leg from every origin to the destination, from the walking leg cache where possible.
+
+    Args:
+    origins (list): The starting coordinates (str) of each walking leg.
+    destination_coords (str): The shared ending coordinates.
+    bing_maps_key (str): Bing Maps API key.
+
+    Returns:
+    list: One tuple of walking distance in kilometers and duration in minutes per origin, in the same order as origins.
+          Legs that cannot be computed are returned as ('Unknown', 'Unknown').
+
+    Legs are routed on the offline walking network when it is loaded. Legs it cannot route are looked up in the cache,
+    and the rest are fetched with fetch_walking_legs; complete fetched legs are cached for later requests.
+    """
+
+    if not origins:
+        return []
+
+    legs = await offline_walking_legs(origins, destination_coords)
+    unrouted = [i for i, leg in enumerate(legs) if leg is None]
+    cached = await asyncio.gather(*(walking_cache.get(origins[i], destination_coords) for i in unrouted))
+    for i, leg in zip(unrouted, cached):
+        legs[i] = leg
+    missing = [i for i, leg in enumerate(legs) if leg is None]
+    if missing:
+        fetched = await fetch_walking_legs([origins[i] for i in missing], destination_coords, bing_maps_key)
+        for i, leg in zip(missing, fetched):
+            legs[i] = leg
+        await asyncio.gather(*(
+            walking_cache.put(origins[i], destination_coords, legs[i])
+            for i in missing if is_number(legs[i][0]) and is_number(legs[i][1])
+        ))
+    return legs
+
+
+async def offline_walking_legs(origins, destination_coords):
+
+    """
+    Routes walking legs from many origins to one destination on the offline walking network.
+
+    Args:
+    origins (list): The starting coordinates (str) of each walking leg.
+    destination_coords (str): The shared ending coordinates.
+
+    Returns:
+    list: One tuple of walking distance in kilometers and duration in minutes per origin, or None for legs the network
+          cannot route. All None until the network is loaded.
+    """
+
+    network = road_network.walking
+    if network is None:
+        return [None] * len(origins)
+    points = [tuple(map(float, origin.split(','))) for origin in origins]
+    destination = tuple(map(float, destination_coords.split(',')))
+    with timed("offline_routing"):
+        routes = await asyncio.to_thread(network.many_to_one, points, destination)
+    return [None if route is None else (route.km, route.seconds / 60) for route in routes]
+
+
+
+def calculate_soc(altitude_change, useable_capacity, weight, initial_SOC, temperature, route_info, rates_dict, total_ascent=None):
+
+    """
+    Calculates the State of Charge (SOC) for an electric vehicle considering various factors.
+
+    Args:
+    altitude_change (float): Change in altitude between origin and destination.
+    useable_capacity (float): Usable battery capacity in kWh.
+    weight (float): Weight in kg of the vehicle.
+    initial_SOC (float): Initial state of charge as a percentage.
+    temperature (float): Ambient temperature.
+    route_info (dict): Information about the route including distances by road type.
+    rates_dict (dict): Dictionary containing discharge rates in Wh/km.
+    total_ascent (float): Total climb in meters along the route, if known.
+
+    Returns:
+    tuple: A tuple containing final SOC and altitude-adjusted SOC percentages.
+
+    The function calculates energy consumption based on road type, distance traveled, and discharge rates.
+    It adjusts the SOC for potential energy  lost due to positive altitude changes, or to the total ascent along the
+    route when it is given, since every climb costs energy even when the route ends lower than it started. Exception handling is used
+    to manage potential calculation errors, returning None in such cases.
+    """
+
+    try:
+
+        weight = float(weight)  # Make sure weight is a float for calculations
+        if math.isnan(weight):
+            raise ValueError("the EV weight is not a number")
+        useable_capacity = parse_quantity(useable_capacity)
+        climb = altitude_change if total_ascent is None else total_ascent
+        potential_energy = (climb * 9.81 * weight) / 3600000      
+        
+        # Calculate highway and city kilometers based on the route info
+        highway_kilometers = (
+            route_info["LimitedAccessHighway"]["distance"]
+            + route_info["Highway"]["distance"]
+            + route_info["Ramp"]["distance"]
+            + route_info["Arterial"]["distance"]
+            + route_info["MajorRoad"]["distance"]
+        )
+        
+
+        city_kilometers = route_info["Street"]["distance"] + route_info["LocalRoad"]["distance"]
+        
+
+        if not rates_dict or all(value is None for value in rates_dict.values()):
+            logging.error("Insufficient data to calculate SOC.")
+            return None, None
+        else:
+            temperature_threshold = 10
+            if temperature < temperature_threshold:
+                discharge_highway = parse_quantity(rates_dict['highway_cold_rate'])
+                discharge_combined = parse_quantity(rates_dict['combined_cold_rate'])
+                discharge_city = parse_quantity(rates_dict['city_cold_rate'])
+            else:
+                discharge_highway = parse_quantity(rates_dict['highway_mild_rate'])
+                discharge_combined = parse_quantity(rates_dict['combined_mild_rate'])
+                discharge_city = parse_quantity(rates_dict['city_mild_rate'])
+
+            final_SOC = ((initial_SOC * float(useable_capacity) * 10 - (discharge_highway * highway_kilometers + discharge_city * city_kilometers)) / (float(useable_capacity) * 1000)) * 100
+            
+            if climb > 0:
+                adjusted_SOC = final_SOC - potential_energy
+            else:
+                adjusted_SOC = final_SOC
+        
         return final_SOC, adjusted_SOC
 
     except Exception as e:
@@ -556,108 +1187,856 @@ def calculate_soc(altitude_change, useable_capacity_str, weight, initial_SOC, te
 
 
 
-def your_main_code(data: RouteCalculationData):
+async def evaluate_station(station, origin_coordinates):
+
     """
-    Processes user input to find optimal charging stations and calculate SoC around the final destination of an electric vehicle trip.
+    Runs the independent provider lookups needed to evaluate a single charging station.
 
     Args:
-    data (RouteCalculationData): User inputs including EV model, origin, destination, maximum search radius, initial state of charge (SoC), and fast charging priority.
+    station (dict): Charging station information as returned by get_charging_stations.
+    origin_coordinates (str): The trip origin coordinates, formatted as "lat,lon".
 
     Returns:
-    dict: Dictionary containing a success message and a list of suitable charging stations and parameters such as final SoC or walking time at each station.
+    dict: The analyzed route, elevation change and, with a local elevation model, total ascent for the station.
+
+    Legs already in the leg cache are served without any request. When the offline road network is loaded, the driving
+    route comes from it and only the elevation is looked up. Otherwise the driving route and elevation requests, which
+    do not depend on each other, are issued concurrently and the analyzed leg is cached. With a local elevation model
+    the route geometry is requested as well, and the climb along it is measured on the model. The shared HTTP client
+    enforces the global concurrency limit across all stations. Walking legs and temperatures are resolved for all
+    stations at once by get_walking_legs and the shared TemperatureService.
+    """
+
+    origin = tuple(map(float, origin_coordinates.split(',')))
+    cached = await leg_cache.get(origin, station['location'])
+    if cached is not None:
+        route_info, segment_distances_sum, altitude_change, total_ascent = cached
+        return {
+            "route_info": route_info,
+            "altitude_change": altitude_change,
+            "total_ascent": total_ascent,
+        }
+
+    station_coordinates = f"{station['location'][0]},{station['location'][1]}"
+    offline = await offline_driving_leg(origin, station['location'])
+    if offline is not None:
+        route_info, total_ascent = offline
+        altitude_change = await get_elevation_change(origin_coordinates, station_coordinates, BING_MAPS_API_KEY)
+        return {
+            "route_info": route_info,
+            "altitude_change": altitude_change,
+            "total_ascent": total_ascent,
+        }
+
+    route_data, altitude_change = await asyncio.gather(
+        get_route_info(origin_coordinates, station_coordinates, route_path=elevation_model.enabled),
+        get_elevation_change(origin_coordinates, station_coordinates, BING_MAPS_API_KEY),
+    )
+    route_info, segment_distances_sum = analyze_route(route_data)
+    total_ascent = await asyncio.to_thread(route_ascent, route_data) if elevation_model.enabled else None
+    # Only complete legs are cached, so failed lookups are retried on the next request
+    if route_info is not None and isinstance(altitude_change, (int, float)):
+        await leg_cache.put(origin, station['location'], route_info, segment_distances_sum, altitude_change, total_ascent)
+
+    return {
+        "route_info": route_info,
+        "altitude_change": altitude_change,
+        "total_ascent": total_ascent,
+    }
+
+
+async def offline_driving_leg(origin, destination):
 
-    The function integrates several steps: retrieving EV information, converting locations to coordinates, getting temperature data, fetching charging stations, and calculating SoC. 
-    Each charging station is evaluated for its suitability based on the route, available chargers, and expected SoC upon arrival. Exception handling ensures appropriate responses in case of data retrieval issues or missing information.
     """
-    
-    # Initialize the geolocator and extract necessary data from the input
+    Routes a driving leg on the offline road network.
+
+    Args:
+    origin (tuple): Latitude and longitude of the trip origin.
+    destination (tuple): Latitude and longitude of the charging station.
+
+    Returns:
+    tuple: The route info as produced by analyze_route and, with a local elevation model, the total ascent along the
+           route in meters; None if the network is not loaded or cannot route the leg.
+
+    The network keeps the origin's search between calls, so routing from one origin to every candidate station costs
+    one search per station on top of a single origin search.
+    """
+
+    network = road_network.driving
+    if network is None:
+        return None
+    with timed("offline_routing"):
+        route = (await asyncio.to_thread(network.one_to_many, origin, [destination]))[0]
+    if route is None:
+        return None
+    route_info, _ = offline_route_info(route)
+    total_ascent = None
+    if elevation_model.enabled:
+        climb = await asyncio.to_thread(lambda: elevation_model.route_climb(network.path_points(route)))
+        total_ascent = None if climb is None else round(climb[0], 1)
+    return route_info, total_ascent
+
+
+def route_ascent(route_data):
+
+    """
+    Measures the total climb along a Bing Maps route on the local elevation model.
+
+    Args:
+    route_data (dict): Route data from Bing Maps, requested with the route geometry.
+
+    Returns:
+    float: The total ascent in meters, or None if the route has no geometry or the model does not cover all of it.
+    """
+
+    try:
+        points = route_data["resourceSets"][0]["resources"][0]["routePath"]["line"]["coordinates"]
+    except (KeyError, IndexError, TypeError):
+        return None
+    climb = elevation_model.route_climb(points)
+    return None if climb is None else round(climb[0], 1)
+
+
+
+async def prewarm_destination(target):
+
+    """
+    Warms everything a trip to a destination fetches that does not depend on its origin or EV.
+
+    Args:
+    target (PrewarmTarget): The destination address and station search radius.
+
+    Returns:
+    bool: True if the destination was found and its charging stations were warmed.
+
+    The destination is geocoded and its candidate charging stations looked up, then the walking legs from and the
+    temperatures at the STATION_TOP_K nearest stations are fetched, as the stations a trip evaluates are usually
+    among them.
+    """
+
+    coordinates = await geocoder.geocode(target.address)
+    if coordinates is None:
+        return False
+    destination_coordinates = f"{coordinates[0]},{coordinates[1]}"
+    charging_stations = await get_charging_stations(OCM_API_KEY, destination_coordinates, target.max_radius)
+    if not charging_stations:
+        return False
+    nearest = charging_stations[:STATION_TOP_K]
+    await asyncio.gather(
+        get_walking_legs([f"{station['location'][0]},{station['location'][1]}" for station in nearest], destination_coordinates, BING_MAPS_API_KEY),
+        temperature_service.get_temperatures([station['location'] for station in nearest]),
+    )
+    return True
+
+
+async def prewarm_origin(target):
+
+    """
+    Warms the coordinates and the temperature of a common trip origin.
+
+    Returns:
+    bool: True if the origin was found.
+    """
+
+    coordinates = await geocoder.geocode(target.address)
+    if coordinates is None:
+        return False
+    await get_temperature(*coordinates)
+    return True
+
+
+async def get_corridor(origin, destination, corridor_km):
+
+    """
+    Retrieves the driving route between two points with the charging stations near it.
+
+    Args:
+    origin (tuple): Latitude and longitude of the origin.
+    destination (tuple): Latitude and longitude of the destination.
+    corridor_km (float): Maximum distance of a station from the route in kilometers.
+
+    Returns:
+    Corridor: The route profile, the stations within corridor_km of the route and the elevations of the origin, the
+    stations and the destination, or None if the route could not be retrieved.
+
+    Stations come from the local mirror when it holds data and from a single Open Charge Map polyline search otherwise.
+    Corridors whose elevations are all known are cached, so plans between the same places only repeat the search.
+    """
+
+    key = (origin, destination, corridor_km)
+    cached = corridors.get(key)
+    if cached is not None:
+        return cached
+
+    route_data = await get_route_info(f"{origin[0]},{origin[1]}", f"{destination[0]},{destination[1]}", route_path=True)
+    profile = route_profile(route_data, get_road_type) if route_data else None
+    if profile is None:
+        return None
+
+    points = sample_points(profile, corridor_km)
+    if len(station_mirror):
+        stations = station_mirror.query_corridor(points, corridor_km, limit=PLAN_MAX_CANDIDATES)
+    else:
+        stations = [ocm_station_dict(station) for station in await fetch_corridor_station_data(OCM_API_KEY, points, corridor_km) or []]
+    stations = [station for station in stations if None not in station['location']]
+
+    route_km, offset_km = project_stations(profile, stations)
+    near = offset_km <= corridor_km
+    stations = [station for station, keep in zip(stations, near) if keep]
+    elevations = await get_elevations([origin] + [station['location'] for station in stations] + [destination], BING_MAPS_API_KEY)
+    ascent = await asyncio.to_thread(profile_ascent, profile, elevation_model) if elevation_model.enabled else None
+
+    corridor = Corridor(profile, stations, route_km[near], offset_km[near], elevations, ascent)
+    if None not in elevations:
+        corridors.put(key, corridor)
+    return corridor
+
+
+async def plan_trip(data: PlanRouteData):
+
+    """
+    Plans the charging stops of a trip.
+
+    Args:
+    data (PlanRouteData): User inputs for the trip.
+
+    Returns:
+    dict: The charging stops in driving order with the SOC on arrival and departure and the charging time at each, the
+    total distance, travel time and charging time, and the SOC at the destination.
+
+    Raises HTTPException (404) when the EV model, a location or a feasible plan cannot be found, (422) when the EV
+    specification lacks the data a plan needs, (502) when the driving route is unavailable and (503) when the EV
+    model cannot be looked up in the database.
+    """
+
+    with timed("ev_model"):
+        await ev_catalog.ensure_loaded()
+        ev_spec = await lookup_ev_model(data.ev_model)
+    if ev_spec is None:
+        raise HTTPException(status_code=404, detail="EV model not found in the database")
+    if not can_plan(ev_spec):
+        raise HTTPException(status_code=422, detail="The EV model lacks the capacity or discharge rates needed to plan charging stops")
+
+    with timed("geocoding"):
+        origin, destination = await asyncio.gather(geocoder.geocode(data.origin_location), geocoder.geocode(data.destination_location))
+    if origin is None:
+        raise HTTPException(status_code=404, detail="Could not find the origin location")
+    if destination is None:
+        raise HTTPException(status_code=404, detail="Could not find the destination location")
+
+    with timed("corridor"):
+        corridor = await get_corridor(origin, destination, data.corridor_km)
+    if corridor is None:
+        raise HTTPException(status_code=502, detail="Could not retrieve the driving route")
+
+    # Temperatures are read along the route and applied to the legs leaving the nearest stops
+    with timed("temperature"):
+        readings = await temperature_service.get_temperatures(sample_points(corridor.profile, PLAN_TEMPERATURE_SPACING_KM))
+        readings = [DEGRADED_TEMPERATURE if reading is None else reading for reading in readings]
+        temperatures = corridor_temperatures(corridor, readings)
+
+    with timed("planning"):
+        plan = await asyncio.to_thread(
+            plan_charging_stops, corridor, ev_spec, data.initial_SOC, temperatures,
+            data.fast_charging_priority, data.corridor_km, data.min_arrival_SOC,
+        )
+    if plan is None:
+        raise HTTPException(status_code=404, detail="No sequence of charging stops along the route reaches the destination")
+    return {"message": "Data processed successfully", **plan}
+
+
+RANGE_NOT_ENOUGH_MESSAGE = "Your range is not enough to reach the destination. Please choose a closer destination."
+
+# Stations predicted to be reached with less SOC (in percent) are reported with a warning
+LOW_SOC_WARNING_PERCENT = 7.5
+
+
+
+async def prepare_trip(data: RouteCalculationData, lookups: SharedLookups):
+
+    """
+    Resolves everything a trip needs before its charging stations can be evaluated.
+
+    Args:
+    data (RouteCalculationData): User inputs for the trip.
+    lookups (SharedLookups): Memo used to share identical lookups with other trips.
+
+    Returns:
+    dict: The EV specification, origin and destination coordinates, origin temperature, the charging stations selected
+          for evaluation, their positions in the candidate pool and the whole pool.
 
-    geolocator = Nominatim(user_agent="Navigator")
+    Raises HTTPException (404) when the EV model, a location or any charging station cannot be found and (503) when
+    the EV model cannot be looked up in the database.
+    """
+
+    # Extract necessary data from the input
     origin_location = data.origin_location
     destination_location = data.destination_location
     max_radius = data.max_radius
     ev_model = data.ev_model
-    initial_SOC = data.initial_SOC
 
-    # Retrieve EV information from the database
-    useable_capacity_str, charge_port, fast_charge_port, charge_power, charge_speed, rates, weight = get_ev_information(ev_model)
-    if useable_capacity_str is None:
+    # Retrieve EV information from the in-memory catalog
+    with timed("ev_model"):
+        await ev_catalog.ensure_loaded()
+        ev_spec = await lookups.get(("ev_model", normalize_model_name(ev_model)), lambda: lookup_ev_model(ev_model))
+    if ev_spec is None:
         raise HTTPException(status_code=404, detail="EV model not found in the database")
 
-    # Convert origin and destination locations into latitude and longitude
-    origin_latitude, origin_longitude = get_coordinates(geolocator, origin_location)
-    if origin_latitude is None or origin_longitude is None:
+    # Convert origin and destination locations into latitude and longitude through the shared geocoder
+    with timed("geocoding"):
+        origin, destination = await asyncio.gather(
+            lookups.get(("geocode", normalize_address(origin_location)), lambda: geocoder.geocode(origin_location)),
+            lookups.get(("geocode", normalize_address(destination_location)), lambda: geocoder.geocode(destination_location)),
+        )
+    if origin is None:
         raise HTTPException(status_code=404, detail="Could not find the origin location")
+    origin_latitude, origin_longitude = origin
 
-    destination_latitude, destination_longitude = get_coordinates(geolocator, destination_location)
-    if destination_latitude is None or destination_longitude is None:
+    if destination is None:
         raise HTTPException(status_code=404, detail="Could not find the destination location")
+    destination_latitude, destination_longitude = destination
 
     # Prepare coordinates for API calls
     origin_coordinates = f"{origin_latitude},{origin_longitude}"
     destination_coordinates = f"{destination_latitude},{destination_longitude}"
 
-    # Get temperature and charging stations data
-    temperature_origin = get_temperature(origin_latitude, origin_longitude)
-    charging_stations = get_charging_stations(OCM_API_KEY, f"{destination_latitude},{destination_longitude}", max_radius)
+    # Get temperature and charging stations data concurrently
+    with timed("stations"):
+        temperature_origin, charging_stations = await asyncio.gather(
+            lookups.get(("temperature", origin), lambda: get_temperature(origin_latitude, origin_longitude)),
+            lookups.get(("stations", destination, max_radius), lambda: get_charging_stations(OCM_API_KEY, destination_coordinates, max_radius)),
+        )
     
     if not charging_stations:
         raise HTTPException(status_code=404, detail="No charging stations found within the specified radius and destination.")
+
+    selection = select_candidates(ev_spec, data.initial_SOC, origin, charging_stations)
+    return {
+        "ev_spec": ev_spec,
+        "origin_coordinates": origin_coordinates,
+        "destination_coordinates": destination_coordinates,
+        "temperature_origin": temperature_origin,
+        "charging_stations": [charging_stations[index] for index in selection],
+        "selection": selection,
+        "candidates": charging_stations,
+    }
+
+
+def station_soc_bounds(ev_spec, initial_SOC, origin, charging_stations):
+
+    """
+    Bounds the altitude-adjusted SOC at each charging station without any provider request.
+
+    Args:
+    ev_spec (EVSpec): The EV specification.
+    initial_SOC (float): Initial state of charge as a percentage.
+    origin (tuple): The trip origin as (latitude, longitude).
+    charging_stations (list): Charging stations as returned by get_charging_stations.
+
+    Returns:
+    array: The highest SOC each station can be reached with.
+
+    The bound drives STATION_PRUNE_DISTANCE_FACTOR of the straight-line distance at the EV's best-case discharge
+    rate without any climb, so no road route gives a higher SOC. Only legs with segments calculate_soc does not
+    count (ferry crossings) can end above it.
+    """
+
+    distances = [
+        haversine_km(origin[0], origin[1], station['location'][0], station['location'][1]) * STATION_PRUNE_DISTANCE_FACTOR
+        for station in charging_stations
+    ]
+    return soc_upper_bounds(ev_spec, initial_SOC, distances)
+
+
+def select_candidates(ev_spec, initial_SOC, origin, charging_stations):
+
+    """
+    Chooses which candidate charging stations are evaluated.
+
+    Args:
+    ev_spec (EVSpec): The EV specification.
+    initial_SOC (float): Initial state of charge as a percentage.
+    origin (tuple): The trip origin as (latitude, longitude).
+    charging_stations (list): Candidate charging stations, nearest to the destination first.
+
+    Returns:
+    list: The positions of the selected stations in charging_stations, nearest first.
+
+    The nearest station is always selected, because it decides whether the destination is within range. The others
+    are taken nearest first, skipping the stations whose SOC bound is below LOW_SOC_WARNING_PERCENT, until
+    STATION_TOP_K are selected. The selection only depends on its arguments, so a what-if request for the same EV
+    model and initial SOC selects the same stations.
+    """
+
+    bounds = station_soc_bounds(ev_spec, initial_SOC, origin, charging_stations)
+    selected = [0]
+    for index in range(1, len(charging_stations)):
+        if len(selected) >= STATION_TOP_K:
+            break
+        if bounds[index] >= LOW_SOC_WARNING_PERCENT:
+            selected.append(index)
+    return selected
+
+
+def start_station_lookups(trip, lookups: SharedLookups):
+
+    """
+    Starts the lookups shared by all selected charging stations of a prepared trip.
+
+    Args:
+    trip (dict): The prepared trip returned by prepare_trip.
+    lookups (SharedLookups): Memo used to share identical lookups with other trips.
+
+    Returns:
+    tuple: The walking legs task and the station temperatures task, each resolving to one entry per station.
+
+    All walking legs are resolved in one matrix lookup and all station temperatures in one batched request.
+    """
+
+    charging_stations = trip['charging_stations']
+    destination_coordinates = trip['destination_coordinates']
+    station_coordinates = [f"{station['location'][0]},{station['location'][1]}" for station in charging_stations]
+
+    walking_legs = asyncio.ensure_future(lookups.get(
+        ("walking", destination_coordinates, tuple(station_coordinates)),
+        lambda: get_walking_legs(station_coordinates, destination_coordinates, BING_MAPS_API_KEY),
+    ))
+    station_temperatures = asyncio.ensure_future(lookups.get(
+        ("temperatures", tuple(station_coordinates)),
+        lambda: temperature_service.get_temperatures([station['location'] for station in charging_stations]),
+    ))
+    return walking_legs, station_temperatures
+
+
+def start_leg_evaluations(trip, lookups: SharedLookups, charging_stations):
+
+    """
+    Starts the driving route and elevation lookups of charging stations of a prepared trip.
+
+    Args:
+    trip (dict): The prepared trip returned by prepare_trip.
+    lookups (SharedLookups): Memo used to share identical lookups with other trips.
+    charging_stations (list): The stations to evaluate.
+
+    Returns:
+    list: One evaluation task per station, in station order.
+
+    Trips start with the nearest station alone, because it decides whether the destination is within range, and
+    only start the others once it is.
+    """
+
+    origin_coordinates = trip['origin_coordinates']
+    return [
+        asyncio.ensure_future(lookups.get(
+            ("leg", origin_coordinates, f"{station['location'][0]},{station['location'][1]}"),
+            lambda station=station: evaluate_station(station, origin_coordinates),
+        ))
+        for station in charging_stations
+    ]
+
+
+def station_socs(ev_spec, initial_SOC, origin_coordinates, charging_stations, evaluated_stations, temperatures):
+
+    """
+    Calculates the SOC at each charging station of a trip.
+
+    Args:
+    ev_spec (EVSpec): The EV specification.
+    initial_SOC (float): Initial state of charge as a percentage.
+    origin_coordinates (str): The trip origin coordinates, formatted as "lat,lon".
+    charging_stations (list): The charging stations.
+    evaluated_stations (list): Their evaluations.
+    temperatures (list): The ambient temperature used for each leg.
+
+    Returns:
+    list: One (final SOC, altitude-adjusted SOC) tuple per station, (None, None) where it cannot be calculated.
+
+    Missing temperatures and elevation changes are replaced by DEGRADED_TEMPERATURE and DEGRADED_ALTITUDE_CHANGE.
+    """
+
+    socs = soc_for_legs(
+        ev_spec, initial_SOC,
+        [evaluated['route_info'] for evaluated in evaluated_stations],
+        [
+            DEGRADED_ALTITUDE_CHANGE if not is_number(evaluated['altitude_change']) and DEGRADED_ALTITUDE_CHANGE is not None else evaluated['altitude_change']
+            for evaluated in evaluated_stations
+        ],
+        [DEGRADED_TEMPERATURE if temperature is None else temperature for temperature in temperatures],
+        [evaluated.get('total_ascent') for evaluated in evaluated_stations],
+    )
+    return socs
+
+
+def leg_temperatures(temperature_origin, station_temperatures):
+
+    """
+    Averages the origin temperature with each station temperature, giving None where either reading is missing.
+    """
+
+    return [
+        None if temperature_origin is None or temperature_station is None else (temperature_origin + temperature_station) / 2
+        for temperature_station in station_temperatures
+    ]
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def degraded_inputs(evaluated, temperature, walking_time):
+
+    """
+    Lists the non-critical data of a station that was unavailable and replaced by a default or left out.
+
+    Args:
+    evaluated (dict): The analyzed route and elevation change returned by evaluate_station.
+    temperature (float): The ambient temperature of the leg, None if no reading was available.
+    walking_time (float): Walking time in minutes from the station to the destination, or 'Unknown'.
+
+    Returns:
+    list: Any of "temperature", "elevation" and "walking".
+    """
+
+    degraded = []
+    if evaluated['route_info'] is None:
+        # The station has no SOC anyway
+        return degraded
+    if temperature is None and DEGRADED_TEMPERATURE is not None:
+        degraded.append("temperature")
+    if not is_number(evaluated['altitude_change']) and DEGRADED_ALTITUDE_CHANGE is not None:
+        degraded.append("elevation")
+    if not is_number(walking_time):
+        degraded.append("walking")
+    return degraded
+
+
+def build_station_result(x, station, evaluated, final_SOC, adjusted_SOC, walking_time, degraded=()):
+
+    """
+    Builds the response entry of one charging station.
+
+    Args:
+    x (int): The station number, starting at 1 for the station nearest to the destination.
+    station (dict): Charging station information as returned by get_charging_stations.
+    evaluated (dict): The analyzed route and elevation change returned by evaluate_station.
+    final_SOC (float): Predicted SOC at the station.
+    adjusted_SOC (float): Predicted SOC at the station adjusted for altitude gain.
+    walking_time (float): Walking time in minutes from the station to the destination.
+    degraded (list): The unavailable data of the station, as returned by degraded_inputs.
+
+    Returns:
+    dict: The station details, or a warning when the predicted SOC at the station is too low or cannot be
+    calculated (e.g. no driving route, or no weight or consumption rates for the EV model). Results based on default
+    values for unavailable data list them under "degraded".
+    """
+
+    route_info = evaluated['route_info']
+    altitude_change = evaluated['altitude_change']
+    degraded_fields = {"degraded": list(degraded)} if degraded else {}
+    ascent_fields = {"total_ascent_m": evaluated['total_ascent']} if evaluated.get('total_ascent') is not None else {}
+
+    if adjusted_SOC is None:
+        logging.warning(f"No SOC could be calculated for charging station '{station['name']}'")
+        return {
+            "station_number": x,
+            "station_name": station['name'],
+            "warning": "The SOC at this charging station could not be calculated.",
+            **degraded_fields,
+        }
+    if adjusted_SOC<0:
+        adjusted_SOC=0
+    if adjusted_SOC < LOW_SOC_WARNING_PERCENT:
+        return {
+            "station_number": x,
+            "station_name": station['name'],
+            "warning": f"Predicted SOC at this charging station is too low ({adjusted_SOC:.1f}%).",
+            **degraded_fields,
+        }
+
+    return {
+        "station_number": x,
+        "station_name": station['name'],
+        "route_distance_km": route_info['distance'],
+        "route_duration_minutes": "{:.1f}".format(route_info['duration'] / 60),
+        "traffic_congestion": route_info['traffic_congestion'],
+        "charger_connections": [{"charger_type": conn['connection_type'], "price": conn.get('price', 'Unknown')} for conn in station['connections']],
+        "operator": station.get('operator', 'Unknown'),
+        "usage_cost": station.get('usage_cost', 'Unknown'),
+        "walking_time": "{:.1f}".format(float(walking_time)) if is_number(walking_time) else "Unknown",
+        "elevation_change_m": altitude_change,
+        **ascent_fields,
+        "final_SOC": final_SOC,
+        "altitude_adjusted_SOC": adjusted_SOC,
+        **degraded_fields,
+    }
+
+
+async def your_main_code(data: RouteCalculationData, lookups: SharedLookups = None):
+    """
+    Processes user input to find optimal charging stations and calculate SoC around the final destination of an electric vehicle trip.
+
+    Args:
+    data (RouteCalculationData): User inputs including EV model, origin, destination, maximum search radius, initial state of charge (SoC), and fast charging priority.
+    lookups (SharedLookups): Optional memo shared with other trips of the same batch, so identical geocodes, station searches,
+    route legs and catalog lookups are only performed once.
+
+    Returns:
+    dict: Dictionary containing a success message and a list of suitable charging stations and parameters such as final SoC or walking time at each station.
+
+    The function integrates several steps: retrieving EV information, converting locations to coordinates, getting temperature data, fetching charging stations, and calculating SoC. 
+    Each charging station is evaluated for its suitability based on the route, available chargers, and expected SoC upon arrival. Exception handling ensures appropriate responses in case of data retrieval issues or missing information.
+    All stations are evaluated concurrently, but results are assembled in the original station order. SoC values for
+    all stations are computed together by the vectorized soc_engine.
+    """
     
+    lookups = lookups if lookups is not None else SharedLookups()
+    trip = await prepare_trip(data, lookups)
+    ev_spec = trip['ev_spec']
+    initial_SOC = data.initial_SOC
+    charging_stations = trip['charging_stations']
+
+    # Start the walking and temperature lookups of every station and the route of the nearest one
+    walking_legs, station_temperatures = start_station_lookups(trip, lookups)
+    evaluations = start_leg_evaluations(trip, lookups, charging_stations[:1])
+
+    try:
+        with timed("station_evaluation"):
+            # Average the origin and station temperatures for every leg
+            temperatures = leg_temperatures(trip['temperature_origin'], await station_temperatures)
+
+            # The nearest station decides whether the destination is within range, so the others are only evaluated
+            # once it is
+            first = await evaluations[0]
+            (_, first_adjusted_SOC), = station_socs(ev_spec, initial_SOC, trip['origin_coordinates'], charging_stations[:1], [first], temperatures[:1])
+            if first_adjusted_SOC is not None and first_adjusted_SOC <= 0:
+                return(RANGE_NOT_ENOUGH_MESSAGE)
+
+            evaluations += start_leg_evaluations(trip, lookups, charging_stations[1:])
+            evaluated_stations = await asyncio.gather(*evaluations)
+            walking = await walking_legs
+    finally:
+        # Stop any evaluations still running after an early exit or an error
+        for evaluation in evaluations:
+            evaluation.cancel()
+        walking_legs.cancel()
+        station_temperatures.cancel()
+
+    # Keep everything that does not depend on the EV model or initial SOC for what-if requests
+    context = build_trip_context(trip, evaluated_stations, walking, temperatures)
+
+    with timed("soc"):
+        station_results = station_results_for_context(context, ev_spec, initial_SOC)
 
-    x = 1
-    # Process each charging station and calculate SOC
-    station_results = []  # Initialize a list to store station results
-    for station in charging_stations:
-        temperature_station = get_temperature(*station['location'])
-        temperature = (temperature_origin + temperature_station) / 2
-        station_coordinates = f"{station['location'][0]},{station['location'][1]}"
-        origin_coordinates = f"{origin_latitude},{origin_longitude}"
-        route_data = get_route_info(origin_coordinates, station_coordinates)
-        route_info, segment_distances_sum = analyze_route(route_data)
-        altitude_change = get_elevation_change(origin_coordinates, station_coordinates, BING_MAPS_API_KEY)
-       
-        walking_distance, walking_time = get_walking_route(station_coordinates, destination_coordinates, BING_MAPS_API_KEY)
-        final_SOC, adjusted_SOC = calculate_soc(altitude_change, useable_capacity_str, weight, initial_SOC, temperature, route_info, rates)
-        
-        if adjusted_SOC<0:
-            adjusted_SOC=0
-        if x == 1 and adjusted_SOC==0:
-            return("Your range is not enough to reach the destination. Please choose a closer destination.")
-        if adjusted_SOC < 7.5:
-            station_result = {
-                "station_number": x,
-                "station_name": station['name'],
-                "warning": f"Predicted SOC at this charging station is too low ({adjusted_SOC:.1f}%)."
-            }
-        
-        else:
-           
-
-            try:
-                station_result = {
-                    "station_number": x,
-                    "station_name": station['name'],
-                    "route_distance_km": route_info['distance'],
-                    "route_duration_minutes": "{:.1f}".format(route_info['duration'] / 60),
-                    "traffic_congestion": route_info['traffic_congestion'],
-                    "charger_connections": [{"charger_type": conn['connection_type'], "price": conn.get('price', 'Unknown')} for conn in station['connections']],
-                    "operator": station.get('operator', 'Unknown'),
-                    "usage_cost": station.get('usage_cost', 'Unknown'),
-                    "walking_time": "{:.1f}".format(float(walking_time)),
-                    "elevation_change_m": altitude_change,
-                    "final_SOC": final_SOC,
-                    "altitude_adjusted_SOC": adjusted_SOC
-            }
-            except Exception as e:
-                    logging.error(f"An error occurred: {e}")
-           
-        station_results.append(station_result)
-        x=x+1
     response = {
         "message": "Data processed successfully",
-        "charging_stations": station_results
+        "charging_stations": station_results,
+        "trip_context_id": await trip_contexts.put(context),
     }
     return response
 
 
+def build_trip_context(trip, evaluated_stations, walking, temperatures):
+
+    """
+    Keeps the model-independent data of a computed trip, padded to its whole candidate pool.
+
+    Args:
+    trip (dict): The prepared trip returned by prepare_trip.
+    evaluated_stations (list): The evaluations of the selected stations.
+    walking (list): Their walking legs.
+    temperatures (list): Their leg temperatures.
+
+    Returns:
+    TripContext: The context, with None for the candidates that were not selected for this trip.
+    """
+
+    pool = {name: [None] * len(trip['candidates']) for name in ("evaluated_stations", "walking", "temperatures")}
+    for position, index in enumerate(trip['selection']):
+        pool["evaluated_stations"][index] = evaluated_stations[position]
+        pool["walking"][index] = walking[position]
+        pool["temperatures"][index] = temperatures[position]
+    return TripContext(
+        origin_coordinates=trip['origin_coordinates'],
+        destination_coordinates=trip['destination_coordinates'],
+        charging_stations=trip['candidates'],
+        temperature_origin=trip['temperature_origin'],
+        **pool,
+    )
+
+
+def context_selection(context: TripContext, ev_spec, initial_SOC):
+
+    """
+    Returns the positions of the candidates of a trip context that a trip with this EV model and initial SOC evaluates.
+    """
+
+    origin = tuple(map(float, context.origin_coordinates.split(',')))
+    return select_candidates(ev_spec, initial_SOC, origin, context.charging_stations)
+
+
+async def complete_trip_context(context_id, context: TripContext, selection):
+
+    """
+    Evaluates the candidates a what-if request selects that the original trip did not, e.g. because the new EV has
+    more range and reaches candidates the original EV could not.
+
+    Args:
+    context_id (str): The handle of the trip context, under which the completed context is stored again.
+    context (TripContext): The trip context.
+    selection (list): Positions of the candidates the what-if request evaluates, as returned by context_selection.
+
+    Returns:
+    TripContext: The context with every selected candidate evaluated.
+
+    Only the missing stations are looked up, through the same caches as a trip request, so the what-if answer is the
+    one a fresh trip for the same inputs would give.
+    """
+
+    missing = [index for index in selection if context.evaluated_stations[index] is None]
+    if not missing:
+        return context
+
+    trip = {
+        "origin_coordinates": context.origin_coordinates,
+        "destination_coordinates": context.destination_coordinates,
+        "charging_stations": [context.charging_stations[index] for index in missing],
+    }
+    lookups = SharedLookups()
+    walking_legs, station_temperatures = start_station_lookups(trip, lookups)
+    evaluations = start_leg_evaluations(trip, lookups, trip['charging_stations'])
+    try:
+        with timed("station_evaluation"):
+            evaluated_stations = await asyncio.gather(*evaluations)
+            walking = await walking_legs
+            temperatures = leg_temperatures(context.temperature_origin, await station_temperatures)
+    finally:
+        for evaluation in evaluations:
+            evaluation.cancel()
+        walking_legs.cancel()
+        station_temperatures.cancel()
+
+    completed = {name: list(getattr(context, name)) for name in ("evaluated_stations", "walking", "temperatures")}
+    for position, index in enumerate(missing):
+        completed["evaluated_stations"][index] = evaluated_stations[position]
+        completed["walking"][index] = walking[position]
+        completed["temperatures"][index] = temperatures[position]
+    context = context._replace(**completed)
+    await trip_contexts.replace(context_id, context)
+    return context
+
+
+def station_results_for_context(context: TripContext, ev_spec, initial_SOC):
+
+    """
+    Calculates the SOC and builds the result of every charging station a trip with this EV model and initial SOC
+    selects from a computed trip's candidates.
+
+    Args:
+    context (TripContext): The model-independent data of the trip, with every selected candidate evaluated.
+    ev_spec (EVSpec): The EV specification to calculate the SOC for.
+    initial_SOC (float): Initial state of charge as a percentage.
+
+    Returns:
+    list: The station results, in station order.
+
+    No provider is contacted, so the same trip can be recomputed for any EV model or initial SOC in milliseconds.
+    """
+
+    selection = context_selection(context, ev_spec, initial_SOC)
+    charging_stations = [context.charging_stations[index] for index in selection]
+    evaluated_stations = [context.evaluated_stations[index] for index in selection]
+    walking = [context.walking[index] for index in selection]
+    temperatures = [context.temperatures[index] for index in selection]
+
+    # Calculate the SOC at every charging station in one vectorized pass
+    socs = station_socs(ev_spec, initial_SOC, context.origin_coordinates, charging_stations, evaluated_stations, temperatures)
+
+    # Process each charging station in order
+    station_results = []  # Initialize a list to store station results
+    for x, (station, evaluated, (final_SOC, adjusted_SOC), (walking_distance, walking_time), temperature) in enumerate(zip(charging_stations, evaluated_stations, socs, walking, temperatures), start=1):
+        degraded = degraded_inputs(evaluated, temperature, walking_time)
+        station_results.append(build_station_result(x, station, evaluated, final_SOC, adjusted_SOC, walking_time, degraded))
+    return station_results
+
+
+async def stream_station_results(data: RouteCalculationData, trip, lookups: SharedLookups):
+
+    """
+    Yields each charging station result as soon as its SoC is computed, followed by a summary record.
+
+    Args:
+    data (RouteCalculationData): User inputs for the trip.
+    trip (dict): The prepared trip returned by prepare_trip.
+    lookups (SharedLookups): Memo used to share identical lookups with other trips.
+
+    Yields:
+    dict: Records of type "station" (a station result, in completion order), "error" (a station whose evaluation
+    failed) and a final record of type "summary".
+
+    The nearest station is always sent first, because it decides whether the destination is within range. If it is
+    not, the summary carries the out-of-range message and no station is sent.
+    """
+
+    ev_spec = trip['ev_spec']
+    initial_SOC = data.initial_SOC
+    charging_stations = trip['charging_stations']
+    walking_legs, station_temperatures = start_station_lookups(trip, lookups)
+    evaluations = start_leg_evaluations(trip, lookups, charging_stations[:1])
+
+    async def evaluate(index):
+        try:
+            return index, await evaluations[index], None
+        except Exception as e:
+            return index, None, e
+
+    sent = 0
+    failed = 0
+    evaluated_stations = [None] * len(charging_stations)
+    try:
+        temperatures = leg_temperatures(trip['temperature_origin'], await station_temperatures)
+        walking = await walking_legs
+
+        async def completed():
+            yield await evaluate(0)
+            # Only reached when the nearest station is within range
+            evaluations.extend(start_leg_evaluations(trip, lookups, charging_stations[1:]))
+            for next_result in asyncio.as_completed([evaluate(index) for index in range(1, len(charging_stations))]):
+                yield await next_result
+
+        async for index, evaluated, error in completed():
+            if error is not None:
+                logging.error(f"Could not evaluate charging station '{charging_stations[index]['name']}': {error!r}")
+                failed += 1
+                yield {
+                    "type": "error",
+                    "station_number": index + 1,
+                    "station_name": charging_stations[index]['name'],
+                    "detail": "The charging station could not be evaluated.",
+                }
+                continue
+            evaluated_stations[index] = evaluated
+            (final_SOC, adjusted_SOC), = station_socs(ev_spec, initial_SOC, trip['origin_coordinates'], charging_stations[index:index + 1], [evaluated], temperatures[index:index + 1])
+            if index == 0 and adjusted_SOC is not None and adjusted_SOC <= 0:
+                yield {"type": "summary", "message": RANGE_NOT_ENOUGH_MESSAGE, "stations_sent": 0}
+                return
+            degraded = degraded_inputs(evaluated, temperatures[index], walking[index][1])
+            station_result = build_station_result(index + 1, charging_stations[index], evaluated, final_SOC, adjusted_SOC, walking[index][1], degraded)
+            sent += 1
+            yield {"type": "station", **station_result}
+    finally:
+        for evaluation in evaluations:
+            evaluation.cancel()
+        walking_legs.cancel()
+        station_temperatures.cancel()
+
+    context = build_trip_context(trip, evaluated_stations, walking, temperatures)
+    yield {
+        "type": "summary",
+        "message": "Data processed successfully",
+        "stations_sent": sent,
+        "stations_failed": failed,
+        "stations_found": len(charging_stations),
+        "trip_context_id": await trip_contexts.put(context),
+    }
+
+
@@ -0,0 +1,121 @@
+# Prometheus metrics of the navigator: request and stage latency, and latency, errors and concurrency per provider
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+
+from timing import timed
+
+# Latency buckets (in seconds), wide enough to tell a slow provider from a 12 second request
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+REQUESTS = Counter("navigator_requests_total", "Requests handled by the navigator", ["endpoint", "status"])
+REQUEST_LATENCY = Histogram("navigator_request_duration_seconds", "Time to answer a request", ["endpoint"], buckets=LATENCY_BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge("navigator_requests_in_flight", "Requests being handled", ["endpoint"], multiprocess_mode="livesum")
+STAGE_LATENCY = Histogram(
+    "navigator_stage_duration_seconds", "Time a request spent in each pipeline stage, summed over concurrent calls",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)
+PROVIDER_LATENCY = Histogram(
+    "navigator_provider_request_duration_seconds", "Latency of single calls to an external data source",
+    ["provider"], buckets=LATENCY_BUCKETS,
+)
+PROVIDER_ERRORS = Counter("navigator_provider_errors_total", "Failed calls to an external data source", ["provider", "kind"])
+PROVIDER_IN_FLIGHT = Gauge(
+    "navigator_provider_requests_in_flight", "Calls to an external data source waiting for an answer",
+    ["provider"], multiprocess_mode="livesum",
+)
+PROVIDER_HEDGES = Counter("navigator_provider_hedges_total", "Second requests sent because the first was slow", ["provider"])
+PROVIDER_QUEUE_DEPTH = Gauge(
+    "navigator_provider_queue_depth", "Calls waiting for the rate limit of a provider quota",
+    ["quota"], multiprocess_mode="livesum",
+)
+PROVIDER_QUEUE_WAIT = Histogram(
+    "navigator_provider_queue_wait_seconds", "Time calls waited for the rate limit of a provider quota",
+    ["quota", "priority"], buckets=LATENCY_BUCKETS,
+)
+PROVIDER_CIRCUIT_STATE = Gauge(
+    "navigator_provider_circuit_state", "Circuit breaker state of a data source (0 closed, 1 half-open, 2 open)",
+    ["provider"], multiprocess_mode="max",
+)
+
+
+def error_kind(error):
+
+    """
+    Classify an exception raised by a provider call as "timeout" or "error".
+    """
+
+    name = type(error).__name__
+    return "timeout" if "Timeout" in name or "TimedOut" in name else "error"
+
+
+@contextmanager
+def provider_call(name):
+
+    """
+    Track one call to an external data source: latency, in-flight count, exceptions and the provider_<name> stage
+    of the current request.
+
+    Args:
+    name (str): The data source, e.g. "ocm" or "mysql".
+    """
+
+    PROVIDER_IN_FLIGHT.labels(name).inc()
+    started = time.perf_counter()
+    try:
+        with timed(f"provider_{name}"):
+            yield
+    except Exception as e:
+        PROVIDER_ERRORS.labels(name, error_kind(e)).inc()
+        raise
+    finally:
+        PROVIDER_LATENCY.labels(name).observe(time.perf_counter() - started)
+        PROVIDER_IN_FLIGHT.labels(name).dec()
+
+
+def provider_error(name, kind="status"):
+
+    """
+    Count a failed call that did not raise, e.g. an HTTP error status.
+    """
+
+    PROVIDER_ERRORS.labels(name, kind).inc()
+
+
+def observe_request(endpoint, status, seconds, timings):
+
+    """
+    Record a finished request and the time it spent in each stage.
+
+    Args:
+    endpoint (str): The route path.
+    status (int): The response status code.
+    seconds (float): Total time spent on the request.
+    timings (RequestTimings): The stage timings collected while handling it.
+    """
+
+    REQUESTS.labels(endpoint, str(status)).inc()
+    REQUEST_LATENCY.labels(endpoint).observe(seconds)
+    for stage, (stage_seconds, _) in timings.snapshot().items():
+        STAGE_LATENCY.labels(stage).observe(stage_seconds)
+
+
+def render_metrics():
+
+    """
+    Render all metrics in the Prometheus text format, combined over every worker process when
+    PROMETHEUS_MULTIPROC_DIR is set.
+
+    Returns:
+    tuple: The encoded metrics and their content type.
+    """
+
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
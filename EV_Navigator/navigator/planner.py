@@ -0,0 +1,642 @@
+# Multi-stop charging plans: route corridor model, charging model and a state-space search over charging stations
+import heapq
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+
+from elevation import cumulative_climb
+from soc_engine import CITY_ROAD_TYPES, TEMPERATURE_THRESHOLD
+
+# Maximum distance (in kilometers) of a charging station from the driving route
+PLAN_CORRIDOR_KM = float(os.getenv("PLAN_CORRIDOR_KM", "5"))
+# Maximum number of corridor stations considered before pruning
+PLAN_MAX_CANDIDATES = int(os.getenv("PLAN_MAX_CANDIDATES", "1000"))
+# The route is cut into sections of this length (km), keeping only the best PLAN_STATIONS_PER_SECTION stations of each
+PLAN_SECTION_KM = float(os.getenv("PLAN_SECTION_KM", "10"))
+PLAN_STATIONS_PER_SECTION = int(os.getenv("PLAN_STATIONS_PER_SECTION", "3"))
+# SOC (in percent) that must be left when arriving at a charging stop or the destination
+PLAN_MIN_ARRIVAL_SOC = float(os.getenv("PLAN_MIN_ARRIVAL_SOC", "10"))
+# Highest SOC (in percent) charged to at a stop, and the SOC steps between the charge levels considered
+PLAN_MAX_CHARGE_SOC = float(os.getenv("PLAN_MAX_CHARGE_SOC", "90"))
+PLAN_SOC_STEP = float(os.getenv("PLAN_SOC_STEP", "10"))
+# Maximum number of charging stops in a plan
+PLAN_MAX_STOPS = int(os.getenv("PLAN_MAX_STOPS", "8"))
+# Minutes added for every stop (leaving the route, parking, plugging in)
+PLAN_STOP_OVERHEAD_MINUTES = float(os.getenv("PLAN_STOP_OVERHEAD_MINUTES", "5"))
+# The road distance to a station off the route is estimated as its straight-line distance times this factor,
+# driven at PLAN_DETOUR_SPEED_KMH on city roads
+PLAN_DETOUR_FACTOR = float(os.getenv("PLAN_DETOUR_FACTOR", "1.3"))
+PLAN_DETOUR_SPEED_KMH = float(os.getenv("PLAN_DETOUR_SPEED_KMH", "30"))
+# DC power (kW) an EV is assumed to accept at a fast charger of its Fast_charge_port type; ev_data only has AC power
+FAST_CHARGE_POWER_KW = float(os.getenv("FAST_CHARGE_POWER_KW", "50"))
+# Fast charging slows down above this SOC (percent) to this fraction of its power
+FAST_CHARGE_TAPER_SOC = float(os.getenv("FAST_CHARGE_TAPER_SOC", "80"))
+FAST_CHARGE_TAPER_FACTOR = float(os.getenv("FAST_CHARGE_TAPER_FACTOR", "0.4"))
+# Kilometers between the route points whose temperature is looked up; stops use the nearest one
+PLAN_TEMPERATURE_SPACING_KM = float(os.getenv("PLAN_TEMPERATURE_SPACING_KM", "50"))
+# Seconds a corridor (route profile, stations and elevations) is reused for the same origin and destination
+PLAN_CORRIDOR_CACHE_TTL = float(os.getenv("PLAN_CORRIDOR_CACHE_TTL", "3600"))
+PLAN_CORRIDOR_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CORRIDOR_CACHE_MAX_ENTRIES", "200"))
+
+# The corridor polyline is resampled to points at most this far apart (km) for projecting stations onto it
+RESAMPLE_STEP_KM = 0.5
+KM_PER_DEGREE = 111.32
+
+
+class RouteProfile(NamedTuple):
+
+    """
+    The driving route as cumulative profiles over the distance along it.
+
+    latitudes and longitudes are route points RESAMPLE_STEP_KM apart at the distances in point_km. bounds_km
+    are the ends of the route's itinerary items; city_km and hours hold the city kilometers and the driving time
+    accumulated up to each bound, so any stretch of the route is costed with two interpolations.
+    """
+
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+    point_km: np.ndarray
+    bounds_km: np.ndarray
+    city_km: np.ndarray
+    hours: np.ndarray
+    total_km: float
+
+    def city_at(self, km):
+        return np.interp(km, self.bounds_km, self.city_km)
+
+    def hours_at(self, km):
+        return np.interp(km, self.bounds_km, self.hours)
+
+
+class Node(NamedTuple):
+
+    """
+    A point the plan can pass: the origin, a charging station or the destination.
+
+    route_km is the distance along the route of the point's projection and detour_km the estimated road distance
+    between the route and the point. power_kw and fast describe the best connector the EV can use (0 for the
+    origin and destination).
+    """
+
+    route_km: float
+    detour_km: float
+    power_kw: float
+    fast: bool
+    station: dict = None
+
+
+def _path_lengths(latitudes, longitudes):
+    lat = np.radians(latitudes)
+    lon = np.radians(longitudes)
+    a = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+    return np.concatenate(([0.0], np.cumsum(2 * 6371.0088 * np.arcsin(np.minimum(1.0, np.sqrt(a))))))
+
+
+def route_profile(route_data, road_type=None):
+
+    """
+    Build the profile of a Bing Maps driving route.
+
+    Args:
+    route_data (dict): Route data from Bing Maps, ideally requested with routeAttributes=routePath.
+    road_type (callable): Returns the road type of an itinerary item, such as main.get_road_type.
+
+    Returns:
+    RouteProfile: The route profile, or None if the route data is unusable.
+
+    Without a route path the maneuver points of the itinerary are used as the route geometry. Item distances are
+    scaled to the length of the geometry so both describe the same route, and items without a duration share the
+    route's duration by distance.
+    """
+
+    try:
+        resource = route_data["resourceSets"][0]["resources"][0]
+        items = resource["routeLegs"][0]["itineraryItems"]
+        path = (resource.get("routePath") or {}).get("line", {}).get("coordinates") or [
+            item["maneuverPoint"]["coordinates"] for item in items
+        ]
+        points = np.array(path, dtype=float)
+        distances = np.array([item["travelDistance"] for item in items], dtype=float)
+        durations = np.array([item.get("travelDuration", 0) for item in items], dtype=float)
+        if not durations.sum():
+            # Spread the route's duration over the items by distance
+            durations = float(resource["travelDuration"]) * distances / max(distances.sum(), 1e-9)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+    if len(points) < 2 or not len(items):
+        return None
+
+    path_km = _path_lengths(points[:, 0], points[:, 1])
+    total_km = float(path_km[-1])
+    if total_km <= 0:
+        return None
+
+    # Resample the geometry so that stations can be projected onto route points
+    point_km = np.linspace(0.0, total_km, max(2, int(math.ceil(total_km / RESAMPLE_STEP_KM)) + 1))
+    latitudes = np.interp(point_km, path_km, points[:, 0])
+    longitudes = np.interp(point_km, path_km, points[:, 1])
+
+    scale = total_km / distances.sum() if distances.sum() > 0 else 1.0
+    city = np.array([(road_type(item) if road_type else "Unknown") in CITY_ROAD_TYPES for item in items])
+    bounds_km = np.concatenate(([0.0], np.cumsum(distances * scale)))
+    city_km = np.concatenate(([0.0], np.cumsum(np.where(city, distances * scale, 0.0))))
+    hours = np.concatenate(([0.0], np.cumsum(durations / 3600)))
+    return RouteProfile(latitudes, longitudes, point_km, bounds_km, city_km, hours, total_km)
+
+
+def sample_points(profile, spacing_km):
+
+    """
+    Return (latitude, longitude) points along the route at most spacing_km apart, for corridor station queries.
+    """
+
+    count = max(2, int(math.ceil(profile.total_km / spacing_km)) + 1)
+    km = np.linspace(0.0, profile.total_km, count)
+    return list(zip(np.interp(km, profile.point_km, profile.latitudes).tolist(), np.interp(km, profile.point_km, profile.longitudes).tolist()))
+
+
+def encode_polyline(points):
+
+    """
+    Encode (latitude, longitude) points in the encoded polyline format accepted by Open Charge Map.
+    """
+
+    encoded = []
+    previous = (0, 0)
+    for latitude, longitude in points:
+        current = (int(round(latitude * 1e5)), int(round(longitude * 1e5)))
+        for value in (current[0] - previous[0], current[1] - previous[1]):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                encoded.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            encoded.append(chr(value + 63))
+        previous = current
+    return "".join(encoded)
+
+
+def project_stations(profile, stations, chunk_size=256):
+
+    """
+    Project charging stations onto the route.
+
+    Returns:
+    tuple: Arrays of the distance along the route of each station's nearest route point and of the straight-line
+           distance (km) between the station and that point.
+    """
+
+    if not stations:
+        return np.zeros(0), np.zeros(0)
+    locations = np.array([station['location'] for station in stations], dtype=float)
+    km_per_lon = KM_PER_DEGREE * math.cos(math.radians(float(np.mean(profile.latitudes))))
+    route_km = np.empty(len(stations))
+    offset_km = np.empty(len(stations))
+    for start in range(0, len(stations), chunk_size):
+        chunk = locations[start:start + chunk_size]
+        dy = (chunk[:, :1] - profile.latitudes[None, :]) * KM_PER_DEGREE
+        dx = (chunk[:, 1:] - profile.longitudes[None, :]) * km_per_lon
+        squared = dx * dx + dy * dy
+        nearest = np.argmin(squared, axis=1)
+        route_km[start:start + chunk_size] = profile.point_km[nearest]
+        offset_km[start:start + chunk_size] = np.sqrt(squared[np.arange(len(chunk)), nearest])
+    return route_km, offset_km
+
+
+class Corridor(NamedTuple):
+
+    """
+    A route profile with the charging stations near it and the elevation of every station, origin and destination.
+
+    ascent holds the climb (m) accumulated along the route up to each profile point when a local elevation model
+    covers the route, and is None otherwise.
+    """
+
+    profile: RouteProfile
+    stations: list
+    route_km: np.ndarray
+    offset_km: np.ndarray
+    elevations: list  # origin, one per station, destination; None where unknown
+    ascent: np.ndarray = None
+
+
+def profile_ascent(profile, elevation_model):
+
+    """
+    Measure the climb along a route on a local elevation model.
+
+    Args:
+    profile (RouteProfile): The route profile.
+    elevation_model (ElevationModel): The elevation model.
+
+    Returns:
+    array: The ascent (m) accumulated up to each point of the profile, or None unless the model covers the whole route.
+    """
+
+    distance_km, heights = elevation_model.profile(np.column_stack((profile.latitudes, profile.longitudes)))
+    if not len(heights) or np.isnan(heights).any():
+        return None
+    ascent, _ = cumulative_climb(heights)
+    return np.interp(profile.point_km, distance_km * profile.total_km / max(distance_km[-1], 1e-9), ascent)
+
+
+def can_plan(spec):
+
+    """
+    Return True if an EV specification has the usable capacity and all four discharge rates a plan needs.
+    """
+
+    rates = (spec.city_cold_rate, spec.highway_cold_rate, spec.city_mild_rate, spec.highway_mild_rate)
+    return bool(spec.useable_capacity) and all(rate is not None for rate in rates)
+
+
+def corridor_temperatures(corridor, readings, spacing_km=PLAN_TEMPERATURE_SPACING_KM):
+
+    """
+    Spread temperature readings along a corridor.
+
+    Args:
+    corridor (Corridor): The corridor.
+    readings (list): Temperatures read at sample_points(corridor.profile, spacing_km).
+
+    Returns:
+    list: The temperature at the origin, at each corridor station and at the destination, each taken from the
+          reading nearest along the route.
+    """
+
+    sample_km = np.linspace(0.0, corridor.profile.total_km, len(readings))
+    node_km = np.concatenate(([0.0], corridor.route_km, [corridor.profile.total_km]))
+    nearest = np.abs(node_km[:, None] - sample_km[None, :]).argmin(axis=1)
+    return [readings[i] for i in nearest]
+
+
+def ac_power_kw(spec):
+
+    """
+    Return the AC charging power of an EV in kW: charge_power, or its charge_speed (km of range per hour)
+    converted with the combined mild consumption when the power is unknown.
+    """
+
+    if spec.charge_power:
+        return spec.charge_power
+    if spec.charge_speed and spec.combined_mild_rate:
+        return spec.charge_speed * spec.combined_mild_rate / 1000
+    return None
+
+
+def station_charging(station, spec):
+
+    """
+    Find the best connector of a station the EV can use.
+
+    Args:
+    station (dict): Charging station as returned by get_charging_stations.
+    spec (EVSpec): The EV specification.
+
+    Returns:
+    tuple: The charging power in kW and whether it is a fast (DC) charger, or None if no connector fits the EV.
+
+    A connector whose type names the EV's Fast_charge_port (e.g. "CCS (Type 2)" for "CCS") is a fast charger,
+    limited to FAST_CHARGE_POWER_KW; one naming its Charge_Port charges at the EV's AC power. Connectors with a
+    known power are limited to it.
+    """
+
+    fast_port = (spec.fast_charge_port or "").lower()
+    ac_port = (spec.charge_port or "").lower()
+    ac_power = ac_power_kw(spec)
+    best = None
+    for connection in station.get('connections', []):
+        connection_type = str(connection.get('connection_type') or "").lower()
+        power = float(connection.get('power_kw') or 0)
+        if fast_port and fast_port in connection_type:
+            option = (min(power, FAST_CHARGE_POWER_KW) if power else FAST_CHARGE_POWER_KW, True)
+        elif ac_port and ac_port in connection_type and ac_power:
+            option = (min(power, ac_power) if power else ac_power, False)
+        else:
+            continue
+        if best is None or option > best:
+            best = option
+    return best
+
+
+def charge_hours(node, capacity_kwh, from_soc, to_soc):
+
+    """
+    Return the hours needed to charge from from_soc to to_soc percent at a node.
+
+    Fast chargers slow down to FAST_CHARGE_TAPER_FACTOR of their power above FAST_CHARGE_TAPER_SOC.
+    """
+
+    if to_soc <= from_soc:
+        return 0.0
+    kwh_per_percent = capacity_kwh / 100
+    if not node.fast:
+        return (to_soc - from_soc) * kwh_per_percent / node.power_kw
+    full_power = max(0.0, min(to_soc, FAST_CHARGE_TAPER_SOC) - from_soc)
+    tapered = max(0.0, to_soc - max(from_soc, FAST_CHARGE_TAPER_SOC))
+    return (full_power / node.power_kw + tapered / (node.power_kw * FAST_CHARGE_TAPER_FACTOR)) * kwh_per_percent
+
+
+class LegCosts:
+
+    """
+    SOC drop and driving time between the nodes of a corridor, for one EV.
+
+    Costs follow from the route's cumulative profiles: the stretch between two nodes is split into highway and
+    city kilometers with two interpolations, the detours to and from stations are driven as city kilometers, and
+    climbing adds potential energy: the ascent along the route where the corridor has it, else the rise between the
+    two nodes. All legs leaving a node are computed at once, vectorized, the first time the
+    node is expanded and reused for every later label at that node.
+    """
+
+    def __init__(self, nodes, profile, elevations, temperatures, spec, ascent=None):
+        self.nodes = nodes
+        self.route_km = np.array([node.route_km for node in nodes])
+        self.ascent = None if ascent is None else np.interp(self.route_km, profile.point_km, ascent)
+        self.detour_km = np.array([node.detour_km for node in nodes])
+        self.city_km = profile.city_at(self.route_km)
+        self.hours = profile.hours_at(self.route_km)
+        self.elevations = np.array([np.nan if value is None else value for value in elevations], dtype=float)
+        self.temperatures = temperatures
+        self.capacity = spec.useable_capacity
+        self.weight = spec.weight or 0.0
+        self.spec = spec
+        # The lowest consumption of the EV, used by the search's lower bounds
+        rates = [rate for rate in (spec.city_cold_rate, spec.highway_cold_rate, spec.city_mild_rate, spec.highway_mild_rate) if rate]
+        self.min_rate = min(rates) if rates else 0.0
+        self._legs = {}
+        self.computed = 0
+
+    def rates(self, index):
+        temperature = self.temperatures[index]
+        if temperature is not None and temperature < TEMPERATURE_THRESHOLD:
+            return self.spec.city_cold_rate, self.spec.highway_cold_rate
+        return self.spec.city_mild_rate, self.spec.highway_mild_rate
+
+    def legs_from(self, index, max_km):
+
+        """
+        Return the nodes ahead of a node within max_km along the route, with the SOC drop (percent) and the
+        driving hours of the leg to each.
+        """
+
+        cached = self._legs.get(index)
+        if cached is None:
+            ahead = np.nonzero(self.route_km > self.route_km[index])[0]
+            ahead = ahead[self.route_km[ahead] - self.route_km[index] <= max_km]
+            along_km = self.route_km[ahead] - self.route_km[index]
+            city_km = self.city_km[ahead] - self.city_km[index]
+            detour_km = self.detour_km[index] + self.detour_km[ahead]
+            city_rate, highway_rate = self.rates(index)
+            watt_hours = highway_rate * (along_km - city_km) + city_rate * (city_km + detour_km)
+            if self.ascent is not None:
+                climb = self.ascent[ahead] - self.ascent[index]
+            else:
+                climb = np.maximum(np.nan_to_num(self.elevations[ahead] - self.elevations[index], nan=0.0), 0.0)
+            watt_hours = watt_hours + climb * 9.81 * self.weight / 3600
+            soc_drop = watt_hours / (self.capacity * 10)
+            hours = self.hours[ahead] - self.hours[index] + detour_km / PLAN_DETOUR_SPEED_KMH
+            cached = (ahead, soc_drop, hours)
+            self._legs[index] = cached
+            self.computed += len(ahead)
+        return cached
+
+    def min_soc_to_end(self, index):
+        # Lower bound of the SOC (percent) needed from a node to the destination
+        return self.min_rate * (self.route_km[-1] - self.route_km[index]) / (self.capacity * 10)
+
+    def hours_to_end(self, index):
+        return self.hours[-1] - self.hours[index]
+
+
+def prune_stations(stations, route_km, offset_km, charging, corridor_km, section_km=PLAN_SECTION_KM, per_section=PLAN_STATIONS_PER_SECTION):
+
+    """
+    Keep the charging stations worth searching: usable by the EV, within corridor_km of the route and among the
+    per_section most powerful (then closest) stations of their section_km stretch of the route.
+
+    Returns:
+    list: Node entries for the kept stations, ordered along the route.
+    """
+
+    sections = {}
+    for station, km, offset, usable in zip(stations, route_km, offset_km, charging):
+        if usable is None or offset > corridor_km:
+            continue
+        node = Node(float(km), float(offset) * PLAN_DETOUR_FACTOR, usable[0], usable[1], station)
+        sections.setdefault(int(km // section_km), []).append(node)
+    kept = []
+    for nodes in sections.values():
+        nodes.sort(key=lambda node: (-node.power_kw, node.detour_km))
+        kept.extend(nodes[:per_section])
+    kept.sort(key=lambda node: node.route_km)
+    return kept
+
+
+def search_plan(nodes, costs, initial_SOC, min_arrival_SOC=PLAN_MIN_ARRIVAL_SOC, max_charge_SOC=PLAN_MAX_CHARGE_SOC,
+                soc_step=PLAN_SOC_STEP, max_stops=PLAN_MAX_STOPS):
+
+    """
+    Find the fastest sequence of charging stops from the origin (nodes[0]) to the destination (nodes[-1]).
+
+    Args:
+    nodes (list): The origin, the stations ordered along the route and the destination.
+    costs (LegCosts): Leg costs between the nodes.
+    initial_SOC (float): SOC (percent) at the origin.
+    min_arrival_SOC (float): SOC (percent) that must be left at every stop and at the destination.
+    max_charge_SOC (float): Highest SOC (percent) charged to.
+    soc_step (float): Charge levels considered at a stop are multiples of soc_step, plus max_charge_SOC.
+    max_stops (int): Maximum number of charging stops.
+
+    Returns:
+    tuple: The list of (node index, arrival SOC, departure SOC) stops including origin and destination, the total
+           hours and the number of labels expanded; None for the list and hours if no feasible plan exists.
+
+    A* over labels (node, arrival SOC): at a station the EV charges to one of the charge levels and drives to any
+    node ahead it can reach with min_arrival_SOC left. Labels dominated by another label at the same node (arrived
+    no later with no less SOC) are dropped. The heuristic adds the remaining driving time along the route to the
+    time needed to charge the missing energy at the fastest station ahead, both lower bounds, so the first
+    destination label taken from the queue is the fastest plan.
+    """
+
+    destination = len(nodes) - 1
+    capacity = costs.capacity
+    max_range_km = max(max_charge_SOC, initial_SOC) * capacity * 10 / costs.min_rate if costs.min_rate else float("inf")
+    # Highest charging power from each node on, for the heuristic
+    best_power = [0.0] * len(nodes)
+    fastest = 0.0
+    for index in range(destination, -1, -1):
+        fastest = max(fastest, nodes[index].power_kw)
+        best_power[index] = fastest
+    levels = sorted({round(soc_step * k, 6) for k in range(1, int(max_charge_SOC // soc_step) + 1)} | {max_charge_SOC})
+    overhead = PLAN_STOP_OVERHEAD_MINUTES / 60
+
+    def heuristic(index, soc):
+        deficit = costs.min_soc_to_end(index) + min_arrival_SOC - soc
+        if deficit <= 0 or not best_power[index]:
+            return costs.hours_to_end(index)
+        return costs.hours_to_end(index) + deficit * capacity / 100 / best_power[index]
+
+    labels = {0: [(0.0, initial_SOC)]}
+    queue = [(heuristic(0, initial_SOC), 0.0, 0, initial_SOC, 0, None)]
+    expanded = 0
+    while queue:
+        _, elapsed, index, soc, stops, parent = heapq.heappop(queue)
+        if index and (elapsed, soc) not in labels.get(index, ()):
+            continue  # Dominated after it was queued
+        label = (index, soc, elapsed, parent)
+        if index == destination:
+            return _unwind(label), elapsed, expanded
+        expanded += 1
+
+        # Leave the origin without charging, or charge at a station to each level above the arrival SOC
+        if index == 0:
+            departures = [(soc, 0.0)]
+        elif stops < max_stops:
+            departures = [(level, overhead + charge_hours(nodes[index], capacity, soc, level)) for level in levels if level > soc]
+        else:
+            departures = []
+
+        ahead, soc_drop, drive_hours = costs.legs_from(index, max_range_km)
+        for departure_soc, stop_hours in departures:
+            reachable = departure_soc - soc_drop >= min_arrival_SOC
+            for target, drop, hours in zip(ahead[reachable], soc_drop[reachable], drive_hours[reachable]):
+                target = int(target)
+                arrival = round(float(departure_soc - drop), 1)
+                arrival_time = elapsed + stop_hours + float(hours)
+                front = labels.setdefault(target, [])
+                if any(t <= arrival_time and s >= arrival for t, s in front):
+                    continue
+                front[:] = [(t, s) for t, s in front if not (arrival_time <= t and arrival >= s)]
+                front.append((arrival_time, arrival))
+                heapq.heappush(queue, (
+                    arrival_time + heuristic(target, arrival), arrival_time, target, arrival,
+                    stops + (index != 0), (label, departure_soc),
+                ))
+    return None, None, expanded
+
+
+def _unwind(label):
+    # Follow parent links back to the origin; each step is (node index, arrival SOC, departure SOC)
+    steps = []
+    index, soc, _, parent = label
+    departure = soc
+    while True:
+        steps.append((index, soc, departure))
+        if parent is None:
+            break
+        (index, soc, _, parent), departure = parent
+    steps.reverse()
+    return steps
+
+
+class CorridorCache:
+
+    """
+    In-memory LRU of corridors with a fixed time to live, keyed by origin, destination and corridor width.
+    """
+
+    def __init__(self, ttl=PLAN_CORRIDOR_CACHE_TTL, max_entries=PLAN_CORRIDOR_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, corridor):
+        self._entries[key] = (time.monotonic() + self.ttl, corridor)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+def plan_charging_stops(corridor, spec, initial_SOC, temperatures, fast_charging_priority=False,
+                        corridor_km=PLAN_CORRIDOR_KM, min_arrival_SOC=PLAN_MIN_ARRIVAL_SOC):
+
+    """
+    Plan the fastest sequence of charging stops along a corridor for an EV.
+
+    Args:
+    corridor (Corridor): The route profile, the stations near it and the elevations.
+    spec (EVSpec): The EV specification.
+    initial_SOC (float): SOC (percent) at the origin.
+    temperatures (list): Ambient temperature at the origin, at each corridor station and at the destination.
+    fast_charging_priority (bool): Only stop at fast chargers, unless the trip is impossible without AC stations.
+    corridor_km (float): Maximum distance of a stop from the route.
+    min_arrival_SOC (float): SOC (percent) that must be left at every stop and at the destination.
+
+    Returns:
+    dict: The plan, or None if the EV cannot reach the destination with the stations available.
+    """
+
+    charging = [station_charging(station, spec) for station in corridor.stations]
+    if fast_charging_priority:
+        fast_only = [usable if usable and usable[1] else None for usable in charging]
+        plan = _plan(corridor, spec, initial_SOC, temperatures, fast_only, corridor_km, min_arrival_SOC)
+        if plan is not None:
+            plan["fast_charging_only"] = True
+            return plan
+    plan = _plan(corridor, spec, initial_SOC, temperatures, charging, corridor_km, min_arrival_SOC)
+    if plan is not None and fast_charging_priority:
+        plan["fast_charging_only"] = all(stop["fast_charging"] for stop in plan["stops"])
+    return plan
+
+
+def _plan(corridor, spec, initial_SOC, temperatures, charging, corridor_km, min_arrival_SOC):
+    profile = corridor.profile
+    stations = prune_stations(corridor.stations, corridor.route_km, corridor.offset_km, charging, corridor_km)
+    positions = {id(station): i for i, station in enumerate(corridor.stations)}
+    station_indexes = [positions[id(node.station)] for node in stations]
+    nodes = [Node(0.0, 0.0, 0.0, False)] + stations + [Node(profile.total_km, 0.0, 0.0, False)]
+    elevations = [corridor.elevations[0]] + [corridor.elevations[i + 1] for i in station_indexes] + [corridor.elevations[-1]]
+    node_temperatures = [temperatures[0]] + [temperatures[i + 1] for i in station_indexes] + [temperatures[-1]]
+
+    costs = LegCosts(nodes, profile, elevations, node_temperatures, spec, corridor.ascent)
+    steps, total_hours, expanded = search_plan(nodes, costs, initial_SOC, min_arrival_SOC=min_arrival_SOC)
+    if steps is None:
+        return None
+
+    stops = []
+    charging_hours = 0.0
+    for index, arrival, departure in steps[1:-1]:
+        node = nodes[index]
+        hours = charge_hours(node, spec.useable_capacity, arrival, departure)
+        charging_hours += hours
+        stops.append({
+            **node.station,
+            "distance_from_origin_km": round(node.route_km, 1),
+            "detour_km": round(node.detour_km, 1),
+            "arrival_SOC": round(arrival, 1),
+            "departure_SOC": round(departure, 1),
+            "charging_minutes": round(hours * 60, 1),
+            "charging_power_kw": round(node.power_kw, 1),
+            "fast_charging": node.fast,
+        })
+    return {
+        "stops": stops,
+        "total_distance_km": round(profile.total_km + sum(2 * stop["detour_km"] for stop in stops), 1),
+        "total_minutes": round(total_hours * 60, 1),
+        "charging_minutes": round(charging_hours * 60, 1),
+        "arrival_SOC": round(steps[-1][1], 1),
+        **({"total_ascent_m": round(float(corridor.ascent[-1]), 1)} if corridor.ascent is not None else {}),
+        "candidate_stations": len(corridor.stations),
+        "searched_stations": len(nodes) - 2,
+        "expanded_labels": expanded,
+        "leg_costs_computed": costs.computed,
+    }
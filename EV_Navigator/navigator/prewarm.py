@@ -0,0 +1,137 @@
+# Scheduled pre-warming of the caches used by trips to popular destinations and from common origins
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import NamedTuple
+
+# JSON file listing the hot destinations and common origins to keep warm (empty disables pre-warming)
+PREWARM_PATH = os.getenv("PREWARM_PATH", "")
+# Seconds between pre-warming runs; keep it below TEMPERATURE_CACHE_TTL so temperatures stay warm
+PREWARM_INTERVAL_SECONDS = float(os.getenv("PREWARM_INTERVAL_SECONDS", "600"))
+# Seconds to wait between two targets of a run, so pre-warming never bursts against the providers
+PREWARM_SPACING_SECONDS = float(os.getenv("PREWARM_SPACING_SECONDS", "1"))
+# Station search radius (in kilometers) of destinations listed without their own max_radius
+PREWARM_MAX_RADIUS = float(os.getenv("PREWARM_MAX_RADIUS", "10"))
+
+
+class PrewarmTarget(NamedTuple):
+
+    """
+    A location to keep warm. max_radius is the station search radius of a destination and None for an origin.
+    """
+
+    address: str
+    max_radius: float = None
+
+
+def load_prewarm_targets(path=PREWARM_PATH):
+
+    """
+    Read the pre-warming targets from a JSON file.
+
+    Args:
+    path (str): File of the form {"destinations": [...], "origins": [...]}. Destinations are addresses or
+                {"address": ..., "max_radius": ...} objects, origins are addresses.
+
+    Returns:
+    tuple: The destination targets and the origin targets.
+    """
+
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+
+    destinations = []
+    for entry in config.get("destinations", []):
+        if isinstance(entry, str):
+            destinations.append(PrewarmTarget(entry, PREWARM_MAX_RADIUS))
+        else:
+            destinations.append(PrewarmTarget(entry["address"], float(entry.get("max_radius", PREWARM_MAX_RADIUS))))
+    origins = [PrewarmTarget(address) for address in config.get("origins", [])]
+    return destinations, origins
+
+
+class Prewarmer:
+
+    """
+    Periodically runs the lookups of a trip that only depend on its destination or its origin, so that requests
+    for configured locations find them cached.
+
+    warm_destination and warm_origin are coroutine functions taking a PrewarmTarget and returning True if the
+    target was warmed. Targets are warmed one at a time, PREWARM_SPACING_SECONDS apart, and every lookup goes
+    through the same caches, rate limits and circuit breakers as requests.
+    """
+
+    def __init__(self, warm_destination, warm_origin, destinations=(), origins=(), spacing=PREWARM_SPACING_SECONDS):
+        self.warm_destination = warm_destination
+        self.warm_origin = warm_origin
+        self.destinations = list(destinations)
+        self.origins = list(origins)
+        self.spacing = spacing
+        self.runs = 0
+        self.warmed = 0
+        self.failed = 0
+        self.last_run = None
+        self.last_duration = None
+
+    def __len__(self):
+        return len(self.destinations) + len(self.origins)
+
+    async def _warm(self, warm, target):
+        try:
+            warmed = await warm(target)
+        except Exception as e:
+            logging.error(f"Pre-warming {target.address} failed: {e}")
+            warmed = False
+        if warmed:
+            self.warmed += 1
+        else:
+            self.failed += 1
+            logging.warning(f"Could not pre-warm {target.address}")
+
+    async def run_once(self):
+
+        """
+        Warm every configured destination and origin once.
+        """
+
+        started = time.monotonic()
+        jobs = [(self.warm_destination, target) for target in self.destinations]
+        jobs += [(self.warm_origin, target) for target in self.origins]
+        for index, (warm, target) in enumerate(jobs):
+            if index and self.spacing > 0:
+                await asyncio.sleep(self.spacing)
+            await self._warm(warm, target)
+        self.runs += 1
+        self.last_run = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
+        self.last_duration = time.monotonic() - started
+        logging.info(f"Pre-warmed {len(self.destinations)} destinations and {len(self.origins)} origins in {self.last_duration:.1f} seconds")
+
+    async def run_periodic(self, interval=PREWARM_INTERVAL_SECONDS):
+
+        """
+        Warm all targets now and then every interval seconds until cancelled (once only if interval is 0).
+        """
+
+        while True:
+            await self.run_once()
+            if interval <= 0:
+                return
+            await asyncio.sleep(interval)
+
+    def stats(self):
+
+        """
+        Return the number of targets, runs and warmed or failed targets, and when the last run happened.
+        """
+
+        return {
+            "destinations": len(self.destinations),
+            "origins": len(self.origins),
+            "runs": self.runs,
+            "warmed": self.warmed,
+            "failed": self.failed,
+            "last_run": self.last_run,
+            "last_duration": self.last_duration,
+        }
@@ -0,0 +1,422 @@
+# Data source providers with live, record-to-disk and replay-from-disk implementations
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from typing import NamedTuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl
+
+import httpx
+from geopy.exc import GeocoderTimedOut
+
+from http_client import limited_get, get_request_semaphore
+from geocoding import normalize_address
+from metrics import provider_call, provider_error
+from resilience import ResilientProvider, ResilientGeocodingProvider
+
+# Data sources used by the navigator; each one gets its own provider and recordings directory
+PROVIDER_NAMES = ("open_meteo", "ocm", "bing_routes", "bing_walking", "bing_elevation", "bing_distance_matrix", "nominatim")
+
+# Provider mode for every data source: "live", "record" (live and written to disk) or "replay" (served from disk).
+# A single source can be overridden with PROVIDER_MODE_<NAME>, e.g. PROVIDER_MODE_NOMINATIM=live
+PROVIDER_MODE = os.getenv("PROVIDER_MODE", "live")
+# Directory holding one sub-directory of recorded responses per data source
+PROVIDER_RECORDINGS_PATH = os.getenv("PROVIDER_RECORDINGS_PATH", os.path.join("cache", "recordings"))
+# Replayed latency: "recorded" to reuse the measured latency of each response, or a fixed number of seconds
+PROVIDER_REPLAY_LATENCY = os.getenv("PROVIDER_REPLAY_LATENCY", "recorded")
+# Factor applied to the replayed latency and random extra latency (in seconds) added to it
+PROVIDER_REPLAY_LATENCY_SCALE = float(os.getenv("PROVIDER_REPLAY_LATENCY_SCALE", "1"))
+PROVIDER_REPLAY_JITTER = float(os.getenv("PROVIDER_REPLAY_JITTER", "0"))
+# Share of replayed requests that fail, and how: "status" (HTTP 503) or "timeout"
+PROVIDER_REPLAY_ERROR_RATE = float(os.getenv("PROVIDER_REPLAY_ERROR_RATE", "0"))
+PROVIDER_REPLAY_ERROR_KIND = os.getenv("PROVIDER_REPLAY_ERROR_KIND", "status")
+# Seed for latency jitter and error injection, so replayed runs can be repeated exactly
+PROVIDER_REPLAY_SEED = os.getenv("PROVIDER_REPLAY_SEED")
+
+# Query parameters left out of recording keys so recordings do not depend on (or leak) API keys
+SECRET_PARAMETERS = {"key"}
+
+
+def request_key(url, params=None):
+
+    """
+    Build the identity of a request from its URL and parameters, independent of parameter order and API keys.
+
+    Args:
+    url (str): The requested URL, possibly including a query string.
+    params (dict): Optional query string parameters.
+
+    Returns:
+    str: The normalized request, e.g. "https://host/path?a=1&b=2".
+    """
+
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    query += [(name, str(value)) for name, value in (params or {}).items()]
+    query = sorted((name, value) for name, value in query if name not in SECRET_PARAMETERS)
+    normalized = "&".join(f"{name}={value}" for name, value in query)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, normalized, ""))
+
+
+class RecordingStore:
+
+    """
+    Directory of recorded provider responses, one JSON file per request key.
+    """
+
+    def __init__(self, name, path=PROVIDER_RECORDINGS_PATH):
+        self.name = name
+        self.directory = os.path.join(path, name)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def load(self, key):
+
+        """
+        Return the recording stored for key, or None if there is none.
+        """
+
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, key, recording):
+
+        """
+        Store a recording under key, replacing any earlier one.
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = self._path(key) + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(dict(recording, key=key), f)
+        os.replace(temporary, self._path(key))
+
+
+class FaultInjector:
+
+    """
+    Decides the artificial latency and failures of replayed requests.
+    """
+
+    def __init__(self, latency=PROVIDER_REPLAY_LATENCY, scale=PROVIDER_REPLAY_LATENCY_SCALE, jitter=PROVIDER_REPLAY_JITTER,
+                 error_rate=PROVIDER_REPLAY_ERROR_RATE, error_kind=PROVIDER_REPLAY_ERROR_KIND, seed=PROVIDER_REPLAY_SEED):
+        self.latency = latency
+        self.scale = scale
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_kind = error_kind
+        self._random = random.Random(seed)
+
+    def delay(self, recorded_elapsed):
+
+        """
+        Return the number of seconds a replayed request takes.
+        """
+
+        base = recorded_elapsed if self.latency == "recorded" else float(self.latency)
+        return max(0.0, base * self.scale + self._random.uniform(0, self.jitter))
+
+    def should_fail(self):
+
+        """
+        Return True if the next replayed request has to fail.
+        """
+
+        return self.error_rate > 0 and self._random.random() < self.error_rate
+
+
+class LiveProvider:
+
+    """
+    Sends requests to the real data source through the shared, concurrency-limited HTTP client.
+    """
+
+    mode = "live"
+
+    def __init__(self, name):
+        self.name = name
+
+    async def get(self, url, params=None):
+
+        """
+        Perform a GET request against the data source.
+
+        Args:
+        url (str): The URL to request.
+        params (dict): Optional query string parameters.
+
+        Returns:
+        httpx.Response: The response returned by the data source.
+        """
+
+        with provider_call(self.name):
+            response = await limited_get(url, params=params)
+        if response.status_code >= 400:
+            provider_error(self.name)
+        return response
+
+
+class RecordingProvider(LiveProvider):
+
+    """
+    Sends requests to the real data source and writes every response, with its latency, to disk.
+    """
+
+    mode = "record"
+
+    def __init__(self, name, store=None):
+        super().__init__(name)
+        self.store = store if store is not None else RecordingStore(name)
+
+    async def get(self, url, params=None):
+        started = time.monotonic()
+        response = await super().get(url, params=params)
+        recording = {
+            "status_code": response.status_code,
+            "content_type": response.headers.get("content-type", "application/json"),
+            "body": response.text,
+            "elapsed": time.monotonic() - started,
+        }
+        try:
+            await asyncio.to_thread(self.store.save, request_key(url, params), recording)
+        except OSError as e:
+            logging.error(f"Could not record {self.name} response: {e}")
+        return response
+
+
+class ReplayProvider:
+
+    """
+    Serves recorded responses from disk, with artificial latency and injected errors and without any network access.
+
+    Requests without a recording are answered with HTTP 504 (gateway timeout), which callers treat like any other failed lookup.
+    """
+
+    mode = "replay"
+
+    def __init__(self, name, store=None, faults=None):
+        self.name = name
+        self.store = store if store is not None else RecordingStore(name)
+        self.faults = faults if faults is not None else FaultInjector()
+        self.misses = 0
+
+    async def get(self, url, params=None):
+        request = httpx.Request("GET", url, params=params)
+        key = request_key(url, params)
+        recording = await asyncio.to_thread(self.store.load, key)
+        if recording is None:
+            self.misses += 1
+            logging.warning(f"No {self.name} recording for {key}")
+            return httpx.Response(504, request=request)
+
+        # Hold a request slot while waiting, like a real request would
+        with provider_call(self.name):
+            async with get_request_semaphore():
+                await asyncio.sleep(self.faults.delay(recording.get("elapsed", 0)))
+            failed = self.faults.should_fail()
+            if failed and self.faults.error_kind == "timeout":
+                raise httpx.ReadTimeout(f"Injected {self.name} timeout", request=request)
+        if failed or recording["status_code"] >= 400:
+            provider_error(self.name)
+        if failed:
+            return httpx.Response(503, request=request)
+        return httpx.Response(
+            recording["status_code"],
+            headers={"content-type": recording.get("content_type", "application/json")},
+            content=recording["body"].encode("utf-8"),
+            request=request,
+        )
+
+
+class GeocodedLocation(NamedTuple):
+
+    """
+    Replayed geocoding result, exposing the attributes used from geopy locations.
+    """
+
+    latitude: float
+    longitude: float
+
+
+class LiveGeocodingProvider:
+
+    """
+    Geocodes addresses with a geopy geocoder such as Nominatim.
+    """
+
+    mode = "live"
+
+    def __init__(self, geolocator, name="nominatim"):
+        self.geolocator = geolocator
+        self.name = name
+
+    def geocode(self, address, timeout=None):
+
+        """
+        Geocode an address. Blocking; run it in a worker thread.
+
+        Args:
+        address (str): The address to geocode.
+        timeout (float): Optional timeout in seconds replacing the geocoder's default.
+
+        Returns:
+        object: A location with latitude and longitude attributes, or None if the address is not found.
+        """
+
+        options = {} if timeout is None else {"timeout": timeout}
+        with provider_call(self.name):
+            return self.geolocator.geocode(address, **options)
+
+
+class RecordingGeocodingProvider(LiveGeocodingProvider):
+
+    """
+    Geocodes addresses with a geopy geocoder and writes every result, with its latency, to disk.
+    """
+
+    mode = "record"
+
+    def __init__(self, geolocator, name="nominatim", store=None):
+        super().__init__(geolocator, name)
+        self.store = store if store is not None else RecordingStore(name)
+
+    def geocode(self, address, timeout=None):
+        started = time.monotonic()
+        location = super().geocode(address, timeout=timeout)
+        recording = {
+            "result": [location.latitude, location.longitude] if location else None,
+            "elapsed": time.monotonic() - started,
+        }
+        try:
+            self.store.save(normalize_address(address), recording)
+        except OSError as e:
+            logging.error(f"Could not record {self.name} response: {e}")
+        return location
+
+
+class ReplayGeocodingProvider:
+
+    """
+    Serves recorded geocoding results from disk, with artificial latency and injected timeouts.
+
+    Addresses without a recording are reported as a geocoder timeout.
+    """
+
+    mode = "replay"
+
+    def __init__(self, name="nominatim", store=None, faults=None):
+        self.name = name
+        self.store = store if store is not None else RecordingStore(name)
+        self.faults = faults if faults is not None else FaultInjector()
+        self.misses = 0
+
+    def geocode(self, address, timeout=None):
+        recording = self.store.load(normalize_address(address))
+        if recording is None:
+            self.misses += 1
+            raise GeocoderTimedOut(f"No {self.name} recording for {address}")
+        with provider_call(self.name):
+            delay = self.faults.delay(recording.get("elapsed", 0))
+            if timeout is not None and delay > timeout:
+                time.sleep(timeout)
+                raise GeocoderTimedOut(f"Replayed {self.name} response took longer than {timeout:.1f} seconds")
+            time.sleep(delay)
+            if self.faults.should_fail():
+                raise GeocoderTimedOut(f"Injected {self.name} timeout")
+        result = recording["result"]
+        return GeocodedLocation(*result) if result else None
+
+
+def provider_mode(name):
+
+    """
+    Return the configured mode of a data source.
+    """
+
+    mode = os.getenv(f"PROVIDER_MODE_{name.upper()}", PROVIDER_MODE)
+    if mode not in ("live", "record", "replay"):
+        logging.warning(f"Unknown provider mode '{mode}' for {name}, using live.")
+        return "live"
+    return mode
+
+
+_providers = {}
+
+
+def get_provider(name):
+
+    """
+    Return the HTTP provider of a data source, created on first use according to its configured mode.
+
+    Args:
+    name (str): One of PROVIDER_NAMES.
+
+    Returns:
+    object: A provider with an async get(url, params) method returning an httpx.Response.
+
+    Every provider is wrapped with the data source's timeout, circuit breaker and hedging settings.
+    """
+
+    provider = _providers.get(name)
+    if provider is None:
+        mode = provider_mode(name)
+        if mode == "record":
+            provider = RecordingProvider(name)
+        elif mode == "replay":
+            provider = ReplayProvider(name)
+        else:
+            provider = LiveProvider(name)
+        provider = ResilientProvider(provider)
+        _providers[name] = provider
+    return provider
+
+
+def get_geocoding_provider(geolocator, name="nominatim"):
+
+    """
+    Return the geocoding provider for a geopy geocoder according to the configured mode of the data source.
+
+    Args:
+    geolocator: The geopy geocoder used by the live and recording providers.
+    name (str): The data source name.
+
+    Returns:
+    object: A provider with a blocking geocode(address) method.
+    """
+
+    mode = provider_mode(name)
+    if mode == "record":
+        provider = RecordingGeocodingProvider(geolocator, name)
+    elif mode == "replay":
+        provider = ReplayGeocodingProvider(name)
+    else:
+        provider = LiveGeocodingProvider(geolocator, name)
+    provider = ResilientGeocodingProvider(provider)
+    _providers[name] = provider
+    return provider
+
+
+def provider_stats():
+
+    """
+    Return the mode, timeout and circuit breaker state of every data source in use and, for replayed sources, the
+    number of requests without a recording.
+    """
+
+    stats = {}
+    for name in PROVIDER_NAMES:
+        provider = _providers.get(name)
+        if provider is None:
+            stats[name] = {"mode": provider_mode(name)}
+            continue
+        stats[name] = {"mode": provider.mode, **provider.stats()}
+        if isinstance(provider.provider, (ReplayProvider, ReplayGeocodingProvider)):
+            stats[name]["missing_recordings"] = provider.provider.misses
+    return stats
@@ -0,0 +1,348 @@
+# Request deadlines, per-provider timeouts, circuit breakers and hedged requests for the external data sources
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+
+import httpx
+from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
+
+from metrics import PROVIDER_CIRCUIT_STATE, PROVIDER_HEDGES, provider_error
+from scheduler import get_scheduler
+
+# Seconds a request may take in total; provider calls get at most the remaining budget (0 disables the deadline)
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "30"))
+# Budget of a whole /calculate_routes batch
+BATCH_REQUEST_DEADLINE_SECONDS = float(os.getenv("BATCH_REQUEST_DEADLINE_SECONDS", "240"))
+# Header in which the gateway passes the number of seconds it is still willing to wait
+DEADLINE_HEADER = "X-Request-Deadline"
+
+# Timeout (in seconds) of a single call to each data source, overridable with PROVIDER_TIMEOUT_<NAME>
+DEFAULT_PROVIDER_TIMEOUTS = {
+    "open_meteo": 3,
+    "ocm": 8,
+    "bing_routes": 5,
+    "bing_walking": 5,
+    "bing_elevation": 3,
+    "bing_distance_matrix": 8,
+    "nominatim": 5,
+}
+# Consecutive failed calls after which a data source is considered down and calls to it fail immediately
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+# Seconds a tripped circuit stays open before a single trial call is let through
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+# Seconds after which a second, identical request is sent if the first has not answered, per data source
+# (PROVIDER_HEDGE_DELAY_<NAME>, e.g. PROVIDER_HEDGE_DELAY_BING_ROUTES=0.8); 0 disables hedging
+HEDGE_DELAY_DEFAULT = 0.0
+
+# HTTP status codes counted as a failure of the data source rather than of the request
+FAILURE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(httpx.TimeoutException):
+
+    """
+    Raised instead of calling a data source once the request has used up its deadline.
+    """
+
+
+class CircuitOpenError(httpx.TransportError):
+
+    """
+    Raised instead of calling a data source whose circuit breaker is open.
+    """
+
+
+def provider_timeout(name):
+    return float(os.getenv(f"PROVIDER_TIMEOUT_{name.upper()}", DEFAULT_PROVIDER_TIMEOUTS.get(name, 10)))
+
+
+def hedge_delay(name):
+    return float(os.getenv(f"PROVIDER_HEDGE_DELAY_{name.upper()}", HEDGE_DELAY_DEFAULT))
+
+
+def start_deadline(seconds):
+
+    """
+    Give the current request a deadline seconds from now; None or 0 removes it.
+
+    Tasks and worker threads started afterwards inherit the deadline.
+    """
+
+    _deadline.set(time.monotonic() + seconds if seconds else None)
+
+
+def remaining_time():
+
+    """
+    Return the seconds left until the deadline of the current request, or None if it has none.
+    """
+
+    deadline = _deadline.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def call_timeout(timeout):
+
+    """
+    Shorten a call timeout to the remaining deadline budget.
+
+    Args:
+    timeout (float): The timeout of the data source.
+
+    Returns:
+    float: The timeout to use, 0 once the deadline has passed.
+    """
+
+    remaining = remaining_time()
+    return timeout if remaining is None else min(timeout, remaining)
+
+
+async def within_deadline(awaitable):
+
+    """
+    Await awaitable, raising asyncio.TimeoutError when the deadline of the current request passes first.
+    """
+
+    remaining = remaining_time()
+    if remaining is None:
+        return await awaitable
+    return await asyncio.wait_for(awaitable, remaining)
+
+
+class CircuitBreaker:
+
+    """
+    Tracks the health of one data source.
+
+    After failure_threshold consecutive failures the circuit opens and calls are rejected without contacting the
+    data source. After reset_seconds a single trial call is let through (half-open): success closes the circuit,
+    failure opens it again. Thread-safe, because geocoding calls run in worker threads.
+    """
+
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+        self.rejected = 0
+        self.opened = 0
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        self.state = state
+        PROVIDER_CIRCUIT_STATE.labels(self.name).set(self.STATES[state])
+
+    def allow(self):
+
+        """
+        Return True if a call may be made now.
+        """
+
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self._set_state("half_open")
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.trial_running = False
+            if self.state != "closed":
+                logging.info(f"Circuit for {self.name} closed")
+                self._set_state("closed")
+
+    def abandon(self):
+
+        """
+        Forget a call that ended without telling anything about the data source, e.g. because it was cancelled, so a
+        half-open circuit lets the next trial call through.
+        """
+
+        with self._lock:
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold > 0):
+                logging.warning(f"Circuit for {self.name} opened after {self.failures} consecutive failures")
+                self.opened += 1
+                self.opened_at = time.monotonic()
+                self._set_state("open")
+
+    def stats(self):
+        return {"state": self.state, "consecutive_failures": self.failures, "opened": self.opened, "rejected": self.rejected}
+
+
+class ResilientProvider:
+
+    """
+    Wraps an HTTP provider with the rate limit of its quota, a per-call timeout bounded by the request deadline, a
+    circuit breaker and optional request hedging.
+
+    Calls are checked against the circuit breaker before they wait in the quota's priority queue, so calls to an open
+    circuit fail at once without taking tokens; the wait counts against the request deadline but not against the call
+    timeout. Calls that cannot be made (deadline used up, circuit open) and calls that time out raise httpx
+    errors, so callers handle them like any other failed lookup. A hedged request is only sent if the quota has a
+    token to spare.
+    """
+
+    def __init__(self, provider, timeout=None, breaker=None, hedge_after=None, scheduler=None):
+        self.provider = provider
+        self.name = provider.name
+        self.timeout = timeout if timeout is not None else provider_timeout(self.name)
+        self.breaker = breaker if breaker is not None else CircuitBreaker(self.name)
+        self.scheduler = scheduler if scheduler is not None else get_scheduler(self.name)
+        self.hedge_after = hedge_after if hedge_after is not None else hedge_delay(self.name)
+        self.hedges = 0
+
+    @property
+    def mode(self):
+        return self.provider.mode
+
+    async def get(self, url, params=None):
+
+        """
+        Perform a GET request against the data source.
+
+        Args:
+        url (str): The URL to request.
+        params (dict): Optional query string parameters.
+
+        Returns:
+        httpx.Response: The response returned by the data source.
+        """
+
+        request = httpx.Request("GET", url, params=params)
+        if not self.breaker.allow():
+            provider_error(self.name, "circuit_open")
+            raise CircuitOpenError(f"Circuit for {self.name} is open", request=request)
+        try:
+            await within_deadline(self.scheduler.acquire())
+        except asyncio.TimeoutError:
+            pass  # Still queued at the deadline: rejected as out of time just below
+        except asyncio.CancelledError:
+            self.breaker.abandon()
+            raise
+        timeout = call_timeout(self.timeout)
+        if timeout <= 0:
+            # The call is never made, so a half-open circuit must let the next trial through
+            self.breaker.abandon()
+            provider_error(self.name, "deadline")
+            raise DeadlineExceeded(f"No time left to call {self.name}", request=request)
+
+        try:
+            if self.hedge_after > 0:
+                response = await asyncio.wait_for(self._hedged_get(url, params), timeout)
+            else:
+                response = await asyncio.wait_for(self.provider.get(url, params=params), timeout)
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            provider_error(self.name, "timeout")
+            raise httpx.ReadTimeout(f"{self.name} did not answer within {timeout:.1f} seconds", request=request)
+        except asyncio.CancelledError:
+            self.breaker.abandon()
+            raise
+        except BaseException:
+            # HTTP errors, and anything else the provider raises (e.g. a broken replay recording), count as failures
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code in FAILURE_STATUS_CODES:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def _hedged_get(self, url, params):
+        # Send a second request if the first is slower than hedge_after and use whichever answers first
+        attempts = [asyncio.ensure_future(self.provider.get(url, params=params))]
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=self.hedge_after)
+            if not done and await self.scheduler.try_acquire():
+                self.hedges += 1
+                PROVIDER_HEDGES.labels(self.name).inc()
+                attempts.append(asyncio.ensure_future(self.provider.get(url, params=params)))
+            pending = set(attempts)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        return attempt.result()
+                    error = attempt.exception()
+            raise error
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+    def stats(self):
+        return {"timeout": self.timeout, "hedge_after": self.hedge_after, "hedges": self.hedges, "circuit": self.breaker.stats()}
+
+
+class ResilientGeocodingProvider:
+
+    """
+    Wraps a geocoding provider with a per-call timeout bounded by the request deadline and a circuit breaker.
+
+    Calls that cannot be made raise geopy errors, which get_coordinates handles like any other failed lookup.
+    """
+
+    def __init__(self, provider, timeout=None, breaker=None):
+        self.provider = provider
+        self.name = provider.name
+        self.timeout = timeout if timeout is not None else provider_timeout(self.name)
+        self.breaker = breaker if breaker is not None else CircuitBreaker(self.name)
+
+    @property
+    def mode(self):
+        return self.provider.mode
+
+    def geocode(self, address):
+
+        """
+        Geocode an address. Blocking; run it in a worker thread.
+
+        Returns:
+        object: A location with latitude and longitude attributes, or None if the address is not found.
+        """
+
+        timeout = call_timeout(self.timeout)
+        if timeout <= 0:
+            provider_error(self.name, "deadline")
+            raise GeocoderTimedOut(f"No time left to call {self.name}")
+        if not self.breaker.allow():
+            provider_error(self.name, "circuit_open")
+            raise GeocoderUnavailable(f"Circuit for {self.name} is open")
+        try:
+            location = self.provider.geocode(address, timeout=timeout)
+        except BaseException:
+            # Every GeocoderServiceError (timeouts, unavailability, rate limits and exhausted quotas, like HTTP 429 and
+            # 5xx) and any other error counts, so a half-open circuit never keeps waiting for its trial call
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return location
+
+    def stats(self):
+        return {"timeout": self.timeout, "circuit": self.breaker.stats()}
@@ -0,0 +1,698 @@
+# Offline routing over an OpenStreetMap extract: road graphs per travel mode, contraction hierarchies and
+# one-to-many queries answering driving and walking legs without Bing Maps
+import bz2
+import gzip
+import heapq
+import logging
+import math
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from collections import OrderedDict
+from typing import NamedTuple, Tuple
+
+import numpy as np
+
+from leg_cache import ROAD_TYPES
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, where every worker builds its own index
+    fcntl = None
+
+# OpenStreetMap extract in OSM XML (.osm, .osm.gz or .osm.bz2); empty to route with Bing Maps.
+# Convert .osm.pbf extracts first, e.g. with "osmium cat region.osm.pbf -o region.osm.bz2"
+ROAD_NETWORK_PATH = os.getenv("ROAD_NETWORK_PATH", "")
+# Directory for the precomputed routing indexes, rebuilt whenever the extract changes
+ROAD_NETWORK_INDEX_DIR = os.getenv("ROAD_NETWORK_INDEX_DIR", os.path.join("cache", "routing"))
+# Points further than this (in kilometers) from the road network are routed with Bing Maps
+ROUTING_MAX_SNAP_KM = float(os.getenv("ROUTING_MAX_SNAP_KM", "0.5"))
+# Walking speed (km/h) of offline walking legs
+WALKING_SPEED_KMH = float(os.getenv("WALKING_SPEED_KMH", "5"))
+# Number of origins whose upward search is kept for one-to-many queries
+ROUTING_ORIGIN_CACHE_SIZE = int(os.getenv("ROUTING_ORIGIN_CACHE_SIZE", "256"))
+
+# Bumped whenever the index layout or the graph rules change, so old indexes are rebuilt
+INDEX_VERSION = 1
+# Nodes settled by a witness search before it gives up and keeps the shortcut
+WITNESS_SETTLE_LIMIT = 60
+# Size (in degrees) of the grid used to snap points to the nearest road node
+SNAP_GRID_DEGREES = 0.01
+EARTH_RADIUS_KM = 6371.0088
+
+# Road type and default speed (km/h) of each OSM highway class open to cars, using the road types of Bing Maps
+DRIVING_HIGHWAYS = {
+    "motorway": ("LimitedAccessHighway", 110),
+    "motorway_link": ("Ramp", 60),
+    "trunk": ("Highway", 90),
+    "trunk_link": ("Ramp", 50),
+    "primary": ("MajorRoad", 70),
+    "primary_link": ("Ramp", 40),
+    "secondary": ("Arterial", 60),
+    "secondary_link": ("Arterial", 40),
+    "tertiary": ("Arterial", 50),
+    "tertiary_link": ("Arterial", 35),
+    "unclassified": ("LocalRoad", 40),
+    "road": ("LocalRoad", 30),
+    "service": ("LocalRoad", 20),
+    "residential": ("Street", 30),
+    "living_street": ("Street", 10),
+}
+# OSM highway classes open to pedestrians unless tagged otherwise
+WALKING_HIGHWAYS = (
+    set(DRIVING_HIGHWAYS) - {"motorway", "motorway_link", "trunk", "trunk_link"}
+    | {"footway", "path", "pedestrian", "steps", "track", "cycleway", "bridleway", "corridor"}
+)
+# Speed (km/h) assumed between a point and the road node it is snapped to
+ACCESS_SPEED_KMH = {"driving": 20, "walking": WALKING_SPEED_KMH}
+ACCESS_ROAD_TYPE = ROAD_TYPES.index("LocalRoad")
+MODES = ("driving", "walking")
+TAGS = {"highway", "oneway", "junction", "maxspeed", "access", "motor_vehicle", "motorcar", "foot", "area"}
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def _open_extract(path):
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def read_osm(path):
+
+    """
+    Read the nodes and highway ways of an OSM XML extract.
+
+    Args:
+    path (str): The extract.
+
+    Returns:
+    tuple: A dict from node id to (latitude, longitude) of the nodes used by highways, and a list of (node ids,
+           tags) per highway way, with only the tags relevant to routing.
+    """
+
+    coordinates = {}
+    ways = []
+    with _open_extract(path) as f:
+        for _, element in ElementTree.iterparse(f, events=("end",)):
+            if element.tag == "node":
+                coordinates[int(element.get("id"))] = (float(element.get("lat")), float(element.get("lon")))
+                element.clear()
+            elif element.tag == "way":
+                tags = {tag.get("k"): tag.get("v") for tag in element.iter("tag") if tag.get("k") in TAGS}
+                if "highway" in tags:
+                    ways.append(([int(nd.get("ref")) for nd in element.iter("nd")], tags))
+                element.clear()
+            elif element.tag == "relation":
+                element.clear()
+    used = {ref for refs, _ in ways for ref in refs}
+    return {ref: coordinates[ref] for ref in used if ref in coordinates}, ways
+
+
+def max_speed(tags, default):
+
+    """
+    Return the speed (km/h) of a way from its maxspeed tag, or default when it is missing or not numeric.
+    """
+
+    match = re.match(r"\s*(\d+(?:\.\d+)?)\s*(mph)?", tags.get("maxspeed", ""))
+    if not match:
+        return default
+    speed = float(match.group(1)) * (1.609344 if match.group(2) else 1)
+    return speed if speed > 0 else default
+
+
+def way_rule(tags, mode):
+
+    """
+    Decide how a way is used by a travel mode.
+
+    Returns:
+    tuple: The road type index, speed in km/h and direction (1 forward only, -1 backward only, 0 both ways), or
+           None if the way cannot be used.
+    """
+
+    highway = tags.get("highway")
+    if tags.get("area") == "yes":
+        return None
+    if mode == "walking":
+        if tags.get("foot") in ("no", "private") or (highway not in WALKING_HIGHWAYS and tags.get("foot") not in ("yes", "designated")):
+            return None
+        if tags.get("access") in ("no", "private") and tags.get("foot") not in ("yes", "designated"):
+            return None
+        return ROAD_TYPES.index("Street"), WALKING_SPEED_KMH, 0
+
+    if highway not in DRIVING_HIGHWAYS:
+        return None
+    if tags.get("access") in ("no", "private") or tags.get("motor_vehicle") in ("no", "private") or tags.get("motorcar") in ("no", "private"):
+        return None
+    road_type, speed = DRIVING_HIGHWAYS[highway]
+    oneway = tags.get("oneway")
+    if oneway in ("yes", "true", "1"):
+        direction = 1
+    elif oneway == "-1":
+        direction = -1
+    elif oneway != "no" and (highway == "motorway" or tags.get("junction") in ("roundabout", "circular")):
+        direction = 1
+    else:
+        direction = 0
+    return ROAD_TYPES.index(road_type), max_speed(tags, speed), direction
+
+
+class RoadGraph(NamedTuple):
+
+    """
+    The road graph of one travel mode: intersections and way ends as nodes, the road between two of them as an edge
+    with its travel time and its length per road type (in the order of ROAD_TYPES).
+    """
+
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+    sources: np.ndarray
+    targets: np.ndarray
+    seconds: np.ndarray
+    road_km: np.ndarray
+
+
+def build_graph(coordinates, ways, mode):
+
+    """
+    Build the road graph of a travel mode from the output of read_osm.
+
+    Ways are split at nodes shared with other usable ways, so edges join intersections. Parallel edges keep the
+    fastest.
+    """
+
+    usable = []
+    uses = {}
+    for refs, tags in ways:
+        rule = way_rule(tags, mode)
+        refs = [ref for ref in refs if ref in coordinates]
+        if rule is None or len(refs) < 2:
+            continue
+        usable.append((refs, rule))
+        for ref in refs:
+            uses[ref] = uses.get(ref, 0) + 1
+        uses[refs[0]] += 1
+        uses[refs[-1]] += 1
+
+    index = {}
+    latitudes, longitudes = [], []
+
+    def node(ref):
+        if ref not in index:
+            index[ref] = len(latitudes)
+            latitudes.append(coordinates[ref][0])
+            longitudes.append(coordinates[ref][1])
+        return index[ref]
+
+    best = {}  # (source, target) -> (seconds, road type, km)
+    for refs, (road_type, speed, direction) in usable:
+        points = np.array([coordinates[ref] for ref in refs])
+        lengths = haversine_km(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1])
+        start = 0
+        km = 0.0
+        for position in range(1, len(refs)):
+            km += float(lengths[position - 1])
+            if position < len(refs) - 1 and uses[refs[position]] < 2:
+                continue
+            u, v = node(refs[start]), node(refs[position])
+            seconds = km / speed * 3600
+            if u != v:
+                for pair, allowed in (((u, v), direction >= 0), ((v, u), direction <= 0)):
+                    if allowed and (pair not in best or best[pair][0] > seconds):
+                        best[pair] = (seconds, road_type, km)
+            start = position
+            km = 0.0
+
+    road_km = np.zeros((len(best), len(ROAD_TYPES)), dtype=np.float32)
+    pairs = list(best.items())
+    for edge, (_, (_, road_type, km)) in enumerate(pairs):
+        road_km[edge, road_type] = km
+    return RoadGraph(
+        np.array(latitudes, dtype=float),
+        np.array(longitudes, dtype=float),
+        np.array([pair[0] for pair, _ in pairs], dtype=np.int32),
+        np.array([pair[1] for pair, _ in pairs], dtype=np.int32),
+        np.array([value[0] for _, value in pairs], dtype=float),
+        road_km,
+    )
+
+
+def contract(graph, settle_limit=WITNESS_SETTLE_LIMIT):
+
+    """
+    Build a contraction hierarchy over a road graph.
+
+    Nodes are contracted in order of edge difference plus contracted neighbours, with lazy priority updates. Contracting
+    a node adds a shortcut between each pair of its remaining neighbours unless a bounded witness search finds a path
+    that is at least as fast without it. A shortcut carries the summed time and per-road-type lengths of the two edges
+    it replaces, and remembers them for unpacking.
+
+    Returns:
+    dict: Arrays of the node ranks and of every edge (original edges first, then shortcuts): source, target, seconds,
+          road_km and the two child edges (-1 for original edges).
+    """
+
+    count = len(graph.latitudes)
+    sources = graph.sources.tolist()
+    targets = graph.targets.tolist()
+    seconds = graph.seconds.tolist()
+    road_km = [tuple(row) for row in graph.road_km.tolist()]
+    children = [(-1, -1)] * len(sources)
+    outgoing = [dict() for _ in range(count)]
+    incoming = [dict() for _ in range(count)]
+    for edge, (u, v) in enumerate(zip(sources, targets)):
+        outgoing[u][v] = edge
+        incoming[v][u] = edge
+
+    def witness(source, skip, limit_seconds):
+        distances = {source: 0.0}
+        heap = [(0.0, source)]
+        settled = 0
+        while heap:
+            distance, u = heapq.heappop(heap)
+            if distance > distances[u]:
+                continue
+            if distance > limit_seconds or settled >= settle_limit:
+                break
+            settled += 1
+            for w, edge in outgoing[u].items():
+                if w == skip:
+                    continue
+                candidate = distance + seconds[edge]
+                if candidate < distances.get(w, math.inf):
+                    distances[w] = candidate
+                    heapq.heappush(heap, (candidate, w))
+        return distances
+
+    def shortcuts_for(v):
+        needed = []
+        outs = list(outgoing[v].items())
+        for u, edge_in in incoming[v].items():
+            via = {w: seconds[edge_in] + seconds[edge_out] for w, edge_out in outs if w != u}
+            if not via:
+                continue
+            distances = witness(u, v, max(via.values()))
+            for w, edge_out in outs:
+                if w != u and distances.get(w, math.inf) > via[w]:
+                    needed.append((u, w, via[w], edge_in, edge_out))
+        return needed
+
+    contracted_neighbours = [0] * count
+
+    def priority(v, needed):
+        return len(needed) - len(incoming[v]) - len(outgoing[v]) + contracted_neighbours[v]
+
+    heap = [(priority(v, shortcuts_for(v)), v) for v in range(count)]
+    heapq.heapify(heap)
+    rank = [0] * count
+    order = 0
+    while heap:
+        _, v = heapq.heappop(heap)
+        needed = shortcuts_for(v)
+        current = priority(v, needed)
+        if heap and current > heap[0][0]:
+            heapq.heappush(heap, (current, v))
+            continue
+
+        for u, w, total, edge_in, edge_out in needed:
+            existing = outgoing[u].get(w)
+            if existing is not None and seconds[existing] <= total:
+                continue
+            edge = len(sources)
+            sources.append(u)
+            targets.append(w)
+            seconds.append(total)
+            road_km.append(tuple(a + b for a, b in zip(road_km[edge_in], road_km[edge_out])))
+            children.append((edge_in, edge_out))
+            outgoing[u][w] = edge
+            incoming[w][u] = edge
+        for u in incoming[v]:
+            del outgoing[u][v]
+            contracted_neighbours[u] += 1
+        for w in outgoing[v]:
+            del incoming[w][v]
+            contracted_neighbours[w] += 1
+        rank[v] = order
+        order += 1
+
+    return {
+        "rank": np.array(rank, dtype=np.int32),
+        "sources": np.array(sources, dtype=np.int32),
+        "targets": np.array(targets, dtype=np.int32),
+        "seconds": np.array(seconds, dtype=float),
+        "road_km": np.array(road_km, dtype=np.float32).reshape(-1, len(ROAD_TYPES)),
+        "children": np.array(children, dtype=np.int32).reshape(-1, 2),
+    }
+
+
+def _adjacency(owners, others, edges, count):
+    # Compressed adjacency lists as Python lists, which the search loops index faster than numpy arrays
+    order = np.argsort(owners, kind="stable")
+    offsets = np.searchsorted(owners[order], np.arange(count + 1)).tolist()
+    others = others[order].tolist()
+    edges = edges[order].tolist()
+    return [list(zip(others[offsets[v]:offsets[v + 1]], edges[offsets[v]:offsets[v + 1]])) for v in range(count)]
+
+
+class Route(NamedTuple):
+
+    """
+    A route found by a RoadNetwork: total seconds, total kilometers, kilometers per road type (in the order of
+    ROAD_TYPES), the graph edges it follows (shortcuts included) and the (node, km) its ends were snapped to.
+    """
+
+    seconds: float
+    km: float
+    road_km: Tuple[float, ...]
+    edges: Tuple[int, ...]
+    start: tuple
+    end: tuple
+
+
+class RoadNetwork:
+
+    """
+    Shortest-path queries over the contraction hierarchy of one travel mode.
+
+    A query searches upward in the hierarchy from the origin and from the destination and meets at the best
+    common node. The origin's upward search is kept in a small LRU, so routing from one origin to many stations
+    (or from many stations to one destination) runs that search once. Thread-safe.
+    """
+
+    def __init__(self, mode, latitudes, longitudes, rank, sources, targets, seconds, road_km, children):
+        self.mode = mode
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.sources = sources
+        self.targets = targets
+        self.seconds = seconds.tolist()
+        self.road_km = road_km
+        self.children = children
+        count = len(latitudes)
+        edges = np.arange(len(sources))
+        upward = rank[sources] < rank[targets]
+        # Forward searches follow edges to higher ranks; backward searches follow edges from higher ranks in reverse
+        self._up = _adjacency(sources[upward], targets[upward], edges[upward], count)
+        self._down = _adjacency(targets[~upward], sources[~upward], edges[~upward], count)
+        self._build_snap_grid()
+        self._spaces = OrderedDict()
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.unrouted = 0
+
+    @classmethod
+    def load(cls, mode, path, source_signature):
+
+        """
+        Read an index written by save, or return None if it is missing, outdated or built from another extract.
+        """
+
+        if not os.path.isfile(path):
+            return None
+        with np.load(path) as index:
+            if int(index["version"]) != INDEX_VERSION or str(index["source"]) != source_signature:
+                return None
+            arrays = {name: index[name] for name in ("latitudes", "longitudes", "rank", "sources", "targets", "seconds", "road_km", "children")}
+        return cls(mode, **arrays)
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def _build_snap_grid(self):
+        cells = np.floor(np.column_stack((self.latitudes, self.longitudes)) / SNAP_GRID_DEGREES).astype(np.int64)
+        self._grid = {}
+        for node, cell in enumerate(map(tuple, cells.tolist())):
+            self._grid.setdefault(cell, []).append(node)
+        self._grid = {cell: np.array(nodes) for cell, nodes in self._grid.items()}
+
+    def snap(self, latitude, longitude, max_km=ROUTING_MAX_SNAP_KM):
+
+        """
+        Return the nearest road node of a point and its distance in kilometers, or None if no node is within max_km.
+        """
+
+        row, column = math.floor(latitude / SNAP_GRID_DEGREES), math.floor(longitude / SNAP_GRID_DEGREES)
+        reach = max(1, math.ceil(max_km / (111.32 * SNAP_GRID_DEGREES * max(math.cos(math.radians(latitude)), 0.1))))
+        candidates = [
+            self._grid[cell] for cell in (
+                (row + dr, column + dc) for dr in range(-reach, reach + 1) for dc in range(-reach, reach + 1)
+            ) if cell in self._grid
+        ]
+        if not candidates:
+            return None
+        nodes = np.concatenate(candidates)
+        distances = haversine_km(latitude, longitude, self.latitudes[nodes], self.longitudes[nodes])
+        nearest = int(np.argmin(distances))
+        if distances[nearest] > max_km:
+            return None
+        return int(nodes[nearest]), float(distances[nearest])
+
+    def _search(self, node, adjacency):
+        # Full upward search: settled distance and the edge each node was reached by
+        distances = {node: 0.0}
+        via = {node: -1}
+        heap = [(0.0, node)]
+        seconds = self.seconds
+        while heap:
+            distance, u = heapq.heappop(heap)
+            if distance > distances[u]:
+                continue
+            for w, edge in adjacency[u]:
+                candidate = distance + seconds[edge]
+                if candidate < distances.get(w, math.inf):
+                    distances[w] = candidate
+                    via[w] = edge
+                    heapq.heappush(heap, (candidate, w))
+        return distances, via
+
+    def _space(self, node, forward):
+        key = (node, forward)
+        with self._lock:
+            space = self._spaces.get(key)
+            if space is not None:
+                self._spaces.move_to_end(key)
+                return space
+        space = self._search(node, self._up if forward else self._down)
+        with self._lock:
+            self._spaces[key] = space
+            while len(self._spaces) > ROUTING_ORIGIN_CACHE_SIZE:
+                self._spaces.popitem(last=False)
+        return space
+
+    def _meet(self, forward, backward):
+        (forward_distances, forward_via), (backward_distances, backward_via) = forward, backward
+        small, large = (forward_distances, backward_distances) if len(forward_distances) <= len(backward_distances) else (backward_distances, forward_distances)
+        best, meeting = math.inf, None
+        for node, distance in small.items():
+            other = large.get(node)
+            if other is not None and distance + other < best:
+                best, meeting = distance + other, node
+        if meeting is None:
+            return None
+        edges = []
+        node = meeting
+        while forward_via[node] != -1:
+            edge = forward_via[node]
+            edges.append(edge)
+            node = int(self.sources[edge])
+        edges.reverse()
+        node = meeting
+        while backward_via[node] != -1:
+            edge = backward_via[node]
+            edges.append(edge)
+            node = int(self.targets[edge])
+        return best, edges
+
+    def _route(self, start, end, forward, backward):
+        meeting = self._meet(forward, backward)
+        if meeting is None:
+            return None
+        seconds, edges = meeting
+        road_km = self.road_km[edges].sum(axis=0, dtype=float) if edges else np.zeros(len(ROAD_TYPES))
+        access_km = start[1] + end[1]
+        road_km[ACCESS_ROAD_TYPE] += access_km
+        seconds += access_km / ACCESS_SPEED_KMH[self.mode] * 3600
+        return Route(seconds, float(road_km.sum()), tuple(road_km.tolist()), tuple(edges), start, end)
+
+    def one_to_many(self, origin, destinations):
+
+        """
+        Route from one point to many.
+
+        Args:
+        origin (tuple): Latitude and longitude of the origin.
+        destinations (list): Latitude and longitude of each destination.
+
+        Returns:
+        list: A Route per destination, None where a point is too far from the road network or no route exists.
+        """
+
+        return self._batch(origin, destinations, outbound=True)
+
+    def many_to_one(self, origins, destination):
+
+        """
+        Route from many points to one, e.g. walking from every charging station to the destination.
+
+        Returns:
+        list: A Route per origin, None where a point is too far from the road network or no route exists.
+        """
+
+        return self._batch(destination, origins, outbound=False)
+
+    def _batch(self, shared, others, outbound):
+        self.queries += len(others)
+        shared_node = self.snap(*shared)
+        if shared_node is None:
+            self.unrouted += len(others)
+            return [None] * len(others)
+        shared_space = self._space(shared_node[0], forward=outbound)
+        routes = []
+        for point in others:
+            node = self.snap(*point)
+            if node is None:
+                routes.append(None)
+                continue
+            space = self._space(node[0], forward=not outbound)
+            if outbound:
+                routes.append(self._route(shared_node, node, shared_space, space))
+            else:
+                routes.append(self._route(node, shared_node, space, shared_space))
+        self.unrouted += sum(route is None for route in routes)
+        return routes
+
+    def path_points(self, route):
+
+        """
+        Return the (latitude, longitude) points of the road nodes a route passes, shortcuts unpacked.
+        """
+
+        nodes = []
+        stack = list(reversed(route.edges))
+        while stack:
+            edge = stack.pop()
+            first, second = self.children[edge]
+            if first >= 0:
+                stack.append(int(second))
+                stack.append(int(first))
+                continue
+            if not nodes:
+                nodes.append(int(self.sources[edge]))
+            nodes.append(int(self.targets[edge]))
+        return [(float(self.latitudes[node]), float(self.longitudes[node])) for node in nodes]
+
+    def stats(self):
+        return {"nodes": len(self), "edges": len(self.seconds), "queries": self.queries, "unrouted": self.unrouted}
+
+
+def route_info(route):
+
+    """
+    Convert a Route into the route info dictionary and segment distance sum produced by analyze_route.
+
+    Offline routes carry no traffic information, so their congestion is reported as "Unknown".
+    """
+
+    info = {
+        "distance": round(route.km, 2),
+        "duration": round(route.seconds),
+        "traffic_congestion": "Unknown",
+    }
+    segment_distances_sum = 0
+    for road_type, km in zip(ROAD_TYPES, route.road_km):
+        info[road_type] = {"distance": round(km, 2)}
+        segment_distances_sum += round(km, 2)
+    return info, segment_distances_sum
+
+
+def _save(path, signature, graph, hierarchy):
+    temporary = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(
+        temporary, version=INDEX_VERSION, source=np.array(signature), latitudes=graph.latitudes,
+        longitudes=graph.longitudes, **hierarchy,
+    )
+    os.replace(temporary, path)
+
+
+class OfflineRouter:
+
+    """
+    The driving and walking networks of an OpenStreetMap extract.
+
+    load() reuses the indexes in ROAD_NETWORK_INDEX_DIR when they were built from the same extract and otherwise
+    builds and saves them. Worker processes build one at a time under a lock file, so the others load the
+    finished index. Until loading finishes, driving and walking are None and legs are routed with Bing Maps.
+    """
+
+    def __init__(self, path=ROAD_NETWORK_PATH, index_dir=ROAD_NETWORK_INDEX_DIR):
+        self.path = path
+        self.index_dir = index_dir
+        self.driving = None
+        self.walking = None
+        self.load_seconds = None
+        self.built = False
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _signature(self):
+        stat = os.stat(self.path)
+        return f"{os.path.abspath(self.path)}|{stat.st_size}|{int(stat.st_mtime)}"
+
+    def load(self):
+
+        """
+        Load or build both networks. Blocking; run it in a worker thread.
+        """
+
+        started = time.monotonic()
+        signature = self._signature()
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(os.path.join(self.index_dir, "build.lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            paths = {mode: os.path.join(self.index_dir, f"{mode}.npz") for mode in MODES}
+            networks = {mode: RoadNetwork.load(mode, paths[mode], signature) for mode in MODES}
+            if None in networks.values():
+                logging.info(f"Building routing indexes from {self.path}")
+                coordinates, ways = read_osm(self.path)
+                for mode in MODES:
+                    if networks[mode] is None:
+                        graph = build_graph(coordinates, ways, mode)
+                        hierarchy = contract(graph)
+                        networks[mode] = RoadNetwork(mode, graph.latitudes, graph.longitudes, **hierarchy)
+                        _save(paths[mode], signature, graph, hierarchy)
+                self.built = True
+        self.driving, self.walking = networks["driving"], networks["walking"]
+        self.load_seconds = time.monotonic() - started
+        logging.info(
+            f"Offline routing ready in {self.load_seconds:.1f} seconds: {len(self.driving)} driving and "
+            f"{len(self.walking)} walking nodes"
+        )
+
+    def stats(self):
+
+        """
+        Return whether offline routing is enabled and ready, and the size and query counters of each network.
+        """
+
+        return {
+            "enabled": self.enabled,
+            "ready": self.driving is not None,
+            "built": self.built,
+            "load_seconds": self.load_seconds,
+            "driving": self.driving.stats() if self.driving else None,
+            "walking": self.walking.stats() if self.walking else None,
+        }
+
@@ -0,0 +1,341 @@
+# Outbound request scheduling: a token bucket per provider quota, shared by the worker processes, with priority queues
+# so interactive requests are served before batch and background work
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import PROVIDER_QUEUE_DEPTH, PROVIDER_QUEUE_WAIT
+from timing import timed
+from workers import NAVIGATOR_WORKERS, connect_shared_sqlite
+
+# Location of the token buckets shared by the worker processes (only used with more than one worker)
+PROVIDER_QUOTA_PATH = os.getenv("PROVIDER_QUOTA_PATH", os.path.join("cache", "provider_quota.sqlite3"))
+
+# Requests per second and burst allowed by each provider quota for the whole service, overridable with
+# PROVIDER_RATE_<QUOTA> and PROVIDER_BURST_<QUOTA> (e.g. PROVIDER_RATE_BING=10); a rate of 0 removes the limit
+DEFAULT_PROVIDER_QUOTAS = {
+    "open_meteo": (10, 10),
+    "ocm": (5, 10),
+    "bing": (25, 50),
+    # The Nominatim usage policy allows at most one request per second
+    "nominatim": (1, 1),
+}
+# Data sources sharing one quota; the Bing Maps services count against the same key
+QUOTA_GROUPS = {
+    "bing_routes": "bing",
+    "bing_walking": "bing",
+    "bing_elevation": "bing",
+    "bing_distance_matrix": "bing",
+}
+
+# Request priorities, most urgent first: single trips a user is waiting for, batch requests, and background work
+# such as pre-warming and the station mirror sync
+PRIORITIES = ("interactive", "batch", "background")
+
+_priority = contextvars.ContextVar("request_priority", default="interactive")
+
+
+def set_priority(priority):
+
+    """
+    Set the priority of the provider calls made by the current request or task.
+
+    Tasks and worker threads started afterwards inherit the priority.
+    """
+
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority '{priority}'")
+    _priority.set(priority)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def quota_name(provider):
+    return QUOTA_GROUPS.get(provider, provider)
+
+
+def quota_limits(quota):
+    rate, burst = DEFAULT_PROVIDER_QUOTAS.get(quota, (0, 1))
+    rate = float(os.getenv(f"PROVIDER_RATE_{quota.upper()}", rate))
+    burst = float(os.getenv(f"PROVIDER_BURST_{quota.upper()}", burst))
+    return rate, max(1.0, burst)
+
+
+class LocalQuota:
+
+    """
+    Token buckets of a single worker process.
+    """
+
+    shared = False
+
+    def __init__(self):
+        self._buckets = {}  # quota -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, quota, rate, capacity):
+
+        """
+        Take a token from a bucket.
+
+        Returns:
+        float: 0 if a token was taken, otherwise the seconds until one is available.
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated_at = self._buckets.get(quota, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[quota] = (tokens, now)
+            return wait
+
+
+class SharedQuota:
+
+    """
+    Token buckets in a SQLite database shared by every worker process, so a provider's quota holds for the whole
+    service however the calls are spread over the workers.
+    """
+
+    shared = True
+
+    def __init__(self, path=PROVIDER_QUOTA_PATH):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = connect_shared_sqlite(self.path)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (quota TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def take(self, quota, rate, capacity):
+
+        """
+        Take a token from a bucket. Blocking; run it in a worker thread.
+
+        Returns:
+        float: 0 if a token was taken, otherwise the seconds until one is available.
+        """
+
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Wall-clock time, because the buckets are compared between processes
+                now = time.time()
+                row = connection.execute("SELECT tokens, updated_at FROM buckets WHERE quota = ?", (quota,)).fetchone()
+                tokens, updated_at = row if row else (capacity, now)
+                tokens = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+                wait = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / rate
+                connection.execute(
+                    "INSERT OR REPLACE INTO buckets (quota, tokens, updated_at) VALUES (?, ?, ?)", (quota, tokens, now)
+                )
+                connection.commit()
+            except sqlite3.Error:
+                connection.rollback()
+                raise
+            return wait
+
+
+class ProviderScheduler:
+
+    """
+    Admits the calls to one provider quota at its rate, most urgent priority first.
+
+    Callers wait in a priority queue (first come, first served within a priority). A dispatcher task takes tokens
+    from the quota and hands each one to the most urgent caller still waiting, so an interactive call arriving
+    behind a queue of batch calls is next. Callers that give up (deadline, cancellation) leave the queue.
+    """
+
+    def __init__(self, quota, rate, burst, store):
+        self.quota = quota
+        self.rate = rate
+        self.burst = burst
+        self.store = store
+        self._waiting = []  # heap of (priority index, arrival, future, enqueued_at, priority)
+        self._arrivals = itertools.count()
+        self._dispatcher = None
+        self.depth = dict.fromkeys(PRIORITIES, 0)
+        self.granted = dict.fromkeys(PRIORITIES, 0)
+        self.wait_seconds = dict.fromkeys(PRIORITIES, 0.0)
+        self.max_wait_seconds = dict.fromkeys(PRIORITIES, 0.0)
+        self.errors = 0
+
+    async def _take(self):
+        if self.store.shared:
+            return await asyncio.to_thread(self.store.take, self.quota, self.rate, self.burst)
+        return self.store.take(self.quota, self.rate, self.burst)
+
+    def _grant(self, priority, waited):
+        self.granted[priority] += 1
+        self.wait_seconds[priority] += waited
+        self.max_wait_seconds[priority] = max(self.max_wait_seconds[priority], waited)
+        PROVIDER_QUEUE_WAIT.labels(self.quota, priority).observe(waited)
+
+    def _leave(self, priority):
+        self.depth[priority] -= 1
+        PROVIDER_QUEUE_DEPTH.labels(self.quota).dec()
+
+    async def acquire(self, priority=None):
+
+        """
+        Wait until the quota admits one call.
+
+        Args:
+        priority (str): One of PRIORITIES; defaults to the priority of the current request.
+        """
+
+        priority = priority or current_priority()
+        if self.rate <= 0:
+            self._grant(priority, 0.0)
+            return
+        # Go straight through when nobody is queued and a token is available
+        if not self._waiting:
+            try:
+                if await self._take() == 0:
+                    self._grant(priority, 0.0)
+                    return
+            except sqlite3.Error as e:
+                self._fail_open(e)
+                return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (PRIORITIES.index(priority), next(self._arrivals), future, time.monotonic(), priority))
+        self.depth[priority] += 1
+        PROVIDER_QUEUE_DEPTH.labels(self.quota).inc()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        try:
+            with timed(f"queue_{self.quota}"):
+                await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                self._leave(priority)
+            raise
+
+    async def try_acquire(self):
+
+        """
+        Take a token only if one is available now and nobody is queued, e.g. for an optional hedged request.
+
+        Returns:
+        bool: True if the call may be made.
+        """
+
+        if self.rate <= 0:
+            return True
+        if self._waiting:
+            return False
+        try:
+            return await self._take() == 0
+        except sqlite3.Error as e:
+            self._fail_open(e)
+            return True
+
+    def _fail_open(self, error):
+        # A broken quota store must not stop every provider call; calls go through unscheduled instead
+        self.errors += 1
+        logging.error(f"Could not take a {self.quota} token: {error}")
+
+    async def _dispatch(self):
+        while self._waiting:
+            if self._waiting[0][2].done():
+                heapq.heappop(self._waiting)
+                continue
+            try:
+                wait = await self._take()
+            except sqlite3.Error as e:
+                self._fail_open(e)
+                wait = 0
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            while self._waiting:
+                _, _, future, enqueued_at, priority = heapq.heappop(self._waiting)
+                if not future.done():
+                    self._leave(priority)
+                    self._grant(priority, time.monotonic() - enqueued_at)
+                    future.set_result(None)
+                    break
+
+    def stats(self):
+
+        """
+        Return the quota, the calls waiting now and, per priority, the calls admitted and their mean and maximum
+        wait in seconds.
+        """
+
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "shared": self.store.shared,
+            "queued": sum(self.depth.values()),
+            "store_errors": self.errors,
+            "priorities": {
+                priority: {
+                    "queued": self.depth[priority],
+                    "granted": self.granted[priority],
+                    "mean_wait": self.wait_seconds[priority] / self.granted[priority] if self.granted[priority] else 0.0,
+                    "max_wait": self.max_wait_seconds[priority],
+                }
+                for priority in PRIORITIES
+            },
+        }
+
+
+_store = None
+_schedulers = {}
+
+
+def get_scheduler(provider):
+
+    """
+    Return the scheduler of a data source's quota, created on first use.
+
+    Args:
+    provider (str): One of the provider names; data sources in one quota group share a scheduler.
+
+    Returns:
+    ProviderScheduler: The scheduler, with buckets shared across workers when the navigator runs several.
+    """
+
+    global _store
+    quota = quota_name(provider)
+    scheduler = _schedulers.get(quota)
+    if scheduler is None:
+        if _store is None:
+            _store = SharedQuota() if NAVIGATOR_WORKERS > 1 else LocalQuota()
+        scheduler = ProviderScheduler(quota, *quota_limits(quota), _store)
+        _schedulers[quota] = scheduler
+    return scheduler
+
+
+def scheduler_stats():
+
+    """
+    Return the queue statistics of every provider quota in use.
+    """
+
+    return {quota: scheduler.stats() for quota, scheduler in _schedulers.items()}
@@ -0,0 +1,207 @@
+# Vectorized State of Charge (SoC) computation for many legs, EV models and temperatures at once
+import numpy as np
+
+# Below this ambient temperature (in degrees Celsius) the cold discharge rates are used
+TEMPERATURE_THRESHOLD = 10
+
+# Road types counted as highway and city driving, in the order calculate_soc adds them up
+HIGHWAY_ROAD_TYPES = ("LimitedAccessHighway", "Highway", "Ramp", "Arterial", "MajorRoad")
+CITY_ROAD_TYPES = ("Street", "LocalRoad")
+
+
+def _as_float_array(values):
+    # Missing or non-numeric values (None, 'Unknown') become NaN so they invalidate only their own results
+    return np.array(
+        [value if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan for value in values],
+        dtype=float,
+    )
+
+
+def leg_distances(route_infos):
+
+    """
+    Sum the highway and city kilometers of many analyzed routes.
+
+    Args:
+    route_infos (list): Route info dictionaries as returned by analyze_route (None for failed routes).
+
+    Returns:
+    tuple: Arrays of highway kilometers and city kilometers, NaN where the route is missing.
+    """
+
+    highway = np.full(len(route_infos), np.nan)
+    city = np.full(len(route_infos), np.nan)
+    for i, route_info in enumerate(route_infos):
+        if not route_info:
+            continue
+        try:
+            highway_km = 0
+            for road_type in HIGHWAY_ROAD_TYPES:
+                highway_km = highway_km + route_info[road_type]["distance"]
+            highway[i] = highway_km
+            city[i] = route_info["Street"]["distance"] + route_info["LocalRoad"]["distance"]
+        except (KeyError, TypeError):
+            continue
+    return highway, city
+
+
+def model_parameters(specs):
+
+    """
+    Collect the SoC-relevant parameters of many EV specifications into arrays.
+
+    Args:
+    specs (list): EVSpec entries from the EV catalog.
+
+    Returns:
+    dict: Arrays of usable capacity, weight and the city/highway cold and mild discharge rates, NaN where missing.
+    """
+
+    fields = ("useable_capacity", "weight", "city_cold_rate", "highway_cold_rate", "city_mild_rate", "highway_mild_rate")
+    return {field: _as_float_array([getattr(spec, field) for spec in specs]) for field in fields}
+
+
+def compute_soc(altitude_change, useable_capacity, weight, initial_SOC, temperature, highway_km, city_km,
+                city_cold_rate, highway_cold_rate, city_mild_rate, highway_mild_rate, total_ascent=None):
+
+    """
+    Calculate final and altitude-adjusted SoC for arrays of legs, EV models and temperatures in one pass.
+
+    Args:
+    altitude_change (array): Change in altitude (m) between origin and charging station.
+    useable_capacity (array): Usable battery capacity (kWh).
+    weight (array): Vehicle weight (kg).
+    initial_SOC (array): Initial state of charge as a percentage.
+    temperature (array): Ambient temperature (degrees Celsius).
+    highway_km (array): Kilometers driven on highway-type roads.
+    city_km (array): Kilometers driven on city-type roads.
+    city_cold_rate, highway_cold_rate, city_mild_rate, highway_mild_rate (array): Discharge rates (Wh/km).
+    total_ascent (array): Optional total climb (m) along each leg, NaN where unknown. Where known it replaces the
+    net altitude change in the adjustment, as in calculate_soc.
+
+    Returns:
+    tuple: Arrays of final SoC and altitude-adjusted SoC percentages, NaN wherever calculate_soc would return None.
+
+    All arguments are broadcast against each other, so a (models, 1) set of EV parameters combined with (legs,)
+    leg arrays yields a (models, legs) result. The arithmetic follows calculate_soc operation by operation, so
+    single inputs produce the same numbers.
+    """
+
+    altitude_change, useable_capacity, weight, initial_SOC, temperature, highway_km, city_km = (
+        np.asarray(value, dtype=float)
+        for value in (altitude_change, useable_capacity, weight, initial_SOC, temperature, highway_km, city_km)
+    )
+
+    climb = altitude_change
+    if total_ascent is not None:
+        total_ascent = np.asarray(total_ascent, dtype=float)
+        climb = np.where(np.isnan(total_ascent), altitude_change, total_ascent)
+
+    cold = temperature < TEMPERATURE_THRESHOLD
+    discharge_highway = np.where(cold, highway_cold_rate, highway_mild_rate)
+    discharge_city = np.where(cold, city_cold_rate, city_mild_rate)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        potential_energy = (climb * 9.81 * weight) / 3600000
+        final_SOC = ((initial_SOC * useable_capacity * 10 - (discharge_highway * highway_km + discharge_city * city_km)) / (useable_capacity * 1000)) * 100
+        adjusted_SOC = np.where(climb > 0, final_SOC - potential_energy, final_SOC)
+
+    # calculate_soc fails as a whole when any input is missing or the capacity is zero
+    invalid = (
+        np.isnan(temperature) | np.isnan(potential_energy) | (useable_capacity == 0)
+        | np.isnan(discharge_highway) | np.isnan(discharge_city)
+    )
+    final_SOC = np.where(invalid, np.nan, final_SOC)
+    adjusted_SOC = np.where(invalid, np.nan, adjusted_SOC)
+    return final_SOC, adjusted_SOC
+
+
+def soc_for_legs(spec, initial_SOC, route_infos, altitude_changes, temperatures, total_ascents=None):
+
+    """
+    Calculate SoC at every charging station of a trip for one EV model.
+
+    Args:
+    spec (EVSpec): The EV specification.
+    initial_SOC (float): Initial state of charge as a percentage.
+    route_infos (list): Route info dictionaries from analyze_route, one per leg.
+    altitude_changes (list): Elevation change (m) of each leg.
+    temperatures (list): Ambient temperature used for each leg.
+    total_ascents (list): Optional total climb (m) along each leg, None where unknown.
+
+    Returns:
+    list: One (final SoC, altitude-adjusted SoC) tuple per leg, with (None, None) where the SoC cannot be calculated.
+    """
+
+    parameters = model_parameters([spec])
+    highway_km, city_km = leg_distances(route_infos)
+    final_SOC, adjusted_SOC = compute_soc(
+        _as_float_array(altitude_changes), parameters["useable_capacity"], parameters["weight"], initial_SOC,
+        _as_float_array(temperatures), highway_km, city_km,
+        parameters["city_cold_rate"], parameters["highway_cold_rate"],
+        parameters["city_mild_rate"], parameters["highway_mild_rate"],
+        None if total_ascents is None else _as_float_array(total_ascents),
+    )
+    return [
+        (None, None) if np.isnan(final) else (float(final), float(adjusted))
+        for final, adjusted in zip(final_SOC, adjusted_SOC)
+    ]
+
+
+def soc_upper_bounds(spec, initial_SOC, distances_km):
+
+    """
+    Bound the SoC reachable at many stations from their straight-line distance alone.
+
+    Args:
+    spec (EVSpec): The EV specification.
+    initial_SOC (float): Initial state of charge as a percentage.
+    distances_km (list): Lower bounds of the driving distance (km) to each station.
+
+    Returns:
+    array: Upper bounds of the altitude-adjusted SoC, +inf where the catalog entry does not allow a bound.
+
+    The lowest of the four discharge rates is used for every kilometer, so whatever road types, temperature or
+    elevation the real route has, compute_soc cannot return a higher altitude-adjusted SoC.
+    """
+
+    parameters = model_parameters([spec])
+    rates = np.array([parameters[name][0] for name in ("city_cold_rate", "highway_cold_rate", "city_mild_rate", "highway_mild_rate")])
+    useable_capacity = parameters["useable_capacity"][0]
+    distances_km = np.asarray(distances_km, dtype=float)
+    if np.isnan(rates).any() or np.isnan(useable_capacity) or useable_capacity <= 0:
+        return np.full(distances_km.shape, np.inf)
+
+    best_rate = max(rates.min(), 0.0)
+    return ((initial_SOC * useable_capacity * 10 - best_rate * distances_km) / (useable_capacity * 1000)) * 100
+
+
+def soc_matrix(specs, initial_SOC, route_infos, altitude_changes, temperatures, total_ascents=None):
+
+    """
+    Calculate SoC for every combination of EV model and leg, e.g. for what-if analyses over the whole catalog.
+
+    Args:
+    specs (list): EVSpec entries, one per model.
+    initial_SOC (float or array): Initial state of charge, a scalar or one value per model.
+    route_infos (list): Route info dictionaries from analyze_route, one per leg.
+    altitude_changes (list): Elevation change (m) of each leg.
+    temperatures (list): Ambient temperature used for each leg.
+    total_ascents (list): Optional total climb (m) along each leg, None where unknown.
+
+    Returns:
+    tuple: (models, legs) arrays of final SoC and altitude-adjusted SoC, NaN where the SoC cannot be calculated.
+    """
+
+    parameters = {name: values[:, np.newaxis] for name, values in model_parameters(specs).items()}
+    initial_SOC = np.asarray(initial_SOC, dtype=float)
+    if initial_SOC.ndim:
+        initial_SOC = initial_SOC[:, np.newaxis]
+    highway_km, city_km = leg_distances(route_infos)
+    return compute_soc(
+        _as_float_array(altitude_changes), parameters["useable_capacity"], parameters["weight"], initial_SOC,
+        _as_float_array(temperatures), highway_km, city_km,
+        parameters["city_cold_rate"], parameters["highway_cold_rate"],
+        parameters["city_mild_rate"], parameters["highway_mild_rate"],
+        None if total_ascents is None else _as_float_array(total_ascents),
+    )
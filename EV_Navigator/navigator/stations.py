@@ -0,0 +1,616 @@
+# Local mirror of Open Charge Map stations with an in-memory spatial grid index
+import asyncio
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional, Tuple
+
+import httpx
+
+from providers import get_provider
+from workers import connect_shared_sqlite
+
+# Open Charge Map endpoint, configurable to point the navigator at a mirror or a local fake
+OCM_URL = os.getenv('OCM_URL', 'https://api.openchargemap.io/v3/poi/')
+
+# Location of the local station store
+STATION_MIRROR_PATH = os.getenv("STATION_MIRROR_PATH", os.path.join("cache", "stations.sqlite3"))
+# Optional Open Charge Map export (JSON file or directory of JSON files) imported when the store is empty
+STATION_IMPORT_PATH = os.getenv("STATION_IMPORT_PATH", "")
+# Size (in degrees) of the spatial index grid cells
+STATION_GRID_DEGREES = float(os.getenv("STATION_GRID_DEGREES", "0.1"))
+# Seconds between incremental syncs with Open Charge Map (0 disables the background sync)
+STATION_SYNC_SECONDS = float(os.getenv("STATION_SYNC_SECONDS", "3600"))
+# Seconds a station set fetched from the live API is reused for the same destination and radius
+STATION_SET_CACHE_TTL = float(os.getenv("STATION_SET_CACHE_TTL", "3600"))
+# Maximum number of station sets kept in memory
+STATION_SET_CACHE_MAX_ENTRIES = int(os.getenv("STATION_SET_CACHE_MAX_ENTRIES", "1000"))
+# Lock file electing the one worker process that syncs the mirror with the API when several workers share it
+STATION_SYNC_LOCK_PATH = os.getenv("STATION_SYNC_LOCK_PATH", STATION_MIRROR_PATH + ".lock")
+# Maximum number of modified stations requested per page of a sync
+STATION_SYNC_MAX_RESULTS = int(os.getenv("STATION_SYNC_MAX_RESULTS", "10000"))
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+
+    """
+    Great-circle distance in kilometers between two coordinates.
+    """
+
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _text(value, default="Unknown"):
+    # Repeated values such as operator names and connector types are interned to share one string object
+    if value is None:
+        return default
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class StationRecord(NamedTuple):
+
+    """
+    Compact representation of a charging station, holding only the fields the navigator returns.
+    """
+
+    id: int
+    latitude: float
+    longitude: float
+    name: str
+    operator: str
+    usage_type: str
+    usage_cost: str
+    connections: Tuple[Tuple[str, str, Optional[float]], ...]
+    last_update: Optional[str] = None
+
+    @classmethod
+    def from_ocm(cls, poi):
+
+        """
+        Build a record from an Open Charge Map POI, as returned by the API or found in a dataset export.
+
+        Returns:
+        StationRecord: The compact record, or None if the POI has no usable coordinates.
+        """
+
+        address = poi.get("AddressInfo") or {}
+        latitude = address.get("Latitude")
+        longitude = address.get("Longitude")
+        if poi.get("ID") is None or latitude is None or longitude is None:
+            return None
+        return cls(
+            int(poi["ID"]),
+            float(latitude),
+            float(longitude),
+            address.get("Title", "Unknown"),
+            _text((poi.get('OperatorInfo') or {}).get('Title', "Unknown")),
+            _text((poi.get('UsageType') or {}).get('Title', "Unknown")),
+            _text(poi.get('UsageCost', "Unknown")),
+            tuple(
+                (
+                    _text((conn.get('ConnectionType') or {}).get('Title', "Unknown")),
+                    _text(conn.get('PricingModel', "Unknown")),
+                    conn.get('PowerKW'),
+                )
+                for conn in poi.get('Connections') or []
+            ),
+            poi.get("DateLastStatusUpdate"),
+        )
+
+    def to_station_dict(self):
+
+        """
+        Convert the record into the station dictionary format produced by get_charging_stations.
+
+        Records stored before connections carried their power report it as unknown (None).
+        """
+
+        return {
+            'location': (self.latitude, self.longitude),
+            'name': self.name,
+            'operator': self.operator,
+            'usage_type': self.usage_type,
+            'usage_cost': self.usage_cost,
+            'connections': [
+                {'connection_type': connection[0], 'price': connection[1], 'power_kw': connection[2] if len(connection) > 2 else None}
+                for connection in self.connections
+            ],
+        }
+
+
+def _is_removed(poi):
+    status = poi.get("SubmissionStatus") or {}
+    return status.get("IsLive") is False
+
+
+def read_ocm_export(path):
+
+    """
+    Read Open Charge Map POIs from a dataset export.
+
+    Args:
+    path (str): A JSON file holding a list of POIs, or a directory tree of JSON files each holding a POI or a list of POIs.
+
+    Yields:
+    dict: One Open Charge Map POI at a time.
+    """
+
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(path)
+            for name in names if name.endswith(".json")
+        )
+    else:
+        files = [path]
+
+    for file_path in files:
+        with open(file_path, encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = [data]
+        yield from data
+
+
+class StationStore:
+
+    """
+    SQLite-backed persistent copy of the station dataset and its sync watermark.
+    """
+
+    def __init__(self, path=STATION_MIRROR_PATH):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Opened on first use rather than when the store is built at import time; called with the lock held
+        if self._connection is None:
+            self._connection = connect_shared_sqlite(self.path)
+            with self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS stations (id INTEGER PRIMARY KEY, record TEXT NOT NULL)"
+                )
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS sync_state (name TEXT PRIMARY KEY, value TEXT NOT NULL)"
+                )
+        return self._connection
+
+    def load(self):
+        with self._lock:
+            rows = self._connect().execute("SELECT record FROM stations").fetchall()
+        records = []
+        for (record,) in rows:
+            values = json.loads(record)
+            values[7] = tuple(tuple(connection) for connection in values[7])
+            records.append(StationRecord(*values))
+        return records
+
+    def upsert(self, records, removed_ids=()):
+        with self._lock, self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO stations (id, record) VALUES (?, ?)",
+                ((record.id, json.dumps(record)) for record in records),
+            )
+            connection.executemany("DELETE FROM stations WHERE id = ?", ((i,) for i in removed_ids))
+
+    def get_state(self, name):
+        with self._lock:
+            row = self._connect().execute("SELECT value FROM sync_state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, name, value):
+        with self._lock, self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)", (name, value))
+
+
+class StationSetCache:
+
+    """
+    In-memory LRU of station lists fetched from the live Open Charge Map API, keyed by search center and radius.
+
+    Only used without a local mirror, which answers radius queries itself.
+    """
+
+    def __init__(self, ttl=STATION_SET_CACHE_TTL, max_entries=STATION_SET_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (coordinates, radius) -> (expires_at, stations)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, coordinates, radius_km):
+
+        """
+        Return the stations cached for a "lat,lon" search center and radius, or None.
+        """
+
+        key = (coordinates, radius_km)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, coordinates, radius_km, stations):
+        self._entries[(coordinates, radius_km)] = (time.monotonic() + self.ttl, stations)
+        self._entries.move_to_end((coordinates, radius_km))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+
+        """
+        Return hit/miss counters and the number of cached station sets.
+        """
+
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+class StationIndex:
+
+    """
+    In-memory grid index answering radius queries over the station mirror.
+
+    Coordinates are kept in flat float arrays and each grid cell holds an array of record positions, so a query
+    only touches the cells overlapping the search circle.
+    """
+
+    def __init__(self, records=(), grid_degrees=STATION_GRID_DEGREES):
+        self.grid_degrees = grid_degrees
+        self._records = []
+        self._latitudes = array('d')
+        self._longitudes = array('d')
+        self._cells = {}
+        self._positions = {}  # station id -> position in the arrays
+        self._free = []  # positions of removed records, reused by the next insertions
+        for record in records:
+            self.add(record)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _cell(self, latitude, longitude):
+        return (math.floor(latitude / self.grid_degrees), math.floor(longitude / self.grid_degrees))
+
+    def add(self, record):
+
+        """
+        Insert a record, replacing any existing record with the same station id in its slot.
+
+        New stations take the slot of a removed record when there is one, so updates and deletions received by the
+        periodic syncs never grow the arrays.
+        """
+
+        position = self._positions.get(record.id)
+        if position is not None:
+            previous = self._records[position]
+            cell = self._cell(previous.latitude, previous.longitude)
+            if cell == self._cell(record.latitude, record.longitude):
+                self._records[position] = record
+                self._latitudes[position] = record.latitude
+                self._longitudes[position] = record.longitude
+                return
+            self._leave_cell(cell, position)
+        elif self._free:
+            position = self._free.pop()
+        else:
+            position = len(self._records)
+            self._records.append(None)
+            self._latitudes.append(0.0)
+            self._longitudes.append(0.0)
+        self._records[position] = record
+        self._latitudes[position] = record.latitude
+        self._longitudes[position] = record.longitude
+        self._cells.setdefault(self._cell(record.latitude, record.longitude), array('I')).append(position)
+        self._positions[record.id] = position
+
+    def _leave_cell(self, cell, position):
+        members = self._cells[cell]
+        members.remove(position)
+        if not members:
+            del self._cells[cell]
+
+    def remove(self, station_id):
+
+        """
+        Remove a record by station id. The slot is left empty for the next inserted record rather than compacting
+        the arrays.
+        """
+
+        position = self._positions.pop(station_id, None)
+        if position is None:
+            return
+        record = self._records[position]
+        self._leave_cell(self._cell(record.latitude, record.longitude), position)
+        self._records[position] = None
+        self._free.append(position)
+
+    def query_radius(self, latitude, longitude, radius_km):
+
+        """
+        Find every station within a radius of a point.
+
+        Args:
+        latitude (float): Latitude of the search centre.
+        longitude (float): Longitude of the search centre.
+        radius_km (float): Search radius in kilometers.
+
+        Returns:
+        list: (distance_km, StationRecord) pairs sorted by distance, without any result cap.
+        """
+
+        lat_span = radius_km / 111.32
+        cos_lat = max(math.cos(math.radians(latitude)), 1e-6)
+        lon_span = min(radius_km / (111.32 * cos_lat), 180.0)
+        min_cell = self._cell(latitude - lat_span, longitude - lon_span)
+        max_cell = self._cell(latitude + lat_span, longitude + lon_span)
+
+        matches = []
+        lats = self._latitudes
+        lons = self._longitudes
+        for cell_lat in range(min_cell[0], max_cell[0] + 1):
+            for cell_lon in range(min_cell[1], max_cell[1] + 1):
+                for position in self._cells.get((cell_lat, cell_lon), ()):
+                    distance = haversine_km(latitude, longitude, lats[position], lons[position])
+                    if distance <= radius_km:
+                        matches.append((distance, self._records[position]))
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+class StationMirror:
+
+    """
+    Keeps a local, spatially indexed copy of Open Charge Map in sync with the live API.
+
+    The mirror is seeded from a dataset export, persisted in a StationStore and refreshed incrementally with the
+    API's modifiedsince filter. Radius queries are answered from memory.
+    """
+
+    def __init__(self, store, grid_degrees=STATION_GRID_DEGREES):
+        self.store = store
+        self.index = StationIndex(grid_degrees=grid_degrees)
+        self.last_sync = None
+        self.queries = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def load(self):
+
+        """
+        Rebuild the in-memory index from the local store.
+        """
+
+        self.index = StationIndex(self.store.load(), grid_degrees=self.index.grid_degrees)
+        self.last_sync = self.store.get_state("last_sync")
+        return len(self.index)
+
+    def import_export(self, path):
+
+        """
+        Import an Open Charge Map dataset export into the local store and the index.
+
+        Returns:
+        int: The number of stations imported.
+        """
+
+        records = []
+        for poi in read_ocm_export(path):
+            record = StationRecord.from_ocm(poi)
+            if record is not None and not _is_removed(poi):
+                records.append(record)
+        self.store.upsert(records)
+        for record in records:
+            self.index.add(record)
+        # Later syncs only need the changes made after the export was produced
+        updates = [record.last_update for record in records if record.last_update]
+        if updates and not self.last_sync:
+            self.last_sync = max(updates)[:19]
+            self.store.set_state("last_sync", self.last_sync)
+        logging.info(f"Imported {len(records)} charging stations from {path}")
+        return len(records)
+
+    @staticmethod
+    def split_changes(pois):
+
+        """
+        Split a batch of modified POIs from the API into records to upsert and station ids to remove.
+        """
+
+        records = []
+        removed = []
+        for poi in pois:
+            if _is_removed(poi):
+                if poi.get("ID") is not None:
+                    removed.append(int(poi["ID"]))
+                continue
+            record = StationRecord.from_ocm(poi)
+            if record is not None:
+                records.append(record)
+        return records, removed
+
+    def _update_index(self, records, removed):
+        for record in records:
+            self.index.add(record)
+        for station_id in removed:
+            self.index.remove(station_id)
+        return len(records) + len(removed)
+
+    def apply_changes(self, pois):
+
+        """
+        Apply a batch of modified POIs from the API to the store and the index.
+
+        Returns:
+        int: The number of stations added, updated or removed.
+        """
+
+        records, removed = self.split_changes(pois)
+        self.store.upsert(records, removed)
+        return self._update_index(records, removed)
+
+    async def sync(self, api_key):
+
+        """
+        Fetch stations modified since the last sync from Open Charge Map and apply them.
+
+        Args:
+        api_key (str): The API key for accessing the Open Charge Map API.
+
+        Returns:
+        int: The number of stations changed, or None if the sync failed.
+
+        Changes are requested in pages of STATION_SYNC_MAX_RESULTS stations in ascending station ID order, each page
+        continuing after the highest ID of the previous one, until a page comes back short. The watermark only
+        advances once every page has been applied, so a sync that fails part way is repeated from the same watermark
+        instead of skipping the changes it did not receive.
+        """
+
+        started_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+        params = {
+            "output": "json",
+            "maxresults": STATION_SYNC_MAX_RESULTS,
+            "compact": False,
+            "verbose": False,
+            "key": api_key,
+            "includechargingprices": True,
+            # Open Charge Map returns the stations above this ID in ascending ID order, which pages the changes
+            "greaterthanid": 0,
+        }
+        if self.last_sync:
+            params["modifiedsince"] = self.last_sync
+
+        changed = 0
+        while True:
+            try:
+                response = await get_provider("ocm").get(OCM_URL, params=params)
+                response.raise_for_status()
+                pois = response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                logging.error(f"Charging station sync failed: {e}")
+                return None
+
+            # The store is written in a worker thread; the index is only mutated on the event loop, where queries run
+            records, removed = self.split_changes(pois)
+            await asyncio.to_thread(self.store.upsert, records, removed)
+            changed += self._update_index(records, removed)
+
+            ids = [int(poi["ID"]) for poi in pois if poi.get("ID") is not None]
+            if len(pois) < STATION_SYNC_MAX_RESULTS or not ids:
+                break
+            params["greaterthanid"] = max(ids)
+
+        self.last_sync = started_at
+        await asyncio.to_thread(self.store.set_state, "last_sync", started_at)
+        logging.info(f"Charging station sync applied {changed} changes")
+        return changed
+
+    async def reload_if_changed(self):
+
+        """
+        Reload the index from the local store if another process advanced the sync watermark.
+
+        Returns:
+        bool: True if the index was reloaded.
+        """
+
+        watermark = await asyncio.to_thread(self.store.get_state, "last_sync")
+        if watermark == self.last_sync:
+            return False
+        records = await asyncio.to_thread(self.store.load)
+        self.index = StationIndex(records, grid_degrees=self.index.grid_degrees)
+        self.last_sync = watermark
+        logging.info(f"Reloaded {len(self.index)} charging stations synced by another worker")
+        return True
+
+    async def run_periodic_sync(self, api_key, interval=STATION_SYNC_SECONDS, leader=None):
+
+        """
+        Sync the mirror every interval seconds until cancelled.
+
+        When several worker processes share the store, only the one holding leader (a LeaderLock) calls the API;
+        the others reload their index once the leader has stored new changes.
+        """
+
+        while True:
+            await asyncio.sleep(interval)
+            if leader is not None and not leader.acquire():
+                await self.reload_if_changed()
+            elif len(self):
+                await self.sync(api_key)
+
+    def query(self, latitude, longitude, radius_km, limit=None):
+
+        """
+        Find the stations within radius_km of a point, nearest first, as station dictionaries.
+
+        At most limit stations are returned when a limit is given.
+        """
+
+        self.queries += 1
+        return [record.to_station_dict() for _, record in self.index.query_radius(latitude, longitude, radius_km)[:limit]]
+
+    def query_corridor(self, points, radius_km, limit=None):
+
+        """
+        Find the stations near a route, as station dictionaries in no particular order.
+
+        Args:
+        points (list): (latitude, longitude) points along the route, at most radius_km apart.
+        radius_km (float): Width of the corridor on each side of the route.
+        limit (int): Maximum number of stations returned.
+
+        Returns:
+        list: Every station within radius_km of the route, plus some slightly further away. Each point is searched
+        with a radius enlarged so that the circles cover the corridor between neighbouring points.
+
+        Every point is searched before the limit is applied. Each station belongs to its nearest point, and when
+        there are more than limit stations the nearest station of every point is kept first, then the second
+        nearest and so on, so the whole length of the route keeps candidates.
+        """
+
+        self.queries += 1
+        found = {}  # station id -> (distance_km, point index, StationRecord)
+        for point_index, (latitude, longitude) in enumerate(points):
+            for distance, record in self.index.query_radius(latitude, longitude, radius_km * 1.12):
+                if record.id not in found or distance < found[record.id][0]:
+                    found[record.id] = (distance, point_index, record)
+        matches = list(found.values())
+        if limit is not None and len(matches) > limit:
+            by_point = {}
+            for match in matches:
+                by_point.setdefault(match[1], []).append(match)
+            ranked = []
+            for point_matches in by_point.values():
+                point_matches.sort(key=lambda match: match[0])
+                ranked.extend((rank, match[0], match) for rank, match in enumerate(point_matches))
+            ranked.sort(key=lambda item: item[:2])
+            matches = [match for _, _, match in ranked[:limit]]
+        return [record.to_station_dict() for _, _, record in matches]
+
+    def stats(self):
+
+        """
+        Return the mirror size, sync watermark and query counter.
+        """
+
+        return {"stations": len(self.index), "last_sync": self.last_sync, "queries": self.queries}
@@ -0,0 +1,196 @@
+# Batched and spatially cached access to current temperatures from Open-Meteo
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import httpx
+
+from providers import get_provider
+
+# Open-Meteo endpoint, configurable to point the navigator at a local fake
+OPEN_METEO_URL = os.getenv('OPEN_METEO_URL', 'https://api.open-meteo.com/v1/forecast')
+
+# Size (in degrees) of the grid cells used to share readings between nearby points (0.05 deg is roughly 5 km)
+TEMPERATURE_GRID_DEGREES = float(os.getenv("TEMPERATURE_GRID_DEGREES", "0.05"))
+# Number of seconds a cached reading stays valid
+TEMPERATURE_CACHE_TTL = float(os.getenv("TEMPERATURE_CACHE_TTL", "900"))
+# Maximum number of grid cells kept in the cache
+TEMPERATURE_CACHE_MAX_ENTRIES = int(os.getenv("TEMPERATURE_CACHE_MAX_ENTRIES", "10000"))
+# Maximum number of locations sent in a single Open-Meteo request
+TEMPERATURE_BATCH_SIZE = int(os.getenv("TEMPERATURE_BATCH_SIZE", "100"))
+
+
+async def fetch_current_temperatures(points):
+
+    """
+    Retrieve the current temperature for many coordinates in a single Open-Meteo request.
+
+    Args:
+    points (list): A list of (latitude, longitude) tuples.
+
+    Returns:
+    list: The current temperature for each point, in the same order. Entries are None when the temperature
+          cannot be fetched.
+
+    Open-Meteo accepts comma-separated coordinate lists and answers with one result per location. Only the
+    current weather block is requested, since the hourly series is never used.
+    """
+
+    if not points:
+        return []
+
+    params = {
+        'latitude': ",".join(str(latitude) for latitude, _ in points),
+        'longitude': ",".join(str(longitude) for _, longitude in points),
+        'current_weather': 'true',
+    }
+
+    try:
+        response = await get_provider("open_meteo").get(OPEN_METEO_URL, params=params)
+        if response.status_code != 200:
+            logging.error(f"Error fetching temperature: {response.json().get('reason')}")
+            return [None] * len(points)
+        data = response.json()
+        # A single location is returned as an object, several locations as a list
+        if isinstance(data, dict):
+            data = [data]
+        return [location['current_weather']['temperature'] for location in data]
+    except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+        logging.error(f"Error occurred during temperature request: {e}")
+        return [None] * len(points)
+
+
+class TemperatureService:
+
+    """
+    Serves current temperatures from a grid-snapped, time-limited cache backed by batched Open-Meteo requests.
+
+    Points are snapped to the centre of a grid cell of TEMPERATURE_GRID_DEGREES, so stations a few kilometres
+    apart share one reading. Missing cells are fetched together in multi-location requests, and concurrent
+    lookups of a cell that is already being fetched wait for that request instead of issuing a new one.
+    """
+
+    def __init__(self, grid_degrees=TEMPERATURE_GRID_DEGREES, ttl=TEMPERATURE_CACHE_TTL,
+                 max_entries=TEMPERATURE_CACHE_MAX_ENTRIES, batch_size=TEMPERATURE_BATCH_SIZE):
+        self.grid_degrees = grid_degrees
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self._cache = OrderedDict()  # cell -> (expires_at, temperature)
+        self._pending = {}  # cell -> future resolved by the request currently fetching it
+        self.hits = 0
+        self.misses = 0
+
+    def snap(self, latitude, longitude):
+
+        """
+        Return the centre of the grid cell containing the given coordinates.
+        """
+
+        size = self.grid_degrees
+        return (round(round(latitude / size) * size, 6), round(round(longitude / size) * size, 6))
+
+    def _cached(self, cell):
+        entry = self._cache.get(cell)
+        if entry is None:
+            return None
+        expires_at, temperature = entry
+        if expires_at < time.monotonic():
+            del self._cache[cell]
+            return None
+        self._cache.move_to_end(cell)
+        return entry
+
+    def _store(self, cell, temperature):
+        self._cache[cell] = (time.monotonic() + self.ttl, temperature)
+        self._cache.move_to_end(cell)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def _fetch(self, cells):
+        loop = asyncio.get_running_loop()
+        futures = {cell: loop.create_future() for cell in cells}
+        self._pending.update(futures)
+        results = {}
+        try:
+            for i in range(0, len(cells), self.batch_size):
+                batch = cells[i:i + self.batch_size]
+                temperatures = await fetch_current_temperatures(batch)
+                for cell, temperature in zip(batch, temperatures):
+                    # Failed readings are not cached so the next request retries them
+                    if temperature is not None:
+                        self._store(cell, temperature)
+                    results[cell] = temperature
+                    futures[cell].set_result(temperature)
+        finally:
+            for cell, future in futures.items():
+                if not future.done():
+                    future.set_result(None)
+                self._pending.pop(cell, None)
+        return results
+
+    async def get_temperatures(self, points):
+
+        """
+        Retrieve the current temperature for many coordinates at once.
+
+        Args:
+        points (list): A list of (latitude, longitude) tuples.
+
+        Returns:
+        list: The current temperature for each point, in the same order, or None for points whose reading is unavailable.
+        """
+
+        cells = [self.snap(latitude, longitude) for latitude, longitude in points]
+        resolved = {}
+        waiting = {}
+        missing = {}  # insertion-ordered set of cells to fetch
+        for cell in cells:
+            if cell in resolved or cell in waiting or cell in missing:
+                continue
+            entry = self._cached(cell)
+            if entry is not None:
+                resolved[cell] = entry[1]
+            elif cell in self._pending:
+                waiting[cell] = self._pending[cell]
+            else:
+                missing[cell] = None
+
+        for cell in cells:
+            if cell in resolved:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if missing:
+            fetched = await self._fetch(list(missing))
+            for cell in missing:
+                resolved[cell] = fetched.get(cell)
+        for cell, future in waiting.items():
+            resolved[cell] = await asyncio.shield(future)
+
+        return [resolved[cell] for cell in cells]
+
+    async def get_temperature(self, latitude, longitude):
+
+        """
+        Retrieve the current temperature for a single coordinate.
+        """
+
+        return (await self.get_temperatures([(latitude, longitude)]))[0]
+
+    def stats(self):
+
+        """
+        Return cache hit/miss counters and the current number of cached grid cells.
+        """
+
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "cached_cells": len(self._cache),
+        }
@@ -0,0 +1,101 @@
+# Small, deterministic corridors checking the charging stop search
+import unittest
+
+import numpy as np
+
+from ev_catalog import EVSpec
+from planner import Corridor, LegCosts, Node, RouteProfile, plan_charging_stops, search_plan
+
+# 50 kWh usable and 200 Wh/km on highways: 1% of charge lasts 2.5 km
+SPEC = EVSpec(
+    "Test EV", 50.0, "Type 2", "CCS", 11.0, None,
+    150.0, 200.0, 180.0, 150.0, 200.0, 180.0, None,
+)
+
+
+def make_corridor(total_km, station_km):
+
+    """
+    Build a straight, all-highway corridor driven at 100 km/h, with a CCS fast charger right on the route at each
+    distance in station_km.
+    """
+
+    point_km = np.linspace(0.0, total_km, int(total_km * 2) + 1)
+    profile = RouteProfile(
+        latitudes=40.0 + point_km / 111.32,
+        longitudes=np.full(len(point_km), -3.0),
+        point_km=point_km,
+        bounds_km=np.array([0.0, total_km]),
+        city_km=np.array([0.0, 0.0]),
+        hours=np.array([0.0, total_km / 100]),
+        total_km=float(total_km),
+    )
+    stations = [
+        {
+            "name": f"Station {km} km",
+            "location": (40.0 + km / 111.32, -3.0),
+            "connections": [{"connection_type": "CCS (Type 2)", "power_kw": 50.0}],
+        }
+        for km in station_km
+    ]
+    return Corridor(
+        profile, stations, np.array(station_km, dtype=float), np.zeros(len(station_km)), [0.0] * (len(station_km) + 2),
+    )
+
+
+def plan(corridor, initial_SOC, **kwargs):
+    temperatures = [20.0] * (len(corridor.stations) + 2)
+    return plan_charging_stops(corridor, SPEC, initial_SOC, temperatures, **kwargs)
+
+
+class PlannerTest(unittest.TestCase):
+
+    def test_destination_reachable_without_stop(self):
+        result = plan(make_corridor(100, [50]), 80)
+        self.assertEqual(result["stops"], [])
+        self.assertAlmostEqual(result["arrival_SOC"], 40.0)
+        self.assertAlmostEqual(result["total_minutes"], 60.0)
+
+    def test_single_required_stop(self):
+        # 80% covers 175 km above the 10% reserve, so the 300 km trip needs the station halfway
+        result = plan(make_corridor(300, [150]), 80)
+        self.assertEqual([stop["name"] for stop in result["stops"]], ["Station 150 km"])
+        stop = result["stops"][0]
+        self.assertAlmostEqual(stop["arrival_SOC"], 20.0)
+        # The remaining 150 km use 60%, so charging to 70% is the fastest way to arrive with the reserve
+        self.assertAlmostEqual(stop["departure_SOC"], 70.0)
+        self.assertAlmostEqual(result["arrival_SOC"], 10.0)
+        self.assertTrue(stop["fast_charging"])
+
+    def test_infeasible_route(self):
+        # From the only station, 90% covers 200 km above the reserve, short of the remaining 450 km
+        self.assertIsNone(plan(make_corridor(600, [150]), 80))
+        self.assertIsNone(plan(make_corridor(300, []), 80))
+
+    def test_min_arrival_soc_respected(self):
+        corridor = make_corridor(100, [50])
+        self.assertEqual(plan(corridor, 60)["stops"], [])
+
+        result = plan(corridor, 60, min_arrival_SOC=30)
+        self.assertEqual(len(result["stops"]), 1)
+        self.assertGreaterEqual(result["stops"][0]["arrival_SOC"], 30)
+        self.assertGreaterEqual(result["arrival_SOC"], 30)
+
+        self.assertIsNone(plan(corridor, 60, min_arrival_SOC=45))
+
+    def test_search_plan_steps(self):
+        corridor = make_corridor(300, [100, 150, 200])
+        nodes = [Node(0.0, 0.0, 0.0, False)] + [
+            Node(km, 0.0, 50.0, True, station) for km, station in zip(corridor.route_km, corridor.stations)
+        ] + [Node(300.0, 0.0, 0.0, False)]
+        costs = LegCosts(nodes, corridor.profile, [0.0] * len(nodes), [20.0] * len(nodes), SPEC)
+        steps, hours, _ = search_plan(nodes, costs, 80, min_arrival_SOC=10)
+        self.assertEqual(steps[0], (0, 80, 80))
+        self.assertEqual(steps[-1][0], len(nodes) - 1)
+        self.assertEqual(len(steps), 3)
+        self.assertGreaterEqual(min(arrival for _, arrival, _ in steps), 10)
+        self.assertGreater(hours, 3.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+# Checks that the vectorized soc_engine gives the same SoC as calculate_soc, the reference implementation
+import math
+import unittest
+
+from ev_catalog import EVSpec
+from main import analyze_route, calculate_soc
+from soc_engine import compute_soc, soc_for_legs
+
+
+def make_spec(weight=2000.0, useable_capacity=75.0):
+    return EVSpec(
+        "Test EV", useable_capacity, "Type 2", "CCS", 11.0, 50.0,
+        180.0, 220.0, 200.0, 130.0, 170.0, 150.0, weight,
+    )
+
+
+def make_route_data(segments):
+
+    """
+    Build a Bing Maps route response from (road type, distance km) segments; a road type of None is a ferry segment,
+    which has no driving details.
+    """
+
+    items = []
+    for road_type, distance in segments:
+        details = [{"mode": "Ferry"}] if road_type is None else [{"mode": "Driving", "roadType": road_type}]
+        items.append({"travelDistance": distance, "details": details})
+    return {
+        "resourceSets": [{
+            "resources": [{
+                "travelDistance": sum(distance for _, distance in segments),
+                "travelDuration": 3600,
+                "trafficCongestion": "Mild",
+                "routeLegs": [{"itineraryItems": items}],
+            }],
+        }],
+    }
+
+
+MIXED_ROUTE = make_route_data([
+    ("LimitedAccessHighway", 42.317), ("Highway", 12.5), ("Ramp", 0.834), ("Arterial", 7.25),
+    ("MajorRoad", 3.1), ("Street", 4.444), ("LocalRoad", 1.009),
+])
+CITY_ROUTE = make_route_data([("Street", 2.2), ("LocalRoad", 0.75)])
+FERRY_ROUTE = make_route_data([("Highway", 20.0), (None, 35.0), ("Street", 3.3)])
+UNKNOWN_ROUTE = make_route_data([("MajorRoad", 8.0), ("Unknown", 6.5), ("Bridleway", 1.2), ("LocalRoad", 0.4)])
+
+# (altitude change, temperature, total ascent) of the legs compared, covering cold and mild rates, climbs and descents
+LEG_CONDITIONS = [
+    (120.0, 4.0, None),
+    (-80.0, 18.0, None),
+    (0.0, 10.0, None),
+    (-15.0, 9.9, 240.0),
+    (35.0, 25.0, 0.0),
+]
+
+
+class SocEngineTest(unittest.TestCase):
+
+    def assert_same_soc(self, spec, initial_SOC, route_data, altitude_change, temperature, total_ascent):
+        route_info, _ = analyze_route(route_data)
+        expected = calculate_soc(
+            altitude_change, spec.useable_capacity, spec.weight, initial_SOC, temperature, route_info, spec.rates(),
+            total_ascent,
+        )
+        (actual,) = soc_for_legs(spec, initial_SOC, [route_info], [altitude_change], [temperature], [total_ascent])
+        if expected == (None, None):
+            self.assertEqual(actual, (None, None))
+            return
+        self.assertIsNotNone(actual[0])
+        for expected_value, actual_value in zip(expected, actual):
+            self.assertAlmostEqual(expected_value, actual_value, places=9)
+
+    def test_mixed_segment_legs(self):
+        spec = make_spec()
+        for route_data in (MIXED_ROUTE, CITY_ROUTE):
+            for initial_SOC in (15, 80):
+                for altitude_change, temperature, total_ascent in LEG_CONDITIONS:
+                    with self.subTest(initial_SOC=initial_SOC, altitude_change=altitude_change, temperature=temperature):
+                        self.assert_same_soc(spec, initial_SOC, route_data, altitude_change, temperature, total_ascent)
+
+    def test_ferry_and_unknown_segments(self):
+        # Segments that are not driven on a known road type count no energy in either implementation
+        spec = make_spec()
+        for route_data in (FERRY_ROUTE, UNKNOWN_ROUTE):
+            for altitude_change, temperature, total_ascent in LEG_CONDITIONS:
+                with self.subTest(altitude_change=altitude_change, temperature=temperature):
+                    self.assert_same_soc(spec, 60, route_data, altitude_change, temperature, total_ascent)
+
+    def test_missing_weight(self):
+        for weight in (None, math.nan):
+            spec = make_spec(weight=weight)
+            for altitude_change, temperature, total_ascent in LEG_CONDITIONS:
+                with self.subTest(weight=weight, altitude_change=altitude_change, total_ascent=total_ascent):
+                    self.assert_same_soc(spec, 60, MIXED_ROUTE, altitude_change, temperature, total_ascent)
+                    self.assertEqual(
+                        soc_for_legs(spec, 60, [analyze_route(MIXED_ROUTE)[0]], [altitude_change], [temperature], [total_ascent]),
+                        [(None, None)],
+                    )
+
+    def test_missing_route_and_temperature(self):
+        spec = make_spec()
+        route_info, _ = analyze_route(MIXED_ROUTE)
+        self.assertEqual(soc_for_legs(spec, 60, [None], [10.0], [15.0]), [(None, None)])
+        self.assertEqual(soc_for_legs(spec, 60, [route_info], [10.0], [None]), [(None, None)])
+
+    def test_broadcasts_models_against_legs(self):
+        route_info, _ = analyze_route(MIXED_ROUTE)
+        final_SOC, adjusted_SOC = compute_soc(
+            [[100.0]], [[50.0], [75.0]], [[1800.0], [2200.0]], 70, [5.0, 20.0], [60.0, 60.0], [5.0, 5.0],
+            [[180.0], [180.0]], [[220.0], [220.0]], [[130.0], [130.0]], [[170.0], [170.0]],
+        )
+        self.assertEqual(final_SOC.shape, (2, 2))
+        self.assertEqual(adjusted_SOC.shape, (2, 2))
+        self.assertTrue((adjusted_SOC < final_SOC).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+# Per-request stage timings, reported to callers through the Server-Timing response header
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Header carrying the request ID from the gateway, echoed back on every response
+REQUEST_ID_HEADER = "X-Request-ID"
+# Log format including the ID of the request a message was logged for ("-" outside of requests)
+REQUEST_LOG_FORMAT = "%(levelname)s:%(name)s:[%(request_id)s] %(message)s"
+# Requests taking at least this many seconds get a structured log line with their stage timings; negative disables it
+TIMING_LOG_THRESHOLD_SECONDS = float(os.getenv("TIMING_LOG_THRESHOLD_SECONDS", "0"))
+
+# Incoming request IDs are only reused if they are short and printable, otherwise a new one is generated
+_VALID_REQUEST_ID = re.compile(r"^[\w.:-]{1,128}$")
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+
+    """
+    Accumulated time spent in each named stage of one request.
+
+    Tasks and worker threads started while handling the request inherit it through a context variable, so stages
+    running concurrently (e.g. one provider call per station) add up under the same name.
+    """
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.stages = {}  # stage -> [seconds, count]
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def snapshot(self):
+
+        """
+        Return a copy of the stages as {stage: (seconds, count)}.
+        """
+
+        with self._lock:
+            return {stage: (seconds, count) for stage, (seconds, count) in self.stages.items()}
+
+    def server_timing(self):
+
+        """
+        Format the stages as a Server-Timing header value, durations in milliseconds.
+        """
+
+        return ", ".join(f'{stage};dur={seconds * 1000:.1f};desc="{count}"' for stage, (seconds, count) in self.snapshot().items())
+
+    def log(self, endpoint, status, threshold=TIMING_LOG_THRESHOLD_SECONDS):
+
+        """
+        Log the stage timings of the finished request as one JSON line, if it took at least threshold seconds.
+        """
+
+        elapsed = self.elapsed()
+        if threshold < 0 or elapsed < threshold:
+            return
+        logging.info(json.dumps({
+            "event": "request_timings",
+            "request_id": self.request_id,
+            "endpoint": endpoint,
+            "status": status,
+            "duration_ms": round(elapsed * 1000, 1),
+            "stages": {stage: {"duration_ms": round(seconds * 1000, 1), "count": count} for stage, (seconds, count) in self.snapshot().items()},
+        }))
+
+
+def begin_request(request_id=None):
+
+    """
+    Start collecting stage timings for the current request.
+
+    Args:
+    request_id (str): The ID received from the caller; a new one is generated if it is missing or malformed.
+
+    Returns:
+    RequestTimings: The timings of the request.
+    """
+
+    if request_id is not None and not _VALID_REQUEST_ID.match(request_id):
+        request_id = None
+    timings = RequestTimings(request_id)
+    _current.set(timings)
+    return timings
+
+
+def current_timings():
+
+    """
+    Return the timings of the request being handled, or None outside of a request.
+    """
+
+    return _current.get()
+
+
+@contextmanager
+def timed(stage):
+
+    """
+    Add the time spent in the with block to the given stage of the current request.
+    """
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _current.get()
+        if timings is not None:
+            timings.add(stage, time.perf_counter() - started)
+
+
+_record_factory = logging.getLogRecordFactory()
+
+
+def _request_log_record(*args, **kwargs):
+    # Every log record carries the current request ID, so REQUEST_LOG_FORMAT works for all loggers
+    record = _record_factory(*args, **kwargs)
+    timings = _current.get()
+    if timings is not None or not hasattr(record, "request_id"):
+        record.request_id = timings.request_id if timings is not None else "-"
+    return record
+
+
+logging.setLogRecordFactory(_request_log_record)
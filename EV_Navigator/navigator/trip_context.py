@@ -0,0 +1,222 @@
+# Bounded store of the model-independent parts of computed trips, for SoC what-if recomputation
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import NamedTuple
+
+from workers import connect_shared_sqlite
+
+# Seconds a trip context can be reused after the trip was computed
+TRIP_CONTEXT_TTL = float(os.getenv("TRIP_CONTEXT_TTL", "1800"))
+# Maximum number of trip contexts kept
+TRIP_CONTEXT_MAX_ENTRIES = int(os.getenv("TRIP_CONTEXT_MAX_ENTRIES", "1000"))
+# Trip context backend: "memory" (per process) or "disk" (SQLite, shared by all workers on the host)
+TRIP_CONTEXT_BACKEND = os.getenv("TRIP_CONTEXT_BACKEND", "memory")
+# Location of the SQLite trip context store used by the disk backend
+TRIP_CONTEXT_PATH = os.getenv("TRIP_CONTEXT_PATH", os.path.join("cache", "trip_contexts.sqlite3"))
+
+
+class TripContext(NamedTuple):
+
+    """
+    Everything a trip fetched that does not depend on ev_model or initial_SOC.
+
+    charging_stations is the whole candidate pool, nearest to the destination first, so another EV model can select
+    its own candidates from it. evaluated_stations, walking and temperatures hold one entry per charging station, in
+    station order, with None for stations that have not been evaluated yet.
+    """
+
+    origin_coordinates: str
+    destination_coordinates: str
+    charging_stations: list
+    evaluated_stations: list
+    walking: list
+    temperatures: list
+    temperature_origin: float = None
+
+
+class MemoryTripContextBackend:
+
+    """
+    In-process LRU store of trip contexts with per-entry expiry.
+    """
+
+    def __init__(self, max_entries=TRIP_CONTEXT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # context_id -> (expires_at, context)
+
+    async def get(self, context_id):
+        entry = self._entries.get(context_id)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self._entries[context_id]
+            return None
+        self._entries.move_to_end(context_id)
+        return entry[1]
+
+    async def put(self, context_id, context, ttl):
+        self._entries[context_id] = (time.time() + ttl, context)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def size(self):
+        return len(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskTripContextBackend:
+
+    """
+    SQLite store of trip contexts with per-entry expiry, readable by every worker process on the host.
+    """
+
+    def __init__(self, path=TRIP_CONTEXT_PATH, max_entries=TRIP_CONTEXT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._writes = 0
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Opened on first use rather than when the backend is built at import time; called with the lock held
+        if self._connection is None:
+            self._connection = connect_shared_sqlite(self.path)
+            with self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS trip_contexts (context_id TEXT PRIMARY KEY, expires_at REAL NOT NULL, context TEXT NOT NULL)"
+                )
+                self._connection.execute("CREATE INDEX IF NOT EXISTS trip_contexts_expires_at ON trip_contexts (expires_at)")
+        return self._connection
+
+    def _get(self, context_id):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT context FROM trip_contexts WHERE context_id = ? AND expires_at >= ?", (context_id, time.time())
+            ).fetchone()
+        return TripContext(**json.loads(row[0])) if row else None
+
+    def _put(self, context_id, context, ttl):
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO trip_contexts (context_id, expires_at, context) VALUES (?, ?, ?)",
+                (context_id, time.time() + ttl, json.dumps(context._asdict())),
+            )
+            self._writes += 1
+            # Trim periodically rather than on every write
+            if self._writes % 100 == 0:
+                connection.execute("DELETE FROM trip_contexts WHERE expires_at < ?", (time.time(),))
+                connection.execute(
+                    "DELETE FROM trip_contexts WHERE context_id IN "
+                    "(SELECT context_id FROM trip_contexts ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+    async def get(self, context_id):
+        return await asyncio.to_thread(self._get, context_id)
+
+    async def put(self, context_id, context, ttl):
+        await asyncio.to_thread(self._put, context_id, context, ttl)
+
+    async def size(self):
+        # Counting the rows scans the table, so it runs in a worker thread like the other queries
+        return await asyncio.to_thread(len, self)
+
+    def __len__(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM trip_contexts").fetchone()[0]
+
+
+def create_trip_context_backend(name=TRIP_CONTEXT_BACKEND):
+
+    """
+    Build the trip context backend selected by name ("memory" or "disk").
+    """
+
+    if name == "disk":
+        return DiskTripContextBackend()
+    if name != "memory":
+        logging.warning(f"Unknown trip context backend '{name}', using the in-memory backend.")
+    return MemoryTripContextBackend()
+
+
+class TripContextStore:
+
+    """
+    Bounded store of trip contexts with a fixed time to live.
+
+    With the memory backend contexts are kept per process, so with several workers a what-if request must reach
+    the worker that computed the trip; otherwise it is answered as an expired context. The disk backend shares
+    contexts between the workers of a host.
+    """
+
+    def __init__(self, backend=None, ttl=TRIP_CONTEXT_TTL):
+        self.backend = backend if backend is not None else create_trip_context_backend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def put(self, context):
+
+        """
+        Store a trip context.
+
+        Returns:
+        str: The handle under which the context can be retrieved, or None if it could not be stored.
+        """
+
+        context_id = uuid.uuid4().hex
+        try:
+            await self.backend.put(context_id, context, self.ttl)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logging.error(f"Could not store trip context: {e}")
+            return None
+        return context_id
+
+    async def replace(self, context_id, context):
+
+        """
+        Store a trip context under an existing handle, e.g. after evaluating more of its stations, restarting its
+        time to live.
+        """
+
+        try:
+            await self.backend.put(context_id, context, self.ttl)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logging.error(f"Could not store trip context: {e}")
+
+    async def get(self, context_id):
+
+        """
+        Return the trip context stored under context_id, or None if it is unknown or expired.
+        """
+
+        try:
+            context = await self.backend.get(context_id)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logging.error(f"Trip context read failed: {e}")
+            context = None
+        if context is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return context
+
+    def __len__(self):
+        return len(self.backend)
+
+    async def stats(self):
+
+        """
+        Return hit/miss counters and the number of stored contexts.
+        """
+
+        return {"hits": self.hits, "misses": self.misses, "entries": await self.backend.size()}
@@ -0,0 +1,119 @@
+# Bounded thread pool for blocking work and coordination between navigator worker processes
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of worker processes serving the navigator; uvicorn's --workers defaults to the same variable
+NAVIGATOR_WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+# Threads per worker for blocking work run with asyncio.to_thread: geocoding, MySQL queries and SQLite caches.
+# Calls beyond this limit queue up instead of starting more threads
+NAVIGATOR_THREAD_POOL_SIZE = int(os.getenv("NAVIGATOR_THREAD_POOL_SIZE", "16"))
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, where every worker acts as leader
+    fcntl = None
+
+_executor = None
+
+
+def install_thread_pool(size=NAVIGATOR_THREAD_POOL_SIZE):
+
+    """
+    Make a bounded thread pool the default executor of the running event loop, so every asyncio.to_thread call of
+    the worker shares size threads.
+
+    Returns:
+    ThreadPoolExecutor: The installed pool.
+    """
+
+    global _executor
+    _executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="navigator-worker")
+    asyncio.get_running_loop().set_default_executor(_executor)
+    return _executor
+
+
+def shutdown_thread_pool():
+
+    """
+    Stop the thread pool installed by install_thread_pool, without waiting for queued work.
+    """
+
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+def connect_shared_sqlite(path, attempts=10):
+
+    """
+    Open a SQLite database that several threads and worker processes read and write, in WAL mode.
+
+    Workers starting at the same time may race to create the file and switch its journal mode, which fails with
+    "database is locked" instead of waiting, so the switch is retried.
+
+    Returns:
+    sqlite3.Connection: A connection usable from any thread, guarded by the caller's lock.
+    """
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    for attempt in range(attempts):
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            return connection
+        except sqlite3.OperationalError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.1 * (attempt + 1))
+
+
+class LeaderLock:
+
+    """
+    Non-blocking lock file electing one worker process for jobs that must run only once per host, such as the
+    charging station mirror sync.
+
+    The lock is held until the process exits, so another worker takes over the next time it tries after the
+    leader stopped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+
+        """
+        Return True if this process is (or just became) the leader.
+        """
+
+        if self._file is not None or fcntl is None:
+            return True
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lock_file = open(self.path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        logging.info(f"Worker {os.getpid()} holds {self.path}")
+        return True
+
+
+def worker_stats():
+
+    """
+    Return the worker process ID, the number of workers and the thread pool size.
+    """
+
+    return {"pid": os.getpid(), "workers": NAVIGATOR_WORKERS, "thread_pool_size": NAVIGATOR_THREAD_POOL_SIZE}